@@ -0,0 +1,17 @@
+"""
+Gunicorn settings; gunicorn reads ./gunicorn.conf.py on its own.
+
+The app is served over ASGI (project.asgi) by uvicorn workers, so the async
+endpoints in instaky/async_views.py run on an event loop and overlap their
+queries and other clients' requests. The DRF views keep working under ASGI;
+Django runs them on one thread per worker, as a sync worker would.
+
+Heroku sets WEB_CONCURRENCY from the dyno size and PORT, which gunicorn
+binds to by itself. Set GUNICORN_WORKER_CLASS=sync with project.wsgi to go
+back to plain sync workers.
+"""
+
+import os
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
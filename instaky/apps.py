@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class InstakyConfig(AppConfig):
     name = 'instaky'
+
+    def ready(self):
+        from . import search, signals  # noqa: F401
+
+        post_migrate.connect(search.install, sender=self)
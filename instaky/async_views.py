@@ -0,0 +1,194 @@
+"""
+Async versions of the read-heavy feed and user endpoints, for ASGI servers.
+
+    GET /async/cards/all/ /async/cards/mine/ /async/cards/following/
+    GET /async/users/:id/ /async/users/:id/cards/
+
+return what the DRF views at the same paths without the /async prefix
+return, query parameters included, but a page's independent queries run at
+the same time instead of one after another: a feed fetches its page of cards
+first and then the like state and the comment previews of those cards side
+by side, the following feed fetches cards, likes and previews for the ids on
+its timeline page all at once, and a user's card list looks the user up
+while it fetches the cards. Responses are always JSON and skip the response
+cache, so they measure the database path; see bench_async for a comparison
+with the sync views under concurrent clients.
+
+Django 3.1 has no async ORM, so ORM code runs in threads through asgiref's
+sync_to_async. With ASYNC_CONCURRENT_QUERIES each call gets a worker thread,
+and with it a database connection, of its own; without it the calls take
+turns on the single thread Django runs sync code in, which is what tests
+need to see the data of their transaction. DRF 3.12 has no async views
+either: these are plain Django views that authenticate with DRF's
+authentication classes and report errors the way DRF's exception handler
+does.
+"""
+
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+from users.models import User
+
+from . import feed, metrics, replicas, timeline
+from .models import Card
+from .pagination import CardCursorPagination
+from .renderers import FastJSONRenderer
+from .views import UserViewSet
+
+
+def in_worker(function):
+    """Run ``function`` in a worker thread of the executor."""
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        metrics.instrument()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            # Worker threads never see request_finished; honour CONN_MAX_AGE.
+            close_old_connections()
+
+    return run
+
+
+def database(function, *args, **kwargs):
+    """Awaitable for a call to sync (ORM) code."""
+    if settings.ASYNC_CONCURRENT_QUERIES:
+        return sync_to_async(in_worker(function), thread_sensitive=False)(
+            *args, **kwargs
+        )
+    return sync_to_async(function, thread_sensitive=True)(*args, **kwargs)
+
+
+def authenticate(request):
+    """Wrap ``request`` for DRF and require an authenticated user."""
+    authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    request = Request(request, authenticators=authenticators)
+    try:
+        if not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+    except (exceptions.NotAuthenticated, exceptions.AuthenticationFailed) as exc:
+        # As APIView does: a 401 names the scheme to authenticate with.
+        exc.auth_header = authenticators[0].authenticate_header(request)
+        raise
+    return request
+
+
+def render(data, status=200, headers=None):
+    response = HttpResponse(
+        FastJSONRenderer().render(data),
+        content_type="application/json",
+        status=status,
+    )
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
+
+
+def api_endpoint(view):
+    """
+    Authenticate, pick the database to read from (see replicas.py), call the
+    async ``view`` and render the data it returns.
+    """
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            request = await database(authenticate, request)
+            replicas.reads.set(await database(replicas.read_database, request.user))
+            data = await view(request, *args, **kwargs)
+        except (exceptions.APIException, Http404) as exc:
+            response = exception_handler(exc, {"request": request})
+            headers = {
+                name: response[name]
+                for name in ("WWW-Authenticate", "Retry-After")
+                if response.has_header(name)
+            }
+            return render(response.data, response.status_code, headers)
+        return render(data)
+
+    return wrapper
+
+
+async def serialize(serializer, rows):
+    """CardFeedSerializer.serialize(), fetching likes and previews at once."""
+    ids = [row["id"] for row in rows]
+    liked, recent = await asyncio.gather(
+        database(serializer.liked_ids, ids), database(serializer.recent_comments, ids)
+    )
+    return serializer.render(rows, liked, recent)
+
+
+async def feed_page(request, cards):
+    serializer = feed.CardFeedSerializer(request)
+    paginator = CardCursorPagination()
+    page = await database(paginator.paginate_queryset, serializer.rows(cards), request)
+    return paginator.get_paginated_response(await serialize(serializer, page)).data
+
+
+@api_endpoint
+async def cards_all(request):
+    return await feed_page(request, Card.objects.all())
+
+
+@api_endpoint
+async def cards_mine(request):
+    return await feed_page(request, Card.objects.filter(user=request.user))
+
+
+@api_endpoint
+async def cards_following(request):
+    serializer = feed.CardFeedSerializer(request)
+    paginator = CardCursorPagination()
+
+    def entries():
+        timeline_entries = timeline.timeline_for(request.user).values(
+            "id", "posted_at", "card_id"
+        )
+        return paginator.paginate_queryset(timeline_entries, request)
+
+    ids = [entry["card_id"] for entry in await database(entries)]
+    cards = serializer.rows(Card.objects.filter(id__in=ids))
+    rows, liked, recent = await asyncio.gather(
+        database(list, cards),
+        database(serializer.liked_ids, ids),
+        database(serializer.recent_comments, ids),
+    )
+    rows = {row["id"]: row for row in rows}
+    ordered = [rows[card_id] for card_id in ids if card_id in rows]
+    return paginator.get_paginated_response(
+        serializer.render(ordered, liked, recent)
+    ).data
+
+
+@api_endpoint
+async def user_detail(request, pk):
+    view = UserViewSet(request=request, args=(), kwargs={"pk": pk}, action="retrieve")
+    view.format_kwarg = None
+
+    def data():
+        user = get_object_or_404(view.get_queryset(), pk=pk)
+        return view.get_serializer(user).data
+
+    return await database(data)
+
+
+@api_endpoint
+async def user_cards(request, pk):
+    serializer = feed.CardFeedSerializer(request)
+    paginator = CardCursorPagination()
+    cards = serializer.rows(Card.objects.filter(user_id=pk))
+    _, page = await asyncio.gather(
+        database(get_object_or_404, User.objects.all(), pk=pk),
+        database(paginator.paginate_queryset, cards, request),
+    )
+    return paginator.get_paginated_response(await serialize(serializer, page)).data
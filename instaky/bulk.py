@@ -0,0 +1,83 @@
+"""
+Creating many cards at once.
+
+POST /cards/ with a JSON list of cards instead of a single one creates up to
+BULK_CREATE_MAX_CARDS of them in one request, and the import_cards command
+reads any number from an NDJSON file. Each card is validated with the rules
+of CardSerializer; the valid ones are inserted with bulk_create(),
+BULK_CREATE_BATCH_SIZE rows per INSERT, in one transaction, and fanned out
+to followers' timelines with a query per batch rather than per card. Every
+row gets a result, in the order given: {"id": ...} for a card that was
+created, {"errors": {...}} for one that was not.
+
+bulk_create() skips the signals a save() sends, so the response cache is
+bumped here.
+"""
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from rest_framework.exceptions import ValidationError
+
+from . import cache, events, timeline
+from .models import Card
+from .serializers import CardSerializer
+
+
+def validate(serializer, data):
+    """The validated data for one card, or the errors that rejected it."""
+    if not isinstance(data, dict):
+        return None, {"non_field_errors": ["Expected an object of card fields."]}
+    try:
+        return serializer.run_validation(data), None
+    except ValidationError as exc:
+        return None, exc.detail
+
+
+def insert(cards):
+    """Insert ``cards`` in batches and set their ids."""
+    db = connections[router.db_for_write(Card)]
+    batch_size = settings.BULK_CREATE_BATCH_SIZE
+    if db.features.can_return_rows_from_bulk_insert:
+        Card.objects.using(db.alias).bulk_create(cards, batch_size=batch_size)
+    elif db.vendor == "sqlite":
+        # SQLite lets one transaction write at a time and numbers rows with
+        # AUTOINCREMENT, so the rows just inserted are the ones with the
+        # highest ids.
+        Card.objects.using(db.alias).bulk_create(cards, batch_size=batch_size)
+        ids = Card.objects.using(db.alias).order_by("-pk").values_list("pk", flat=True)
+        for card, pk in zip(cards, reversed(list(ids[: len(cards)]))):
+            card.pk = pk
+    else:
+        # nothing tells which ids a multi-row INSERT took
+        for card in cards:
+            card.save(force_insert=True, using=db.alias)
+
+
+def create_cards(entries, context=None, publish=True):
+    """
+    Create a card for each (user, data) pair of ``entries``. Returns a result
+    per entry. ``publish`` sends the new cards to followers' event streams.
+    """
+    serializer = CardSerializer(context=context or {})
+    results, cards = [], []
+    for user, data in entries:
+        validated, errors = validate(serializer, data)
+        if errors:
+            results.append({"errors": errors})
+            continue
+        card = Card(user=user, **validated)
+        results.append(card)
+        cards.append(card)
+
+    if cards:
+        with transaction.atomic():
+            insert(cards)
+            timeline.fan_out_many(cards)
+            cache.bump_cards((card.id, card.user_id) for card in cards)
+            if publish:
+                for card in cards:
+                    events.card_created(card)
+
+    return [
+        {"id": result.id} if isinstance(result, Card) else result for result in results
+    ]
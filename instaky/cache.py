@@ -0,0 +1,190 @@
+"""
+Versioned response cache for CardViewSet.
+
+Every cached response depends on one or more version keys ("scopes"):
+
+    cards               anything about any card changed
+    card:<id>           that card, its comments or its likes changed
+    user-cards:<id>     a card posted by that user changed
+
+signals.py bumps the scopes a write touches. Response keys and ETags are
+derived from the request URL, the requesting user and the current scope
+versions, so a bump makes every dependent response unreachable at once
+instead of deleting them one by one; stale entries simply age out. Versions
+are random rather than counters, so that none comes back after the store
+loses it (an eviction, a restart, a deploy onto an empty cache).
+
+The store is whichever Django cache FEED_CACHE_ALIAS names: local memory in
+development and tests, Redis (CACHE_URL=redis://...) in production.
+
+With read replicas (see replicas.py), a response built right after a bump may
+come from a replica that has not seen the write yet. Bumps are remembered for
+REPLICA_LAG_SECONDS, and a response read from a replica within that window of
+a bump to one of its scopes is only cached for as long.
+"""
+
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from rest_framework.response import Response
+
+from . import replicas
+
+HITS_KEY = "response-cache:hits"
+MISSES_KEY = "response-cache:misses"
+
+
+def backend():
+    return caches[settings.FEED_CACHE_ALIAS]
+
+
+def version_key(scope):
+    return f"response-cache:version:{scope}"
+
+
+def bumped_key(scope):
+    return f"response-cache:bumped:{scope}"
+
+
+def _incr(key):
+    store = backend()
+    store.add(key, 0, timeout=None)
+    try:
+        return store.incr(key)
+    except ValueError:
+        # evicted between add() and incr()
+        store.set(key, 1, timeout=None)
+        return 1
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+def versions(scopes):
+    store = backend()
+    keys = [version_key(scope) for scope in scopes]
+    found = store.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        # Never start over from a number an evicted version already had: the
+        # ETags and cached bodies of that round would match again.
+        fresh = {key: new_version() for key in missing}
+        for key, version in fresh.items():
+            store.add(key, version, timeout=None)
+        found.update(fresh)
+        # another request may have added its own version first
+        found.update(store.get_many(missing))
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """Invalidate every response that depends on any of ``scopes``."""
+
+    def run():
+        backend().set_many(
+            {version_key(scope): new_version() for scope in scopes}, timeout=None
+        )
+        if settings.DATABASE_REPLICAS and settings.REPLICA_LAG_SECONDS:
+            backend().set_many(
+                {bumped_key(scope): True for scope in scopes},
+                settings.REPLICA_LAG_SECONDS,
+            )
+
+    # Bumping before the write is visible would let a concurrent request cache
+    # the old rows under the new version.
+    transaction.on_commit(run)
+
+
+def bump_cards(cards):
+    """Bump the scopes for an iterable of (card id, author id) pairs."""
+    scopes = {"cards"}
+    for card_id, user_id in cards:
+        scopes.add(f"card:{card_id}")
+        scopes.add(f"user-cards:{user_id}")
+    bump(*sorted(scopes))
+
+
+def timeout(scopes):
+    """How long a response that depends on ``scopes`` may be cached."""
+    if replicas.reads.get() is not None and backend().get_many(
+        [bumped_key(scope) for scope in scopes]
+    ):
+        # the replica may not have the write behind the bump yet
+        return min(settings.FEED_CACHE_TIMEOUT, settings.REPLICA_LAG_SECONDS)
+    return settings.FEED_CACHE_TIMEOUT
+
+
+def stats():
+    found = backend().get_many([HITS_KEY, MISSES_KEY])
+    return {"hits": found.get(HITS_KEY, 0), "misses": found.get(MISSES_KEY, 0)}
+
+
+def fingerprint(request, scopes, personal):
+    parts = [request.build_absolute_uri(), request.accepted_media_type or ""]
+    if personal:
+        parts.append(f"user:{request.user.id}")
+    parts += [f"{scope}={version}" for scope, version in zip(scopes, versions(scopes))]
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+def weak(etag):
+    return etag[2:] if etag.startswith("W/") else etag
+
+
+def etag_matches(request, etag):
+    # a weak comparison: compression.py weakens the ETags it compresses
+    header = request.META.get("HTTP_IF_NONE_MATCH", "")
+    tags = [weak(tag.strip()) for tag in header.split(",")]
+    return header.strip() == "*" or weak(etag) in tags
+
+
+def cache_response(scopes, personal=True):
+    """
+    Cache a viewset action's response data under the given version scopes.
+
+    ``scopes`` is called with the view's request and URL kwargs and returns
+    the scope names the response depends on. Responses that include
+    per-user data (e.g. the "liked" flag in feeds) must stay ``personal``.
+    """
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            names = scopes(request, **kwargs)
+            digest = fingerprint(request, names, personal)
+            etag = f'"{digest}"'
+
+            if etag_matches(request, etag):
+                _incr(HITS_KEY)
+                response = Response(status=304)
+                outcome = "HIT"
+            else:
+                key = f"response-cache:{digest}"
+                cached = backend().get(key)
+                if cached is not None:
+                    _incr(HITS_KEY)
+                    response = Response(cached)
+                    outcome = "HIT"
+                else:
+                    _incr(MISSES_KEY)
+                    response = method(view, request, *args, **kwargs)
+                    if response.status_code != 200:
+                        return response
+                    backend().set(key, response.data, timeout(names))
+                    outcome = "MISS"
+
+            response["ETag"] = etag
+            response["X-Cache"] = outcome
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ["Authorization", "Cookie"])
+            return response
+
+        return wrapper
+
+    return decorator
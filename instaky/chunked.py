@@ -0,0 +1,227 @@
+"""
+Resumable chunked uploads for card images and profile pictures.
+
+    POST /cards/:id/image_resumable/    {"filename", "content_type", "size"}
+        -> {"id", "url", "offset": 0, "size"}
+    HEAD/GET <url>                       -> current offset, to resume after a drop
+    PUT <url>                            one chunk, with headers
+        Upload-Offset: <offset the chunk starts at>
+        Upload-Checksum: sha256 <base64 digest of the chunk>   (optional)
+    POST <url>complete/                  attach the assembled file
+
+(and the same on /users/:id/ for profile pictures).
+
+Chunks are streamed from the request straight into a spool file under
+CHUNKED_UPLOAD_DIR in fixed-size reads, so a worker's memory use does not
+depend on the size of the file or of the chunk. A chunk that fails its
+checksum is truncated away and can simply be sent again. Every worker has to
+see the same CHUNKED_UPLOAD_DIR; a worker that finds no spool file for an
+upload starts it over from offset 0, so the client is told to resend the
+whole file (409, with the offset) rather than failing; so does one whose
+spool file is shorter than the bytes received so far. Size and type limits
+are checked when the upload starts, on every chunk, and once more by opening
+the assembled file as an image before it is moved into the content-addressed
+store (see content.py).
+"""
+
+import base64
+import hashlib
+import os
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import APIException, ValidationError
+
+from . import content
+from .models import ChunkedUpload
+from .uploads import check_content_type
+
+READ_SIZE = 64 * 1024
+
+PILLOW_CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+
+class OffsetConflict(APIException):
+    status_code = 409
+    default_detail = "Upload-Offset does not match the bytes received so far."
+    default_code = "offset_conflict"
+
+    def __init__(self, upload):
+        super().__init__()
+        self.upload = upload
+
+
+def spool_path(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{upload.id}.part")
+
+
+def start(user, instance, field_name, filename, content_type, size):
+    check_content_type(content_type)
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ValidationError({"size": "A total size in bytes is required"})
+    if not 0 < size <= settings.UPLOAD_MAX_BYTES:
+        raise ValidationError({"size": f"Must be 1 to {settings.UPLOAD_MAX_BYTES}"})
+
+    upload = ChunkedUpload.objects.create(
+        user=user,
+        target=instance._meta.label,
+        target_pk=instance.pk,
+        field=field_name,
+        filename=os.path.basename(filename or "upload"),
+        content_type=content_type,
+        size=size,
+    )
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(spool_path(upload), "wb").close()
+    return upload
+
+
+def parse_checksum(header):
+    if not header:
+        return None
+    algorithm, _, digest = header.partition(" ")
+    if algorithm.lower() != "sha256":
+        raise ValidationError({"checksum": "Only sha256 checksums are supported"})
+    try:
+        return base64.b64decode(digest, validate=True)
+    except ValueError:
+        raise ValidationError({"checksum": "Checksum must be base64"})
+
+
+def spooled(upload):
+    """How many bytes this worker's spool file holds, or None if it has none."""
+    try:
+        return os.path.getsize(spool_path(upload))
+    except FileNotFoundError:
+        return None
+
+
+def restart(upload):
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(spool_path(upload), "wb").close()
+    upload.offset = 0
+    upload.save(update_fields=["offset"])
+
+
+def recover(upload):
+    """
+    Start ``upload`` over if this worker's spool file does not hold the bytes
+    received so far: it has none, or an old, shorter copy, which happens when
+    CHUNKED_UPLOAD_DIR is not shared between workers.
+    """
+    if spooled(upload) == upload.offset:
+        return upload
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+        if spooled(upload) != upload.offset:
+            restart(upload)
+    return upload
+
+
+def append(upload, offset, checksum, stream, length):
+    """Append one chunk of ``length`` bytes read from ``stream``."""
+    return _append(recover(upload), offset, checksum, stream, length)
+
+
+@transaction.atomic
+def _append(upload, offset, checksum, stream, length):
+    # Lock the row so two requests can't write into the spool file at once.
+    upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+    if spooled(upload) != upload.offset:
+        # The file changed after recover() looked at it. Should the restart
+        # be rolled back with an OffsetConflict, the next recover() redoes it.
+        restart(upload)
+    try:
+        offset = int(offset)
+    except (TypeError, ValueError):
+        raise ValidationError({"offset": "Upload-Offset header is required"})
+    if offset != upload.offset:
+        raise OffsetConflict(upload)
+    if upload.offset + length > upload.size:
+        raise ValidationError({"size": "Chunk runs past the declared size"})
+    expected = parse_checksum(checksum)
+
+    digest = hashlib.sha256()
+    received = 0
+    with open(spool_path(upload), "r+b") as spool:
+        spool.seek(offset)
+        while received < length:
+            data = stream.read(min(READ_SIZE, length - received))
+            if not data:
+                break
+            digest.update(data)
+            spool.write(data)
+            received += len(data)
+        if received != length or (expected and digest.digest() != expected):
+            spool.truncate(offset)
+            raise ValidationError({"checksum": "Chunk was incomplete or corrupted"})
+        spool.truncate(offset + received)
+
+    upload.offset = offset + received
+    upload.save(update_fields=["offset"])
+    return upload
+
+
+def sniff(path):
+    try:
+        with Image.open(path) as image:
+            image.verify()
+            return PILLOW_CONTENT_TYPES.get(image.format)
+    except Exception:
+        return None
+
+
+def finish(upload):
+    """Move the assembled file into storage and attach it to its target."""
+    upload = recover(upload)
+    if upload.offset != upload.size:
+        raise ValidationError(
+            {"offset": f"Only {upload.offset} of {upload.size} bytes"}
+        )
+
+    path = spool_path(upload)
+    if sniff(path) != upload.content_type:
+        discard(upload)
+        raise ValidationError(
+            {"file": "File is not a valid image of the declared type"}
+        )
+
+    model = apps.get_model(upload.target)
+    instance = model.objects.get(pk=upload.target_pk)
+    with open(path, "rb") as assembled:
+        content.attach(instance, upload.field, File(assembled, upload.filename))
+    discard(upload)
+    return instance
+
+
+def discard(upload):
+    try:
+        os.remove(spool_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def purge(max_age=None):
+    """Drop uploads that were started but never finished."""
+    max_age = max_age or settings.CHUNKED_UPLOAD_MAX_AGE
+    stale = ChunkedUpload.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=max_age)
+    )
+    purged = 0
+    for upload in stale.iterator():
+        discard(upload)
+        purged += 1
+    return purged
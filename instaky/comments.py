@@ -0,0 +1,53 @@
+"""
+Comment previews for card feeds.
+
+Feeds show each card's newest comments; clients follow the card's
+comments_url (/cards/:id/comments/, cursor-paginated) for the rest. The
+number previewed is FEED_COMMENT_PREVIEW, or ?comments=N up to
+FEED_COMMENT_PREVIEW_MAX, 0 turning previews off.
+
+recent_comments() fetches the previews of a whole page of cards in one
+query: a ROW_NUMBER() window numbers each card's comments newest first and
+only those numbered up to N come back, where the old code loaded every
+comment of every card on the page and dropped the surplus in Python. Django
+cannot filter on a window expression, so the numbered query is wrapped in a
+subquery by hand.
+"""
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from .models import Comment
+
+
+def preview_size(request):
+    """How many comments per card the request asked to preview."""
+    try:
+        size = int(request.query_params["comments"])
+    except (KeyError, ValueError):
+        return settings.FEED_COMMENT_PREVIEW
+    return max(0, min(size, settings.FEED_COMMENT_PREVIEW_MAX))
+
+
+def recent_comments(card_ids, limit):
+    """The ``limit`` newest comments of each card, newest first per card."""
+    if not card_ids or limit <= 0:
+        return Comment.objects.none()
+    numbered = (
+        Comment.objects.filter(card_id__in=card_ids)
+        .annotate(
+            recency=Window(
+                expression=RowNumber(),
+                partition_by=[F("card_id")],
+                order_by=[F("posted_at").desc(), F("id").desc()],
+            )
+        )
+        .values("id", "recency")
+    )
+    sql, params = numbered.query.sql_with_params()
+    ids = RawSQL(
+        f"SELECT id FROM ({sql}) numbered WHERE recency <= %s", (*params, limit)
+    )
+    return Comment.objects.filter(id__in=ids).order_by("card_id", "-posted_at", "-id")
@@ -0,0 +1,92 @@
+"""
+Response compression.
+
+CompressionMiddleware compresses responses of at least
+COMPRESSION_MIN_BYTES whose content type is in COMPRESSION_CONTENT_TYPES,
+with Brotli when the client accepts it and the brotli package is installed
+and with gzip otherwise. Smaller bodies are not worth the CPU, and a body that
+would not shrink is sent as it is.
+
+Streaming responses are left alone: exports compress themselves (see
+export.py) and event streams must not be buffered. Compressed responses
+carry a weak ETag, since their bytes differ from the uncompressed ones;
+cache.etag_matches() compares ETags weakly, as If-None-Match calls for.
+"""
+
+import gzip
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(request):
+    """The content codings in Accept-Encoding, with their q-values."""
+    accepted = {}
+    for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, *params = part.split(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def accepts(request, coding):
+    """Whether the client accepts ``coding``, by name or through "*"."""
+    accepted = accepted_encodings(request)
+    return accepted.get(coding, accepted.get("*", 0)) > 0
+
+
+def compress(content, coding):
+    if coding == "br":
+        return brotli.compress(content, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=settings.COMPRESSION_GZIP_LEVEL)
+
+
+def coding_for(request):
+    if brotli is not None and accepts(request, "br"):
+        return "br"
+    if accepts(request, "gzip"):
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding"):
+            return response
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in settings.COMPRESSION_CONTENT_TYPES:
+            return response
+        # whether or not this response is compressed, others for the URL may be
+        patch_vary_headers(response, ["Accept-Encoding"])
+        if len(response.content) < settings.COMPRESSION_MIN_BYTES:
+            return response
+        coding = coding_for(request)
+        if coding is None:
+            return response
+
+        compressed = compress(response.content, coding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = coding
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
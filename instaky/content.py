@@ -0,0 +1,134 @@
+"""
+Content-addressed storage for card images and profile pictures.
+
+Originals are stored under the SHA-256 of their bytes,
+
+    <upload_to>sha256/<first two hex digits>/<digest><extension>
+
+so the same picture uploaded twice (a re-post, the same avatar on several
+accounts) is kept once, and its URL never changes while it exists. Each
+stored object has a StoredImage row counting the fields that point at it,
+along with the dimensions and variants the image pipeline produced for it;
+a second reference is a metadata-only write that reuses both the object and
+its variants. When the last reference is released the object and its
+variants are deleted.
+
+Direct uploads (uploads.py) land under a random key without passing through
+the app server, so they are registered under that key with an empty digest
+until the dedupe_images command hashes and moves them.
+"""
+
+import hashlib
+import posixpath
+
+from django.db import transaction
+from django.db.models import F
+
+from . import images
+from .models import StoredImage
+
+ADDRESS_DIRECTORY = "sha256"
+
+
+def digest_of(file):
+    """Return (hex SHA-256, size) of a file, reading it in chunks."""
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in file.chunks():
+        sha256.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return sha256.hexdigest(), size
+
+
+def address(field, digest, filename):
+    extension = posixpath.splitext(filename or "")[1].lower()
+    return posixpath.join(
+        field.upload_to, ADDRESS_DIRECTORY, digest[:2], f"{digest}{extension}"
+    )
+
+
+def is_addressed(name):
+    return f"/{ADDRESS_DIRECTORY}/" in f"/{name}"
+
+
+def store(field, file):
+    """Store ``file`` for ``field`` (if it isn't already) and take a reference."""
+    digest, size = digest_of(file)
+    name = address(field, digest, file.name)
+    storage = field.storage
+
+    with transaction.atomic():
+        stored, created = StoredImage.objects.select_for_update().get_or_create(
+            name=name, defaults={"digest": digest, "size": size}
+        )
+        if created or not storage.exists(name):
+            saved = storage.save(name, file)
+            if saved != name:
+                # Someone else wrote the same bytes first; keep theirs.
+                storage.delete(saved)
+        StoredImage.objects.filter(pk=stored.pk).update(refcount=F("refcount") + 1)
+    return name
+
+
+def adopt(field, name):
+    """Take a reference to an object that was uploaded under ``name``."""
+    with transaction.atomic():
+        stored, _ = StoredImage.objects.select_for_update().get_or_create(
+            name=name, defaults={"size": field.storage.size(name)}
+        )
+        StoredImage.objects.filter(pk=stored.pk).update(refcount=F("refcount") + 1)
+    return name
+
+
+def release(instance, field_name):
+    """
+    Drop ``instance``'s reference to its current image, deleting the object
+    and its variants if nothing else refers to them. Images stored before this
+    module existed are not counted and belong to this instance alone.
+    """
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return
+    name, storage = field_file.name, field_file.storage
+
+    with transaction.atomic():
+        stored = StoredImage.objects.select_for_update().filter(name=name).first()
+        if stored is None:
+            variants = getattr(instance, f"{field_name}_variants")
+        elif stored.refcount > 1:
+            StoredImage.objects.filter(pk=stored.pk).update(refcount=F("refcount") - 1)
+            return
+        else:
+            variants = stored.variants
+            stored.delete()
+
+    images.delete_variants(storage, variants)
+    storage.delete(name)
+
+
+def replace(instance, field_name, name):
+    release(instance, field_name)
+    getattr(instance, field_name).name = name
+    instance.save()
+    images.schedule(instance, field_name)
+
+
+def attach(instance, field_name, file):
+    """Store ``file`` as ``instance.<field_name>``, replacing any previous image."""
+    field = instance._meta.get_field(field_name)
+    replace(instance, field_name, store(field, file))
+
+
+def attach_uploaded(instance, field_name, name):
+    """Attach an object a client uploaded straight to storage under ``name``."""
+    field = instance._meta.get_field(field_name)
+    replace(instance, field_name, adopt(field, name))
+
+
+def detach(instance, field_name):
+    """Remove ``instance``'s image."""
+    release(instance, field_name)
+    setattr(instance, field_name, None)
+    instance.save()
+    images.reset(instance, field_name)
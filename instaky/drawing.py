@@ -0,0 +1,216 @@
+"""
+Drawing the front of a card with Pillow, for previews.py.
+
+draw() takes plain values rather than a Card and imports nothing from Django,
+so that it can run in worker processes that never set Django up. Fonts are
+looked up by file name in the usual font directories; PREVIEW_FONTS names
+them.
+"""
+
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+# Part of every preview's key: bump it to re-render them all after changing
+# how cards are drawn.
+VERSION = 1
+
+# card_color: (background, text)
+COLORS = {
+    "WH": ("#ffffff", "#222222"),
+    "BK": ("#161616", "#f4f4f4"),
+    "RD": ("#d63c3c", "#ffffff"),
+    "OR": ("#f08a24", "#ffffff"),
+    "YE": ("#f6d33c", "#2a2a2a"),
+    "GR": ("#3b9c55", "#ffffff"),
+    "BL": ("#2f6ad0", "#ffffff"),
+    "IN": ("#4a3f9b", "#ffffff"),
+    "VI": ("#8e4cc4", "#ffffff"),
+    "TE": ("#1e9a96", "#ffffff"),
+}
+
+# font_size: the largest text height, as a fraction of the preview's height
+FONT_SIZES = {0: 0.07, 1: 0.09, 2: 0.12, 3: 0.16}
+MIN_FONT_PIXELS = 12
+
+SOLID, DASHED, DOTTED, DOUBLE = range(4)
+
+PILLOW_FORMATS = {"png": "PNG", "webp": "WEBP"}
+
+
+def font(name, pixels):
+    try:
+        return ImageFont.truetype(name, pixels)
+    except OSError:
+        pass
+    try:
+        return ImageFont.load_default(size=pixels)
+    except TypeError:
+        # before Pillow 10.1 the default font is a bitmap of a single size
+        return ImageFont.load_default()
+
+
+def metrics(face):
+    """``face``'s ascent and descent; bitmap fonts have no getmetrics()."""
+    if hasattr(face, "getmetrics"):
+        return face.getmetrics()
+    if hasattr(face, "getbbox"):
+        return face.getbbox("Ag")[3], 0
+    return face.getsize("Ag")[1], 0
+
+
+def line_height(face):
+    ascent, descent = metrics(face)
+    return round((ascent + descent) * 1.15)
+
+
+def wrap(canvas, text, face, width):
+    """Break ``text`` into lines of words no wider than ``width``."""
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        line = []
+        for word in paragraph.split():
+            if line and canvas.textlength(" ".join(line + [word]), font=face) > width:
+                lines.append(line)
+                line = []
+            line.append(word)
+        lines.append(line)
+    return lines
+
+
+def fit(canvas, text, font_name, pixels, box):
+    """The largest font up to ``pixels`` high that fits ``text`` in ``box``."""
+    width, height = box
+    while True:
+        face = font(font_name, pixels)
+        lines = wrap(canvas, text, face, width)
+        fits = len(lines) * line_height(face) <= height and all(
+            canvas.textlength(" ".join(line), font=face) <= width for line in lines
+        )
+        if fits or pixels <= MIN_FONT_PIXELS:
+            return face, lines
+        pixels = max(MIN_FONT_PIXELS, int(pixels * 0.9))
+
+
+def draw_text(canvas, lines, face, color, align, underline, box):
+    left, top, width, height = box
+    step = line_height(face)
+    y = top + (height - step * len(lines)) // 2
+    for number, words in enumerate(lines):
+        text = " ".join(words)
+        length = canvas.textlength(text, font=face)
+        start = left
+        if align == "J" and len(words) > 1 and number < len(lines) - 1:
+            spare = width - sum(canvas.textlength(word, font=face) for word in words)
+            x = left
+            for word in words:
+                canvas.text((x, y), word, font=face, fill=color)
+                x += canvas.textlength(word, font=face) + spare / (len(words) - 1)
+            length = width
+        else:
+            if align == "C":
+                start = left + (width - length) / 2
+            elif align == "R":
+                start = left + width - length
+            canvas.text((start, y), text, font=face, fill=color)
+        if underline and words:
+            baseline = y + metrics(face)[0] + max(2, step // 20)
+            canvas.line(
+                [(start, baseline), (start + length, baseline)],
+                fill=color,
+                width=max(1, step // 18),
+            )
+        y += step
+
+
+def dashes(canvas, start, end, color, width, dash, gap):
+    (x0, y0), (x1, y1) = start, end
+    length = max(abs(x1 - x0), abs(y1 - y0))
+    position = 0
+    while position < length:
+        stop = min(position + dash, length)
+        canvas.line(
+            [
+                (
+                    x0 + (x1 - x0) * position / length,
+                    y0 + (y1 - y0) * position / length,
+                ),
+                (x0 + (x1 - x0) * stop / length, y0 + (y1 - y0) * stop / length),
+            ],
+            fill=color,
+            width=width,
+        )
+        position = stop + gap
+
+
+def draw_border(canvas, style, color, size):
+    width, height = size
+    thickness = max(2, height // 60)
+    inset = thickness * 2
+    corners = [
+        (inset, inset),
+        (width - inset, inset),
+        (width - inset, height - inset),
+        (inset, height - inset),
+    ]
+    if style == DOUBLE:
+        canvas.rectangle([corners[0], corners[2]], outline=color, width=thickness)
+        inner = inset + thickness * 2
+        canvas.rectangle(
+            [(inner, inner), (width - inner, height - inner)],
+            outline=color,
+            width=thickness,
+        )
+    elif style in (DASHED, DOTTED):
+        dash, gap = (thickness * 6, thickness * 3)
+        if style == DOTTED:
+            dash, gap = (thickness, thickness * 2)
+        for start, end in zip(corners, corners[1:] + corners[:1]):
+            dashes(canvas, start, end, color, thickness, dash, gap)
+    else:
+        canvas.rectangle([corners[0], corners[2]], outline=color, width=thickness)
+    return inset + thickness * 3
+
+
+def draw(
+    text,
+    color,
+    border,
+    font_name,
+    underline,
+    align,
+    font_size,
+    picture=None,
+    size=(1200, 630),
+    fmt="png",
+    quality=80,
+):
+    """The front of a card as ``fmt`` bytes; ``picture`` is image file bytes."""
+    background, foreground = COLORS.get(color, COLORS["WH"])
+    width, height = size
+    image = Image.new("RGB", size, background)
+    canvas = ImageDraw.Draw(image)
+    margin = draw_border(canvas, border, foreground, size)
+
+    left = margin
+    if picture:
+        with Image.open(BytesIO(picture)) as source:
+            photo = ImageOps.exif_transpose(source).convert("RGB")
+        area = (width * 9 // 20 - margin, height - margin * 2)
+        image.paste(ImageOps.fit(photo, area, Image.LANCZOS), (margin, margin))
+        left = margin + area[0]
+
+    padding = height // 15
+    box = (
+        left + padding,
+        margin + padding,
+        width - margin - padding - (left + padding),
+        height - (margin + padding) * 2,
+    )
+    pixels = round(height * FONT_SIZES.get(font_size, FONT_SIZES[1]))
+    face, lines = fit(canvas, text, font_name, pixels, box[2:])
+    draw_text(canvas, lines, face, foreground, align, underline, box)
+
+    buffer = BytesIO()
+    image.save(buffer, PILLOW_FORMATS[fmt], quality=quality)
+    return buffer.getvalue()
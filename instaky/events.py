@@ -0,0 +1,353 @@
+"""
+Server-sent events: new activity pushed to the people it concerns.
+
+GET /events/ is a text/event-stream per user carrying compact events
+
+    card     {"type": "card", "card": id, "user": author}
+             someone they follow posted a card
+    like     {"type": "like", "card": id, "user": liker}
+             someone liked one of their cards
+    comment  {"type": "comment", "card": id, "comment": id, "user": commenter}
+             someone commented on one of their cards
+
+so that the front end can fetch what changed instead of polling the feeds.
+EventSource cannot set headers, so the token may be passed as ?token=
+instead of in the Authorization header. A comment line every
+EVENTS_KEEPALIVE_SECONDS keeps routers from closing an idle stream.
+
+The stream is served by stream(), a plain ASGI app that project/asgi.py
+routes /events/ to: Django 3.1 cannot stream a response without tying up a
+thread per client, so this needs the ASGI server (see gunicorn.conf.py).
+Django's middleware never sees these requests, so stream() adds the CORS
+headers that django-cors-headers would, from the same CORS_* settings.
+
+Events are published to topics, "user:<id>" for activity on that user's
+cards and "author:<id>" for the cards that user posts. A stream subscribes
+to its user's topic and to the author topic of everyone they follow when it
+opens; follows made later apply from the next reconnect, which EventSource
+does by itself. A stream whose client falls EVENTS_QUEUE_SIZE events behind
+drops the rest and is sent a "resync" event, telling it to refetch.
+
+The broker is the class named by EVENTS_BROKER:
+
+    instaky.events.LocalBroker      in-process; for a single worker and tests
+    instaky.events.PostgresBroker   NOTIFY/LISTEN on the app's database, so
+                                    that an event reaches streams on every
+                                    worker and dyno
+
+Either way an event goes out when the transaction that caused it commits,
+and not at all if it rolls back.
+"""
+
+import asyncio
+import json
+import logging
+import re
+import select
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from corsheaders.conf import conf as cors
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, transaction
+from django.utils.module_loading import import_string
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from users.models import Follow
+
+logger = logging.getLogger(__name__)
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENTS_BROKER)()
+        return _broker
+
+
+class Subscription:
+    """The events of some topics, queued for one stream."""
+
+    def __init__(self, broker, topics):
+        self.broker = broker
+        self.topics = topics
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+        self.lagged = False
+
+    def put(self, event):
+        """Called on the subscription's event loop."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    async def get(self, timeout):
+        """The next event, or None after ``timeout`` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Delivers events to the streams of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, topics):
+        """Subscribe to ``topics``; call from the event loop of the stream."""
+        subscription = Subscription(self, topics)
+        with self.lock:
+            for topic in topics:
+                self.subscriptions[topic].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for topic in subscription.topics:
+                subscribers = self.subscriptions.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[topic]
+
+    def publish(self, topic, event):
+        transaction.on_commit(lambda: self.deliver(topic, event))
+
+    def deliver(self, topic, event):
+        """Hand ``event`` to this process's subscribers; safe from any thread."""
+        with self.lock:
+            subscribers = list(self.subscriptions.get(topic, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # its event loop is gone
+                self.unsubscribe(subscription)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Publishes with NOTIFY on EVENTS_CHANNEL, which PostgreSQL delivers when
+    the transaction commits, and runs one listener thread per process that
+    hands what it hears to the local subscribers.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.listener = None
+
+    def publish(self, topic, event):
+        payload = json.dumps({"topic": topic, "event": event})
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, %s)", [settings.EVENTS_CHANNEL, payload]
+            )
+
+    def subscribe(self, topics):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(
+                    target=self.listen, name="instaky-events", daemon=True
+                )
+                self.listener.start()
+        return super().subscribe(topics)
+
+    def listen(self):
+        while True:
+            try:
+                self.receive()
+            except Exception:
+                logger.exception("Event listener failed; reconnecting")
+                time.sleep(settings.EVENTS_RECONNECT_SECONDS)
+
+    def receive(self):
+        db = connections[DEFAULT_DB_ALIAS]
+        listening = db.get_new_connection(db.get_connection_params())
+        try:
+            listening.autocommit = True
+            with listening.cursor() as cursor:
+                cursor.execute(f"LISTEN {db.ops.quote_name(settings.EVENTS_CHANNEL)}")
+            while True:
+                if not select.select([listening], [], [], 60)[0]:
+                    continue
+                listening.poll()
+                while listening.notifies:
+                    message = json.loads(listening.notifies.pop(0).payload)
+                    self.deliver(message["topic"], message["event"])
+        finally:
+            listening.close()
+
+
+def card_created(card):
+    broker().publish(
+        f"author:{card.user_id}",
+        {"type": "card", "card": card.id, "user": card.user.username},
+    )
+
+
+def card_liked(card, user):
+    if user.id != card.user_id:
+        broker().publish(
+            f"user:{card.user_id}",
+            {"type": "like", "card": card.id, "user": user.username},
+        )
+
+
+def comment_created(comment):
+    card = comment.card
+    if comment.user_id != card.user_id:
+        broker().publish(
+            f"user:{card.user_id}",
+            {
+                "type": "comment",
+                "card": card.id,
+                "comment": comment.id,
+                "user": comment.user.username,
+            },
+        )
+
+
+def topics_for(key):
+    """The user a token belongs to and the topics their stream follows."""
+    try:
+        user, _ = TokenAuthentication().authenticate_credentials(key)
+        followed = Follow.objects.filter(follower=user).values_list(
+            "followed_id", flat=True
+        )
+        return user, [f"user:{user.id}"] + [f"author:{pk}" for pk in followed]
+    finally:
+        # not a Django request: nothing else closes connections for us
+        close_old_connections()
+
+
+def token(scope):
+    query = parse_qs(scope.get("query_string", b"").decode("latin1"))
+    if query.get("token"):
+        return query["token"][0]
+    headers = dict(scope.get("headers", []))
+    scheme, _, key = headers.get(b"authorization", b"").decode("latin1").partition(" ")
+    return key if scheme.lower() == "token" and key else None
+
+
+def cors_headers(scope):
+    """The headers CorsMiddleware would add to a response to ``scope``."""
+    headers = dict(scope.get("headers", []))
+    origin = headers.get(b"origin", b"").decode("latin1")
+    if not origin or not re.match(cors.CORS_URLS_REGEX, scope["path"]):
+        return []
+    if cors.CORS_ALLOW_ALL_ORIGINS and not cors.CORS_ALLOW_CREDENTIALS:
+        allowed = "*"
+    elif (
+        cors.CORS_ALLOW_ALL_ORIGINS
+        or origin in cors.CORS_ALLOWED_ORIGINS
+        or any(re.match(regex, origin) for regex in cors.CORS_ALLOWED_ORIGIN_REGEXES)
+    ):
+        allowed = origin
+    else:
+        return [(b"vary", b"origin")]
+    added = [
+        (b"access-control-allow-origin", allowed.encode("latin1")),
+        (b"vary", b"origin"),
+    ]
+    if cors.CORS_ALLOW_CREDENTIALS:
+        added.append((b"access-control-allow-credentials", b"true"))
+    if cors.CORS_EXPOSE_HEADERS:
+        exposed = ", ".join(cors.CORS_EXPOSE_HEADERS).encode("latin1")
+        added.append((b"access-control-expose-headers", exposed))
+    return added
+
+
+def sse(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+
+
+async def respond(send, status, body=b"", headers=()):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), *headers],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def stream(scope, receive, send):
+    """ASGI app serving GET /events/."""
+    cors_allowed = cors_headers(scope)
+    if scope["method"] != "GET":
+        return await respond(
+            send,
+            405,
+            b'{"detail": "Method not allowed."}',
+            [(b"allow", b"GET"), *cors_allowed],
+        )
+    key = token(scope)
+    try:
+        if key is None:
+            raise AuthenticationFailed("Authentication credentials were not provided.")
+        user, topics = await sync_to_async(topics_for, thread_sensitive=True)(key)
+    except AuthenticationFailed as exc:
+        body = json.dumps({"detail": str(exc.detail)}).encode()
+        return await respond(
+            send, 401, body, [(b"www-authenticate", b"Token"), *cors_allowed]
+        )
+
+    subscription = broker().subscribe(topics)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    # nginx and the like would otherwise buffer the stream
+                    (b"x-accel-buffering", b"no"),
+                    *cors_allowed,
+                ],
+            }
+        )
+        await send(
+            {
+                "type": "http.response.body",
+                "body": b": connected\n\n",
+                "more_body": True,
+            }
+        )
+        while not disconnected.done():
+            event = await subscription.get(settings.EVENTS_KEEPALIVE_SECONDS)
+            if subscription.lagged:
+                subscription.lagged = False
+                chunk = sse({"type": "resync"})
+            elif event is None:
+                chunk = b": keepalive\n\n"
+            else:
+                chunk = sse(event)
+            if not disconnected.done():
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+    finally:
+        subscription.close()
+        disconnected.cancel()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
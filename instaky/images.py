@@ -0,0 +1,220 @@
+"""
+Background derivative pipeline for card images and profile pictures.
+
+Upload views store the original and return straight away; schedule() then
+produces resized, EXIF-free variants of the image in every configured format
+(JPEG, WebP and, where Pillow supports it, AVIF) next to the original in the
+field's storage. The variant list and the original's dimensions are written
+back to the model's ``<field>_width``, ``<field>_height`` and
+``<field>_variants`` columns, and serializers turn the variants into
+``srcset`` strings.
+
+With IMAGE_PIPELINE_ASYNC the work runs on a small thread pool after the
+upload commits; without it (tests, management commands) it runs inline. An
+image whose ``<field>_width`` is still null has not been processed yet, which
+is what the process_images command looks for.
+
+Images in the content-addressed store (content.py) share their variants with
+every other field holding the same bytes: they are generated once, kept on the
+StoredImage row, and copied from there for later references.
+"""
+
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, features
+
+from . import cache
+from .models import Card, StoredImage
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "jpeg": ("JPEG", "jpg", None),
+    "webp": ("WEBP", "webp", "webp"),
+    "avif": ("AVIF", "avif", "avif"),
+}
+
+_executor = None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PIPELINE_WORKERS,
+            thread_name_prefix="image-pipeline",
+        )
+    return _executor
+
+
+def formats():
+    return [
+        name
+        for name in settings.IMAGE_VARIANT_FORMATS
+        if FORMATS[name][2] is None or features.check(FORMATS[name][2])
+    ]
+
+
+def widths_for(width):
+    """
+    Configured widths below the original's, plus the original width itself in
+    place of any configured width it would have to be upscaled to.
+    """
+    widths = [w for w in settings.IMAGE_VARIANT_WIDTHS if w < width]
+    if len(widths) < len(settings.IMAGE_VARIANT_WIDTHS):
+        widths.append(width)
+    return widths
+
+
+def encode(image, name):
+    pillow_format = FORMATS[name][0]
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    mode = "RGBA" if has_alpha and name != "jpeg" else "RGB"
+    buffer = BytesIO()
+    # No exif= argument, so the variant is written without any EXIF block.
+    image.convert(mode).save(
+        buffer, pillow_format, quality=settings.IMAGE_VARIANT_QUALITY
+    )
+    return buffer.getvalue()
+
+
+def variant_name(original, width, name):
+    directory, filename = posixpath.split(original)
+    stem = posixpath.splitext(filename)[0]
+    extension = FORMATS[name][1]
+    return posixpath.join(directory, "variants", f"{stem}-{width}w.{extension}")
+
+
+def generate(field_file):
+    """Return (width, height, variants) for a stored image."""
+    storage = field_file.storage
+    with storage.open(field_file.name, "rb") as original:
+        image = Image.open(original)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    width, height = image.size
+
+    variants = []
+    for target in widths_for(width):
+        resized = image
+        if target != width:
+            size = (target, max(1, round(height * target / width)))
+            resized = image.resize(size, Image.LANCZOS)
+        for name in formats():
+            stored = storage.save(
+                variant_name(field_file.name, target, name),
+                ContentFile(encode(resized, name)),
+            )
+            variants.append(
+                {
+                    "format": name,
+                    "width": resized.width,
+                    "height": resized.height,
+                    "name": stored,
+                }
+            )
+    return width, height, variants
+
+
+def delete_variants(storage, variants):
+    for variant in variants:
+        storage.delete(variant["name"])
+
+
+def invalidate(instance):
+    if isinstance(instance, Card):
+        cache.bump_cards([(instance.id, instance.user_id)])
+
+
+def process(model, pk, field_name, force=False):
+    instance = model.objects.filter(pk=pk).first()
+    field_file = getattr(instance, field_name, None)
+    if not field_file:
+        return
+
+    stored = StoredImage.objects.filter(name=field_file.name).first()
+    if stored is not None and stored.width is not None and not force:
+        width, height, variants = stored.width, stored.height, stored.variants
+    else:
+        if stored is not None:
+            delete_variants(field_file.storage, stored.variants)
+        width, height, variants = generate(field_file)
+        if stored is not None:
+            kept = StoredImage.objects.filter(pk=stored.pk).update(
+                width=width, height=height, variants=variants
+            )
+            if not kept:
+                # The last reference was released while we were working.
+                delete_variants(field_file.storage, variants)
+                return
+
+    updated = model.objects.filter(pk=pk, **{field_name: field_file.name}).update(
+        **{
+            f"{field_name}_width": width,
+            f"{field_name}_height": height,
+            f"{field_name}_variants": variants,
+        }
+    )
+    if not updated:
+        # The image was replaced or removed while we were working on it.
+        if stored is None:
+            delete_variants(field_file.storage, variants)
+        return
+    invalidate(instance)
+
+
+def run(model, pk, field_name):
+    try:
+        process(model, pk, field_name)
+    except Exception:
+        logger.exception("Could not process %s %s %s", model.__name__, pk, field_name)
+    finally:
+        close_old_connections()
+
+
+def reset(instance, field_name):
+    """Mark an image as unprocessed."""
+    type(instance).objects.filter(pk=instance.pk).update(
+        **{
+            f"{field_name}_width": None,
+            f"{field_name}_height": None,
+            f"{field_name}_variants": [],
+        }
+    )
+    invalidate(instance)
+
+
+def discard(instance, field_name):
+    """
+    Mark an image as unprocessed, deleting its variants unless they belong to
+    the content-addressed store.
+    """
+    field_file = getattr(instance, field_name)
+    if not StoredImage.objects.filter(name=field_file.name).exists():
+        delete_variants(field_file.storage, getattr(instance, f"{field_name}_variants"))
+    reset(instance, field_name)
+
+
+def schedule(instance, field_name):
+    """Replace an image's variants after a new original has been saved."""
+    discard(instance, field_name)
+    model, pk = type(instance), instance.pk
+    if settings.IMAGE_PIPELINE_ASYNC:
+        transaction.on_commit(lambda: executor().submit(run, model, pk, field_name))
+    else:
+        process(model, pk, field_name)
+
+
+def srcset(storage, variants, build_absolute_uri):
+    """Group variants by format into ``srcset`` strings ("url 320w, ...")."""
+    sets = {}
+    for variant in variants:
+        url = build_absolute_uri(storage.url(variant["name"]))
+        sets.setdefault(variant["format"], []).append(f"{url} {variant['width']}w")
+    return {name: ", ".join(candidates) for name, candidates in sets.items()}
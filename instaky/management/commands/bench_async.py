@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from instaky.models import Card
+from rest_framework.authtoken.models import Token
+
+from . import bench_endpoints
+from .bench_endpoints import percentile
+
+# (name, path); each is served by a DRF view at the path and by its async
+# version at /async + path.
+ROUTES = [
+    ("card-all", "/cards/all/"),
+    ("card-mine", "/cards/mine/"),
+    ("card-following", "/cards/following/"),
+    ("user-detail", "/users/{author}/"),
+    ("user-cards", "/users/{author}/cards/"),
+]
+
+NO_CACHE = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the feed and user endpoints with their async versions "
+        "(instaky/async_views.py) under concurrent clients. Both run in this "
+        "process against the current database: the DRF views on a pool of "
+        "threads through the WSGI handler, as threaded workers serve them, and "
+        "the async views on one event loop through the ASGI handler, as a "
+        "uvicorn worker does. Reports requests per second and p50/p99 latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--clients",
+            type=int,
+            nargs="+",
+            default=[1, 4, 16],
+            help="numbers of concurrent clients to try",
+        )
+        parser.add_argument("--requests", type=int, default=200, help="per run")
+        parser.add_argument("--user", help="username to act as (default: busiest)")
+        parser.add_argument("--routes", nargs="+", help="only these route names")
+
+    def handle(self, *args, **options):
+        endpoints = bench_endpoints.Command()
+        user = endpoints.acting_user(options["user"])
+        ids = endpoints.targets(user)
+        token, created = Token.objects.get_or_create(user=user)
+        self.stdout.write(
+            f"{Card.objects.count()} cards on {connection.vendor}, "
+            f"{options['requests']} requests per run, acting as {user.username}"
+        )
+        # Every request does its database work: the async views do not use
+        # the response cache, so the sync ones get a cache that never hits.
+        no_cache = override_settings(
+            CACHES={**settings.CACHES, "bench-off": NO_CACHE},
+            FEED_CACHE_ALIAS="bench-off",
+            SLOW_REQUEST_SECONDS=None,
+        )
+        try:
+            with no_cache:
+                for name, path in ROUTES:
+                    if options["routes"] and name not in options["routes"]:
+                        continue
+                    path = path.format(**ids)
+                    for clients in options["clients"]:
+                        self.compare(name, path, clients, options["requests"], token)
+        finally:
+            if created:
+                token.delete()
+
+    def compare(self, name, path, clients, count, token):
+        sync = self.run_sync(path, clients, count, token.key)
+        concurrent = async_to_sync(self.run_async)(
+            f"/async{path}", clients, count, token.key
+        )
+        self.stdout.write(
+            f"{name:<16} {clients:>3} clients  "
+            f"sync {self.summary(*sync)}  async {self.summary(*concurrent)}"
+        )
+
+    def run_sync(self, path, clients, count, key):
+        local = threading.local()
+
+        def one(_):
+            if not hasattr(local, "client"):
+                local.client = Client(HTTP_AUTHORIZATION=f"Token {key}")
+            start = time.perf_counter()
+            self.expect_ok(path, local.client.get(path))
+            return time.perf_counter() - start
+
+        with ThreadPoolExecutor(clients) as pool:
+            start = time.perf_counter()
+            latencies = list(pool.map(one, range(count)))
+            return latencies, time.perf_counter() - start
+
+    async def run_async(self, path, clients, count, key):
+        client = AsyncClient()
+        remaining = iter(range(count))
+        latencies = []
+
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                self.expect_ok(
+                    path, await client.get(path, AUTHORIZATION=f"Token {key}")
+                )
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(clients)))
+        return latencies, time.perf_counter() - start
+
+    def expect_ok(self, path, response):
+        if response.status_code != 200:
+            raise CommandError(f"GET {path}: {response.status_code}")
+
+    def summary(self, latencies, elapsed):
+        return (
+            f"{len(latencies) / elapsed:>7.1f} req/s "
+            f"p50 {percentile(latencies, 0.5) * 1000:>7.1f} ms "
+            f"p99 {percentile(latencies, 0.99) * 1000:>7.1f} ms"
+        )
@@ -0,0 +1,355 @@
+import copy
+import json
+import secrets
+import time
+import tracemalloc
+from pathlib import Path
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from instaky.models import Card, Comment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import User
+
+# (name, method, path, body). Paths and bodies are formatted with the ids
+# picked by Command.targets(). Routes that move image bytes (image,
+# image_complete, image_resumable, chunked and local uploads, delete_image)
+# are left out: they measure storage rather than the app, and rolling back
+# the transaction does not undo writes to storage. card-preview is the
+# exception, as only its first request draws and stores the image; the rest
+# measure the lookup that serves a stored preview.
+ROUTES = [
+    ("api-root", "get", "/", None),
+    ("card-list", "get", "/cards/", None),
+    ("card-all", "get", "/cards/all/", None),
+    ("card-mine", "get", "/cards/mine/", None),
+    ("card-following", "get", "/cards/following/", None),
+    ("card-search", "get", "/cards/search/?q={term}", None),
+    ("card-trending", "get", "/cards/trending/", None),
+    ("card-detail", "get", "/cards/{card}/", None),
+    ("card-comments", "get", "/cards/{card}/comments/", None),
+    ("card-preview", "get", "/cards/{card}/preview/", None),
+    ("card-create", "post", "/cards/", {"outer_text": "o", "inner_text": "i"}),
+    (
+        "card-create-many",
+        "post",
+        "/cards/",
+        [{"outer_text": f"o{n}", "inner_text": "i"} for n in range(20)],
+    ),
+    ("card-update", "patch", "/cards/{own_card}/", {"inner_text": "edited"}),
+    ("card-like", "post", "/cards/{card}/like/", None),
+    (
+        "card-image-intent",
+        "post",
+        "/cards/{own_card}/image_intent/",
+        {"filename": "bench.jpg", "content_type": "image/jpeg"},
+    ),
+    ("comment-list", "get", "/comments/", None),
+    ("comment-detail", "get", "/comments/{comment}/", None),
+    (
+        "comment-create",
+        "post",
+        "/comments/",
+        {"card": "http://testserver/cards/{card}/", "body": "bench"},
+    ),
+    ("comment-like", "post", "/comments/{comment}/like/", None),
+    ("user-list", "get", "/users/", None),
+    ("user-detail", "get", "/users/{author}/", None),
+    ("user-suggestions", "get", "/users/suggestions/", None),
+    ("user-cards", "get", "/users/{author}/cards/", None),
+    ("user-comments", "get", "/users/{author}/comments/", None),
+    ("user-followers", "get", "/users/{author}/followers/", None),
+    ("user-following", "get", "/users/{user}/following/", None),
+    ("user-follow", "post", "/users/{author}/follow/", None),
+    ("user-unfollow", "post", "/users/{followed}/unfollow/", None),
+    (
+        "user-image-intent",
+        "post",
+        "/users/{user}/image_intent/",
+        {"filename": "bench.jpg", "content_type": "image/jpeg"},
+    ),
+    ("user-export", "get", "/users/{user}/export/", None),
+    ("export", "get", "/export/?type=cards", None),
+    ("metrics", "get", "/metrics/", None),
+    ("async-card-all", "get", "/async/cards/all/", None),
+    ("async-card-mine", "get", "/async/cards/mine/", None),
+    ("async-card-following", "get", "/async/cards/following/", None),
+    ("async-user-detail", "get", "/async/users/{author}/", None),
+    ("async-user-cards", "get", "/async/users/{author}/cards/", None),
+]
+
+# The URL names of the routes left out of ROUTES, as above.
+UNMEASURED = {
+    "card-image",
+    "card-image-complete",
+    "card-image-resumable",
+    "card-delete-image",
+    "user-image",
+    "user-image-complete",
+    "user-image-resumable",
+    "user-delete-image",
+    "chunked-upload",
+    "chunked-upload-complete",
+    "upload-target",
+}
+
+# /export/ is for staff; the async views only take token authentication;
+# /metrics/ wants the scrape token.
+STAFF_ROUTES = {"export"}
+TOKEN_ROUTES = {name for name, _, _, _ in ROUTES if name.startswith("async-")}
+METRICS_ROUTES = {"metrics"}
+
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / "benchmarks" / "endpoints.json"
+
+
+def fill(template, ids):
+    """``template`` (a path or body) with the ids of targets() put in."""
+    if isinstance(template, str):
+        return template.format(**ids)
+    if isinstance(template, list):
+        return [fill(value, ids) for value in template]
+    if isinstance(template, dict):
+        return {key: fill(value, ids) for key, value in template.items()}
+    return template
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every API route against the current database (see generate_data) "
+        "and report p50/p99 latency, query counts and peak memory. Compares the "
+        "results with a JSON baseline and fails on regressions. Every request "
+        "runs in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="per route")
+        parser.add_argument("--user", help="username to act as (default: busiest)")
+        parser.add_argument("--routes", nargs="+", help="only these route names")
+        parser.add_argument(
+            "--baseline", type=Path, default=DEFAULT_BASELINE, help="JSON baseline"
+        )
+        parser.add_argument(
+            "--update-baseline",
+            action="store_true",
+            help="write the results to the baseline instead of comparing",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.25,
+            help="allowed p50 latency and peak memory growth (0.25 = 25%%)",
+        )
+        parser.add_argument(
+            "--warm",
+            action="store_true",
+            help="keep the response cache between requests",
+        )
+
+    def handle(self, *args, **options):
+        user = self.acting_user(options["user"])
+        ids = self.targets(user)
+        client = APIClient()
+        client.force_authenticate(user)
+        # the same user, as staff for this process only
+        staff = copy.copy(user)
+        staff.is_staff = True
+        staff_client = APIClient()
+        staff_client.force_authenticate(staff)
+        # The async views read the token in worker threads, outside the
+        # transaction each request runs in, so it has to be committed.
+        token, token_created = Token.objects.get_or_create(user=user)
+        token_client = APIClient()
+        token_client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+        # /metrics/ refuses everyone without a token outside DEBUG, so make
+        # one up for this run if none is configured.
+        metrics_token = settings.METRICS_TOKEN or secrets.token_urlsafe()
+        metrics_client = APIClient()
+        metrics_client.credentials(HTTP_AUTHORIZATION=f"Bearer {metrics_token}")
+        try:
+            with override_settings(METRICS_TOKEN=metrics_token):
+                results = self.run_routes(
+                    options, ids, client, staff_client, token_client, metrics_client
+                )
+        finally:
+            if token_created:
+                token.delete()
+
+        baseline = {
+            "dataset": self.dataset(),
+            "requests": options["requests"],
+            "routes": results,
+        }
+        if options["update_baseline"]:
+            options["baseline"].parent.mkdir(parents=True, exist_ok=True)
+            options["baseline"].write_text(json.dumps(baseline, indent=2) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['baseline']}"))
+        elif options["baseline"].exists():
+            self.compare(baseline, options["baseline"], options["tolerance"])
+        else:
+            raise CommandError(
+                f"No baseline at {options['baseline']}; run with --update-baseline"
+            )
+
+    def run_routes(
+        self, options, ids, client, staff_client, token_client, metrics_client
+    ):
+        routes = [
+            route
+            for route in ROUTES
+            if not options["routes"] or route[0] in options["routes"]
+        ]
+        results = {}
+        for name, method, path, body in routes:
+            templates = path + json.dumps(body)
+            if any(f"{{{key}}}" in templates for key, pk in ids.items() if pk is None):
+                self.stdout.write(f"{name:<20} skipped: no data to point it at")
+                continue
+            if name in STAFF_ROUTES:
+                route_client = staff_client
+            elif name in TOKEN_ROUTES:
+                route_client = token_client
+            elif name in METRICS_ROUTES:
+                route_client = metrics_client
+            else:
+                route_client = client
+            results[name] = self.measure(
+                route_client,
+                method,
+                fill(path, ids),
+                fill(body or {}, ids),
+                options["requests"],
+                options["warm"],
+            )
+            self.report(name, results[name])
+        return results
+
+    def acting_user(self, username):
+        if username:
+            return User.objects.get(username=username)
+        # The user following the most accounts has the heaviest following feed.
+        user = (
+            User.objects.annotate(followed=Count("following"))
+            .order_by("-followed", "id")
+            .first()
+        )
+        if user is None:
+            raise CommandError("The database is empty; run generate_data first")
+        return user
+
+    def targets(self, user):
+        popular = Card.objects.exclude(user=user).order_by("-like_count", "id").first()
+        followed = User.objects.filter(followers=user).order_by("id").first()
+        author = (
+            User.objects.exclude(followers=user)
+            .exclude(pk=user.pk)
+            .annotate(follower_count=Count("followers"))
+            .order_by("-follower_count", "id")
+            .first()
+        )
+        own_card = Card.objects.filter(user=user).order_by("id").first()
+        comment = Comment.objects.order_by("-like_count", "id").first()
+        return {
+            "user": user.pk,
+            "card": popular and popular.pk,
+            "own_card": own_card and own_card.pk,
+            "comment": comment and comment.pk,
+            "author": author and author.pk,
+            "followed": followed and followed.pk,
+            # a word from the most liked card, for the search route
+            "term": popular and quote(popular.outer_text.split()[0]),
+        }
+
+    def dataset(self):
+        return {
+            "users": User.objects.count(),
+            "cards": Card.objects.count(),
+            "comments": Comment.objects.count(),
+        }
+
+    def request(self, client, method, path, body):
+        with transaction.atomic():
+            response = getattr(client, method)(path, body, format="json")
+            if response.streaming:
+                # exports read their rows as the body is consumed
+                b"".join(response.streaming_content)
+            transaction.set_rollback(True)
+        if response.status_code >= 400:
+            raise CommandError(f"{method.upper()} {path}: {response.status_code}")
+        return response
+
+    def measure(self, client, method, path, body, count, warm):
+        cache = caches[settings.FEED_CACHE_ALIAS]
+        latencies = []
+        for _ in range(count):
+            if not warm:
+                cache.clear()
+            start = time.perf_counter()
+            self.request(client, method, path, body)
+            latencies.append(time.perf_counter() - start)
+
+        # Count queries and trace memory on one extra request, so that the
+        # tracing overhead stays out of the latency figures.
+        if not warm:
+            cache.clear()
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                self.request(client, method, path, body)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+            "queries": len(queries),
+            "peak_kib": round(peak / 1024, 1),
+        }
+
+    def report(self, name, result):
+        self.stdout.write(
+            f"{name:<20} p50 {result['p50_ms']:>9.2f} ms  "
+            f"p99 {result['p99_ms']:>9.2f} ms  "
+            f"{result['queries']:>4} queries  "
+            f"peak {result['peak_kib']:>9.1f} KiB"
+        )
+
+    def compare(self, current, path, tolerance):
+        baseline = json.loads(path.read_text())
+        if baseline["dataset"] != current["dataset"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Baseline was taken on {baseline['dataset']}, "
+                    f"this run is on {current['dataset']}"
+                )
+            )
+
+        regressions = []
+        for name, result in current["routes"].items():
+            before = baseline["routes"].get(name)
+            if before is None:
+                continue
+            if result["queries"] > before["queries"]:
+                regressions.append(
+                    f"{name}: {result['queries']} queries (was {before['queries']})"
+                )
+            for metric in ("p50_ms", "peak_kib"):
+                if result[metric] > before[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{name}: {metric} {result[metric]} (was {before[metric]})"
+                    )
+
+        if regressions:
+            raise CommandError("Regressions:\n  " + "\n  ".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {path}"))
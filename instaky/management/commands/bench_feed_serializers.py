@@ -0,0 +1,84 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from instaky.feed import CardFeedSerializer, card_rows
+from instaky.models import Card, Comment
+from instaky.serializers import CardSummarySerializer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare serialized cards per second for CardSummarySerializer and the "
+        "CardFeedSerializer fast path. Runs inside a transaction that is rolled "
+        "back, so it leaves the database untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", nargs="+", type=int, default=[1000, 10000], help="feed sizes"
+        )
+        parser.add_argument("--comments", type=int, default=5, help="comments per card")
+        parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create_user(username="bench-feed-user")
+            request = Request(APIRequestFactory().get("/cards/all/"))
+            request.user = user
+
+            created = 0
+            for size in sorted(options["sizes"]):
+                self.create_cards(user, size - created, options["comments"])
+                created = size
+                self.report(request, size, options["repeat"])
+
+            transaction.set_rollback(True)
+
+    def create_cards(self, user, count, comments_per_card):
+        cards = Card.objects.bulk_create(
+            Card(user=user, outer_text=f"outer {n}", inner_text=f"inner {n}")
+            for n in range(count)
+        )
+        if not cards or cards[0].pk is None:
+            cards = list(Card.objects.order_by("-id")[:count])
+        Comment.objects.bulk_create(
+            Comment(card=card, user=user, body=f"comment {n}")
+            for card in cards
+            for n in range(comments_per_card)
+        )
+
+    def time(self, repeat, serialize):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = serialize()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+    def report(self, request, size, repeat):
+        cards = Card.objects.order_by("-posted_at", "-id")[:size]
+
+        old_time, old_data = self.time(
+            repeat,
+            lambda: CardSummarySerializer(
+                cards.select_related("user"), many=True, context={"request": request}
+            ).data,
+        )
+        new_time, new_data = self.time(
+            repeat, lambda: CardFeedSerializer(request).serialize(card_rows(cards))
+        )
+        identical = json.dumps(old_data) == json.dumps(new_data)
+
+        self.stdout.write(
+            f"{size:>6} cards  "
+            f"CardSummarySerializer {size / old_time:>9.0f} cards/s  "
+            f"CardFeedSerializer {size / new_time:>9.0f} cards/s  "
+            f"speedup {old_time / new_time:.1f}x  "
+            f"identical output: {identical}"
+        )
@@ -0,0 +1,73 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from instaky import compression, renderers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import bench_endpoints
+
+
+class Command(BaseCommand):
+    help = (
+        "Render a page of /cards/all/ with DRF's JSONRenderer, FastJSONRenderer "
+        "and MessagePackRenderer, and compress each body with gzip and Brotli as "
+        "CompressionMiddleware would. Reports render and compression times and "
+        "the bytes each combination puts on the wire."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="username to act as (default: busiest)")
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = bench_endpoints.Command().acting_user(options["user"])
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get("/cards/all/", {"page_size": options["page_size"]})
+        if response.status_code != 200:
+            raise CommandError(f"GET /cards/all/: {response.status_code}")
+        data = response.data
+        self.stdout.write(
+            f"/cards/all/ page of {len(data['results'])} cards, "
+            f"{options['iterations']} iterations"
+        )
+
+        contenders = [("json (DRF)", JSONRenderer())]
+        if renderers.orjson is not None:
+            contenders.append(("json (orjson)", renderers.FastJSONRenderer()))
+        if renderers.MessagePackRenderer.available:
+            contenders.append(("msgpack", renderers.MessagePackRenderer()))
+        codings = ["gzip"] + (["br"] if compression.brotli is not None else [])
+
+        reference = None
+        for name, renderer in contenders:
+            seconds, body = self.timed(
+                lambda: renderer.render(data, renderer.media_type), options
+            )
+            if renderer.format == "json":
+                if reference is not None and body != reference:
+                    self.stderr.write(f"{name} differs from DRF's output")
+                reference = reference or body
+            line = f"{name:<14} render {seconds * 1000:7.2f} ms {len(body):>9} B"
+            for coding in codings:
+                elapsed, compressed = self.timed(
+                    lambda: compression.compress(body, coding), options
+                )
+                line += f"  {coding} {len(compressed):>8} B ({elapsed * 1000:5.2f} ms)"
+            self.stdout.write(line)
+        if "br" not in codings:
+            self.stdout.write("brotli is not installed; Brotli was skipped")
+        self.stdout.write(
+            f"gzip level {settings.COMPRESSION_GZIP_LEVEL}, "
+            f"Brotli quality {settings.COMPRESSION_BROTLI_QUALITY}"
+        )
+
+    def timed(self, function, options):
+        """Mean seconds per call of ``function``, and what it returned."""
+        start = time.perf_counter()
+        for _ in range(options["iterations"]):
+            result = function()
+        return (time.perf_counter() - start) / options["iterations"], result
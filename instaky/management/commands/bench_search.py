@@ -0,0 +1,83 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from instaky.models import Card
+from instaky.search import Matches
+from rest_framework.test import APIClient
+from users.models import User
+
+from .bench_endpoints import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Time /cards/search/ against the current database (see generate_data; "
+        "--users 20000 --cards 50 gives about a million cards). Without --query, "
+        "searches for a common, a middling and a rare word taken from the cards, "
+        "two of them together and a word that matches nothing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--query", nargs="+", help="queries to run")
+        parser.add_argument("--requests", type=int, default=20, help="per query")
+        parser.add_argument("--page-size", type=int, default=20)
+        parser.add_argument(
+            "--naive",
+            action="store_true",
+            help="also time the icontains scan the index replaces",
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.order_by("id").first()
+        if user is None:
+            raise CommandError("The database is empty; run generate_data first")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        self.stdout.write(
+            f"{Card.objects.count()} cards on {connection.vendor}, "
+            f"{options['requests']} runs per query"
+        )
+        size = options["page_size"]
+        for query in options["query"] or self.default_queries():
+            matches = Matches(query)
+            index = self.time(lambda: matches[0 : size + 1], options["requests"])
+            endpoint = self.time(
+                lambda: client.get("/cards/search/", {"q": query, "page_size": size}),
+                options["requests"],
+            )
+            line = (
+                f"{query!r:<24} index p50 {percentile(index, 0.5):>8.2f} ms  "
+                f"p99 {percentile(index, 0.99):>8.2f} ms  "
+                f"request p50 {percentile(endpoint, 0.5):>8.2f} ms"
+            )
+            if options["naive"]:
+                scan = matches.fallback()
+                naive = self.time(lambda: list(scan[0:size]), 1)
+                line += f"  icontains {naive[0]:>9.2f} ms"
+            self.stdout.write(line)
+
+    def time(self, run, count):
+        samples = []
+        for _ in range(count):
+            start = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - start) * 1000)
+        return samples
+
+    def default_queries(self):
+        texts = Card.objects.order_by("?").values_list("outer_text", flat=True)
+        words = Counter(
+            word for text in texts[:2000] for word in text.lower().split()
+        ).most_common()
+        if not words:
+            raise CommandError("The cards have no text to search for")
+        common, middling, rare = (
+            words[0][0],
+            words[len(words) // 2][0],
+            words[-1][0],
+        )
+        # a word in no card shows what a miss costs
+        return [common, middling, rare, f"{common} {middling}", "qqqq"]
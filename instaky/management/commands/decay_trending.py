@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from instaky import trending
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the trending scores that have decayed below TRENDING_MIN_SCORE. "
+        "Run it periodically, e.g. hourly, to keep the score table small."
+    )
+
+    def handle(self, *args, **options):
+        pruned = trending.prune()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {pruned} trending scores"))
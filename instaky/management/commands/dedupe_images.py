@@ -0,0 +1,47 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from instaky import content, images
+from instaky.models import Card, StoredImage
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Move card images and profile pictures into the content-addressed store, "
+        "merging duplicates."
+    )
+
+    def handle(self, *args, **options):
+        before = StoredImage.objects.count()
+        for model, field_name in [(Card, "image"), (User, "profile_picture")]:
+            field = model._meta.get_field(field_name)
+            hashed = StoredImage.objects.exclude(digest="").values("name")
+            instances = (
+                model.objects.exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .exclude(**{f"{field_name}__in": hashed})
+            )
+
+            moved = missing = 0
+            for instance in instances.order_by("pk").iterator():
+                field_file = getattr(instance, field_name)
+                if not field_file.storage.exists(field_file.name):
+                    missing += 1
+                    continue
+                with field_file.storage.open(field_file.name, "rb") as original:
+                    name = content.store(field, File(original, field_file.name))
+
+                content.release(instance, field_name)
+                model.objects.filter(pk=instance.pk).update(**{field_name: name})
+                instance.refresh_from_db()
+                images.reset(instance, field_name)
+                images.process(model, instance.pk, field_name)
+                moved += 1
+            self.stdout.write(
+                f"{model._meta.label}.{field_name}: moved {moved}, missing {missing}"
+            )
+
+        after = StoredImage.objects.count()
+        self.stdout.write(
+            self.style.SUCCESS(f"Images deduplicated ({before} -> {after} objects)")
+        )
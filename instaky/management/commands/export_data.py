@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from instaky import export
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Write cards, comments and likes as NDJSON or CSV, streaming rows from "
+        "the database as GET /export/ and /users/:id/export/ do."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="username to export (default: everyone)")
+        parser.add_argument(
+            "--format", choices=["ndjson", "csv"], default="ndjson", dest="fmt"
+        )
+        parser.add_argument(
+            "--type",
+            nargs="+",
+            choices=export.TYPES,
+            dest="types",
+            help="record types to export (default: all; CSV takes one)",
+        )
+        parser.add_argument("--output", help="file to write to (default: stdout)")
+        parser.add_argument(
+            "--gzip", action="store_true", help="gzip the output (needs --output)"
+        )
+        parser.add_argument("--database", default="default")
+
+    def handle(self, *args, **options):
+        types = options["types"] or export.TYPES
+        if options["fmt"] == "csv" and len(types) != 1:
+            raise CommandError("CSV exports one --type at a time")
+        if options["gzip"] and not options["output"]:
+            raise CommandError("--gzip needs --output")
+        user = None
+        if options["user"]:
+            user = (
+                User.objects.using(options["database"])
+                .filter(username=options["user"])
+                .first()
+            )
+            if user is None:
+                raise CommandError(f"No user named {options['user']}")
+
+        body = export.chunks(
+            export.lines(options["fmt"], types, user, options["database"])
+        )
+        if not options["output"]:
+            for chunk in body:
+                self.stdout.write(chunk.decode(), ending="")
+            return
+
+        if options["gzip"]:
+            body = export.gzipped(body)
+        written = 0
+        with open(options["output"], "wb") as output:
+            for chunk in body:
+                output.write(chunk)
+                written += len(chunk)
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"),
+        )
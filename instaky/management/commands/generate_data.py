@@ -0,0 +1,276 @@
+import random
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from instaky import content, images, suggestions, timeline
+from instaky.models import Card, Comment, StoredImage
+from PIL import Image, ImageDraw
+from users.models import Follow, User
+
+
+def heavy_tailed(rng, mean, cap):
+    """Pareto(1.5) sample scaled to ``mean`` (its mean is 3), capped at ``cap``."""
+    return min(cap, int(mean * rng.paretovariate(1.5) / 3))
+
+
+def vocabulary(rng, size):
+    """``size`` distinct pronounceable pseudo-words."""
+    consonants, vowels = "bdfgklmnprstvz", "aeiou"
+    words = set()
+    while len(words) < size:
+        words.add(
+            "".join(
+                rng.choice(consonants) + rng.choice(vowels)
+                for _ in range(rng.randint(2, 4))
+            )
+        )
+    return sorted(words)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic data set for benchmarking: users with a power-law "
+        "follower graph, cards (some with images), comments and likes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument(
+            "--follows", type=int, default=20, help="mean accounts followed per user"
+        )
+        parser.add_argument(
+            "--cards", type=int, default=5, help="mean cards posted per user"
+        )
+        parser.add_argument("--comments", type=int, default=3, help="mean per card")
+        parser.add_argument("--likes", type=int, default=10, help="mean per card")
+        parser.add_argument(
+            "--alpha",
+            type=float,
+            default=1.1,
+            help="Zipf exponent of account popularity (who gets followed)",
+        )
+        parser.add_argument(
+            "--images",
+            type=float,
+            default=0.2,
+            help="fraction of cards with an image",
+        )
+        parser.add_argument(
+            "--image-pool",
+            type=int,
+            default=20,
+            help="distinct images shared between the cards that have one",
+        )
+        parser.add_argument(
+            "--vocabulary",
+            type=int,
+            default=5000,
+            help="distinct words in card and comment text, used with Zipf frequencies",
+        )
+        parser.add_argument("--days", type=int, default=90, help="posting window")
+        parser.add_argument("--prefix", default="synthetic-", help="username prefix")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=options["prefix"]).exists():
+            raise CommandError(
+                f"Users named {options['prefix']}* already exist; pick another --prefix"
+            )
+        self.prefix = options["prefix"]
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.now = timezone.now()
+        self.window = timedelta(days=options["days"]).total_seconds()
+        self.words = vocabulary(self.rng, options["vocabulary"])
+        self.word_weights = list(
+            accumulate(1 / rank for rank in range(1, len(self.words) + 1))
+        )
+
+        with transaction.atomic():
+            users = self.create_users(options["users"])
+            follows = self.create_follows(users, options["follows"], options["alpha"])
+            cards = self.create_cards(users, options["cards"])
+            comments = self.create_comments(users, cards, options["comments"])
+            likes = self.create_likes(users, cards, comments, options["likes"])
+            with_images = self.attach_images(
+                cards, options["images"], options["image_pool"]
+            )
+
+        self.stdout.write("Reconciling counters, building timelines and suggestions...")
+        call_command(
+            "reconcile_counters", batch_size=self.batch_size, stdout=self.stdout
+        )
+        for user in User.objects.filter(username__startswith=self.prefix).iterator():
+            timeline.rebuild(user)
+        suggestions.refresh_all(self.batch_size)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {len(users)} users, {follows} follows, {len(cards)} "
+                f"cards ({with_images} with images), {len(comments)} comments "
+                f"and {likes} likes"
+            )
+        )
+
+    def posted_at(self):
+        return self.now - timedelta(seconds=self.rng.random() * self.window)
+
+    def text(self, low, high):
+        words = self.rng.choices(
+            self.words, cum_weights=self.word_weights, k=self.rng.randint(low, high)
+        )
+        return " ".join(words)[:255]
+
+    def create_users(self, count):
+        password = make_password(None)
+        User.objects.bulk_create(
+            (
+                User(username=f"{self.prefix}{n}", password=password)
+                for n in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        return list(
+            User.objects.filter(username__startswith=self.prefix)
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+
+    def create_follows(self, users, mean, alpha):
+        # Account popularity follows a Zipf law over a random ranking, so a
+        # few accounts have most of the followers; how many accounts each
+        # user follows is heavy-tailed too.
+        ranked = users[:]
+        self.rng.shuffle(ranked)
+        cumulative, total = [], 0.0
+        for rank in range(len(ranked)):
+            total += 1 / (rank + 1) ** alpha
+            cumulative.append(total)
+
+        rows = []
+        for follower in users:
+            count = heavy_tailed(self.rng, mean, len(users) - 1)
+            authors = set(self.rng.choices(ranked, cum_weights=cumulative, k=count))
+            authors.discard(follower)
+            rows += [
+                Follow(
+                    followed_id=author,
+                    follower_id=follower,
+                    created_at=self.posted_at(),
+                )
+                for author in authors
+            ]
+        Follow.objects.bulk_create(rows, batch_size=self.batch_size)
+        return len(rows)
+
+    def create_cards(self, users, mean):
+        colors = Card.CardColorChoices.values
+        fonts = Card.FontFamilyChoices.values
+        sizes = Card.FontSizeChoices.values
+        rows = [
+            Card(
+                user_id=user,
+                outer_text=self.text(2, 6),
+                inner_text=self.text(6, 25),
+                card_color=self.rng.choice(colors),
+                font_family=self.rng.choice(fonts),
+                font_size=self.rng.choice(sizes),
+            )
+            for user in users
+            for _ in range(heavy_tailed(self.rng, mean, 10 * mean))
+        ]
+        Card.objects.bulk_create(rows, batch_size=self.batch_size)
+
+        # auto_now_add stamps every row with "now"; spread them out afterwards.
+        cards = list(
+            Card.objects.filter(user__username__startswith=self.prefix).only("id")
+        )
+        for card in cards:
+            card.posted_at = self.posted_at()
+        Card.objects.bulk_update(cards, ["posted_at"], batch_size=self.batch_size)
+        return [card.id for card in cards]
+
+    def create_comments(self, users, cards, mean):
+        rows = [
+            Comment(card_id=card, user_id=self.rng.choice(users), body=self.text(3, 12))
+            for card in cards
+            for _ in range(int(self.rng.expovariate(1 / mean)) if mean else 0)
+        ]
+        Comment.objects.bulk_create(rows, batch_size=self.batch_size)
+
+        comments = list(
+            Comment.objects.filter(card__user__username__startswith=self.prefix).only(
+                "id"
+            )
+        )
+        for comment in comments:
+            comment.posted_at = self.posted_at()
+        Comment.objects.bulk_update(comments, ["posted_at"], batch_size=self.batch_size)
+        return [comment.id for comment in comments]
+
+    def create_likes(self, users, cards, comments, mean):
+        created = 0
+        for model, ids, field in [
+            (Card, cards, "card_id"),
+            (Comment, comments, "comment_id"),
+        ]:
+            Like = model.liked_by.through
+            rows = [
+                Like(**{field: target, "user_id": user})
+                for target in ids
+                for user in self.rng.sample(
+                    users, heavy_tailed(self.rng, mean, len(users))
+                )
+            ]
+            Like.objects.bulk_create(rows, batch_size=self.batch_size)
+            created += len(rows)
+            # comments get a fraction of the attention cards do
+            mean //= 5
+        return created
+
+    def image(self, n):
+        image = Image.new("RGB", (1080, 720), tuple(self.rng.choices(range(256), k=3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(20):
+            left, right = sorted(self.rng.sample(range(1080), 2))
+            draw.rectangle(
+                (left, 0, right, 720), fill=tuple(self.rng.choices(range(256), k=3))
+            )
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        return ContentFile(buffer.getvalue(), name=f"synthetic-{n}.jpg")
+
+    def attach_images(self, cards, fraction, pool_size):
+        chosen = [card for card in cards if self.rng.random() < fraction]
+        if not chosen or not pool_size:
+            return 0
+
+        field = Card._meta.get_field("image")
+        pool = {}
+        for card in chosen:
+            pool.setdefault(self.rng.randrange(pool_size), []).append(card)
+        for n, ids in pool.items():
+            # One real upload per distinct image; the other cards only take a
+            # reference, as they would when re-posting the same picture.
+            name = content.store(field, self.image(n))
+            StoredImage.objects.filter(name=name).update(
+                refcount=F("refcount") + len(ids) - 1
+            )
+            Card.objects.filter(id__in=ids).update(image=name)
+            images.process(Card, ids[0], "image")
+            stored = StoredImage.objects.get(name=name)
+            Card.objects.filter(id__in=ids).update(
+                image_width=stored.width,
+                image_height=stored.height,
+                image_variants=stored.variants,
+            )
+        return len(chosen)
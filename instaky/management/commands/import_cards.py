@@ -0,0 +1,113 @@
+import json
+import sys
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from instaky import bulk
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Create cards from an NDJSON file, one object of card fields per line "
+        'with the author as "username" (or --user for all of them). Lines are '
+        "validated and inserted --batch-size at a time, each batch in a "
+        "transaction. Imported cards are fanned out to timelines but not "
+        "announced on event streams."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON file to read, or - for stdin")
+        parser.add_argument("--user", help="username to create every card as")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="lines to validate and insert per transaction",
+        )
+        parser.add_argument(
+            "--report",
+            help='file to write a result per line to as NDJSON: {"line": n, '
+            '"id": ...} or {"line": n, "errors": {...}}',
+        )
+
+    def handle(self, *args, **options):
+        owner = None
+        if options["user"]:
+            owner = User.objects.filter(username=options["user"]).first()
+            if owner is None:
+                raise CommandError(f"No user named {options['user']}")
+
+        source = sys.stdin if options["path"] == "-" else open(options["path"])
+        report = open(options["report"], "w") if options["report"] else None
+        created = rejected = 0
+        start = time.perf_counter()
+        try:
+            lines = enumerate(source, start=1)
+            while True:
+                chunk = list(islice(lines, options["batch_size"]))
+                if not chunk:
+                    break
+                batch = [(number, line) for number, line in chunk if line.strip()]
+                for number, result in self.import_batch(batch, owner):
+                    if "id" in result:
+                        created += 1
+                    else:
+                        rejected += 1
+                        self.stderr.write(
+                            f"line {number}: {json.dumps(result['errors'])}"
+                        )
+                    if report:
+                        report.write(json.dumps({"line": number, **result}) + "\n")
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if report:
+                report.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {created} cards, rejected {rejected} lines "
+                f"in {elapsed:.1f}s ({created / elapsed if elapsed else 0:.0f} cards/s)"
+            )
+        )
+
+    def import_batch(self, batch, owner):
+        """Results for the (line number, line) pairs of ``batch``."""
+        parsed, results = [], {}
+        for number, line in batch:
+            try:
+                parsed.append((number, json.loads(line)))
+            except ValueError as exc:
+                results[number] = {
+                    "errors": {"non_field_errors": [f"Invalid JSON: {exc}"]}
+                }
+
+        users = {}
+        if owner is None:
+            names = {
+                data.get("username") for _, data in parsed if isinstance(data, dict)
+            }
+            users = User.objects.in_bulk(
+                [name for name in names if isinstance(name, str)], field_name="username"
+            )
+
+        entries, numbers = [], []
+        for number, data in parsed:
+            user = owner
+            if owner is None:
+                name = data.get("username") if isinstance(data, dict) else None
+                user = users.get(name) if isinstance(name, str) else None
+                if user is None:
+                    results[number] = {
+                        "errors": {"username": [f"No user named {name}."]}
+                    }
+                    continue
+            entries.append((user, data))
+            numbers.append(number)
+
+        for number, result in zip(numbers, bulk.create_cards(entries, publish=False)):
+            results[number] = result
+        return [(number, results[number]) for number, _ in batch]
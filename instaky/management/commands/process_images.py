@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from instaky import images
+from instaky.models import Card
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate image variants for card images and profile pictures that lack them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="regenerate variants for every image, not just unprocessed ones",
+        )
+
+    def handle(self, *args, **options):
+        for model, field_name in [(Card, "image"), (User, "profile_picture")]:
+            instances = model.objects.exclude(**{field_name: ""}).exclude(
+                **{f"{field_name}__isnull": True}
+            )
+            if not options["all"]:
+                instances = instances.filter(**{f"{field_name}_width__isnull": True})
+
+            processed = 0
+            regenerated = set()
+            for instance in instances.order_by("pk").iterator():
+                # Shared images only need their variants regenerated once.
+                name = getattr(instance, field_name).name
+                force = options["all"] and name not in regenerated
+                if options["all"]:
+                    images.discard(instance, field_name)
+                    regenerated.add(name)
+                images.process(model, instance.pk, field_name, force=force)
+                processed += 1
+            self.stdout.write(
+                f"{model._meta.label}.{field_name}: processed {processed}"
+            )
+        self.stdout.write(self.style.SUCCESS("Images processed"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from instaky import chunked
+
+
+class Command(BaseCommand):
+    help = "Delete resumable uploads that were never completed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age",
+            type=int,
+            default=None,
+            help="seconds since the upload started (default: CHUNKED_UPLOAD_MAX_AGE)",
+        )
+
+    def handle(self, *args, **options):
+        purged = chunked.purge(options["max_age"])
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} uploads"))
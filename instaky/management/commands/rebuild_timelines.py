@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from instaky import timeline
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Rebuild materialized following timelines from the follow graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "users", nargs="*", type=int, help="ids of users to rebuild (default: all)"
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by("id")
+        if options["users"]:
+            users = users.filter(id__in=options["users"])
+
+        rebuilt = 0
+        for user in users.iterator():
+            timeline.rebuild(user)
+            rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timelines"))
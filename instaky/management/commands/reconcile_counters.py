@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from instaky.models import Card, Comment
+from instaky.signals import related_count
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized like/comment counters and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="number of rows to check per query",
+        )
+
+    def handle(self, *args, **options):
+        counters = [
+            (Card, "like_count", related_count(Card.liked_by.through, "card")),
+            (Card, "comment_count", related_count(Comment, "card")),
+            (
+                Comment,
+                "like_count",
+                related_count(Comment.liked_by.through, "comment"),
+            ),
+        ]
+        for model, field, actual in counters:
+            repaired = self.reconcile(model, field, actual, options["batch_size"])
+            self.stdout.write(f"{model._meta.label}.{field}: repaired {repaired} rows")
+        self.stdout.write(self.style.SUCCESS("Counters reconciled"))
+
+    def reconcile(self, model, field, actual, batch_size):
+        repaired = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                return repaired
+            last_pk = batch[-1]
+
+            drifted = (
+                model.objects.filter(pk__in=batch)
+                .annotate(actual=actual)
+                .filter(~Q(**{field: F("actual")}))
+                .values_list("pk", flat=True)
+            )
+            repaired += model.objects.filter(pk__in=list(drifted)).update(
+                **{field: actual}
+            )
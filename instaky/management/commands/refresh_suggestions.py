@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from instaky import suggestions
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's follow suggestions from the follow graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="users per transaction (default: SUGGESTIONS_BATCH_SIZE)",
+        )
+
+    def handle(self, *args, **options):
+        refreshed = suggestions.refresh_all(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {refreshed} users"))
@@ -0,0 +1,353 @@
+"""
+Always-on per-endpoint request metrics.
+
+MetricsMiddleware times every request and, per URL name ("card-all",
+"card-following", "user-list", ...) and method, records histograms of
+
+    instaky_request_duration_seconds        wall time of the whole request
+    instaky_request_sql_seconds             time spent waiting on SQL
+    instaky_request_serialization_seconds   time from the view onwards that
+                                            was not SQL, i.e. building and
+                                            rendering the response
+    instaky_request_queries                 number of SQL queries
+    instaky_response_bytes                  size of the response body
+
+and a counter of responses by status code. GET /metrics/ returns them in the
+Prometheus text format; scrapers send METRICS_TOKEN as a bearer token, and
+without one configured the endpoint only answers when DEBUG is on.
+
+Each worker keeps its numbers in memory and copies them to the cache named by
+METRICS_CACHE_ALIAS at most every METRICS_FLUSH_SECONDS; the endpoint merges
+the copies of every live worker, so a scrape sees the whole deployment when
+the cache is shared (Redis) and just the current process when it is not.
+
+Requests slower than SLOW_REQUEST_SECONDS are logged to the
+"instaky.slow_requests" logger together with their slowest queries.
+
+Queries are attributed to the request through a context variable rather than
+a wrapper around the request thread's connections: under ASGI a view's ORM
+code runs in other threads (every sync view, and the concurrent sub-queries
+of async_views.py), and asgiref carries context variables into them.
+instrument() puts timed_execute on a thread's connections; it runs at the
+start of every request and in the worker threads of the async views.
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_started
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.utils.deprecation import MiddlewareMixin
+
+slow_logger = logging.getLogger("instaky.slow_requests")
+
+WORKERS_KEY = "metrics:workers"
+
+HISTOGRAMS = {
+    "instaky_request_duration_seconds": (
+        "Request wall time.",
+        "METRICS_LATENCY_BUCKETS",
+    ),
+    "instaky_request_sql_seconds": (
+        "Time spent executing SQL.",
+        "METRICS_LATENCY_BUCKETS",
+    ),
+    "instaky_request_serialization_seconds": (
+        "Time from the view onwards spent outside SQL.",
+        "METRICS_LATENCY_BUCKETS",
+    ),
+    "instaky_request_queries": (
+        "SQL queries per request.",
+        "METRICS_QUERY_BUCKETS",
+    ),
+    "instaky_response_bytes": (
+        "Response body size.",
+        "METRICS_SIZE_BUCKETS",
+    ),
+}
+
+REQUESTS_TOTAL = "instaky_requests_total"
+
+# The QueryTimer of the request being handled, if any.
+current_timer = ContextVar("instaky_query_timer", default=None)
+
+_lock = threading.Lock()
+_histograms = {}
+_requests = {}
+_last_flush = 0.0
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def backend():
+    return caches[settings.METRICS_CACHE_ALIAS]
+
+
+def observe(name, labels, value):
+    buckets = getattr(settings, HISTOGRAMS[name][1])
+    series = _histograms.setdefault(name, {})
+    counts = series.get(labels)
+    if counts is None:
+        # one slot per bucket plus +Inf, then the sum
+        counts = series[labels] = [0] * (len(buckets) + 1) + [0.0]
+    counts[bisect_left(buckets, value)] += 1
+    counts[-1] += value
+
+
+def record(view, method, status, duration, sql_time, serialization, queries, size):
+    global _last_flush
+    labels = (view, method)
+    with _lock:
+        observe("instaky_request_duration_seconds", labels, duration)
+        observe("instaky_request_sql_seconds", labels, sql_time)
+        observe("instaky_request_serialization_seconds", labels, serialization)
+        observe("instaky_request_queries", labels, queries)
+        observe("instaky_response_bytes", labels, size)
+        key = (view, method, str(status))
+        _requests[key] = _requests.get(key, 0) + 1
+
+        now = time.monotonic()
+        due = now - _last_flush >= settings.METRICS_FLUSH_SECONDS
+        if due:
+            _last_flush = now
+    if due:
+        flush()
+
+
+def snapshot():
+    with _lock:
+        return {
+            "histograms": {
+                name: {labels: list(counts) for labels, counts in series.items()}
+                for name, series in _histograms.items()
+            },
+            "requests": dict(_requests),
+        }
+
+
+def flush():
+    """Publish this worker's numbers for the metrics endpoint to merge."""
+    store = backend()
+    timeout = settings.METRICS_WORKER_TIMEOUT
+    me = worker_id()
+    store.set(f"metrics:worker:{me}", snapshot(), timeout)
+
+    # Read-modify-write; a worker lost to a race re-registers on its next flush.
+    now = time.time()
+    workers = {
+        worker: seen
+        for worker, seen in store.get(WORKERS_KEY, {}).items()
+        if now - seen < timeout
+    }
+    workers[me] = now
+    store.set(WORKERS_KEY, workers, timeout)
+
+
+def collect():
+    """Merge the snapshots of every live worker."""
+    flush()
+    workers = backend().get(WORKERS_KEY, {})
+    snapshots = backend().get_many([f"metrics:worker:{worker}" for worker in workers])
+
+    histograms, requests = {}, {}
+    for data in snapshots.values():
+        for name, series in data["histograms"].items():
+            merged = histograms.setdefault(name, {})
+            for labels, counts in series.items():
+                if labels in merged:
+                    merged[labels] = [a + b for a, b in zip(merged[labels], counts)]
+                else:
+                    merged[labels] = list(counts)
+        for key, count in data["requests"].items():
+            requests[key] = requests.get(key, 0) + count
+    return histograms, requests
+
+
+def format_labels(**labels):
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def exposition():
+    """Render the merged metrics in the Prometheus text format (0.0.4)."""
+    histograms, requests = collect()
+    lines = []
+    for name, (help_text, buckets_setting) in HISTOGRAMS.items():
+        buckets = getattr(settings, buckets_setting)
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for (view, method), counts in sorted(histograms.get(name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(buckets + ["+Inf"], counts):
+                cumulative += count
+                labels = format_labels(view=view, method=method, le=bound)
+                lines.append(f"{name}_bucket{labels} {cumulative}")
+            labels = format_labels(view=view, method=method)
+            lines.append(f"{name}_sum{labels} {counts[-1]}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+
+    lines += [
+        f"# HELP {REQUESTS_TOTAL} Responses by view, method and status.",
+        f"# TYPE {REQUESTS_TOTAL} counter",
+    ]
+    for (view, method, status), count in sorted(requests.items()):
+        labels = format_labels(view=view, method=method, status=status)
+        lines.append(f"{REQUESTS_TOTAL}{labels} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class QueryTimer:
+    """execute_wrapper that counts and times queries, keeping the slowest."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.count = 0
+        self.time = 0.0
+        self.slowest = []
+        # async views run several queries at once
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.count += 1
+                self.time += elapsed
+                entry = (elapsed, self.count, sql)
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heappushpop(self.slowest, entry)
+
+
+def timed_execute(execute, sql, params, many, context):
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def instrument(**kwargs):
+    """Time the queries of this thread's connections (idempotent)."""
+    for connection in connections.all():
+        if timed_execute not in connection.execute_wrappers:
+            # first, so that execute_wrapper() blocks still pop their own
+            connection.execute_wrappers.insert(0, timed_execute)
+
+
+request_started.connect(instrument)
+
+
+def view_name(request):
+    match = getattr(request, "resolver_match", None)
+    # Unresolved paths are lumped together to keep label cardinality bounded.
+    return match.view_name if match and match.view_name else "unmatched"
+
+
+def response_size(response):
+    if response.streaming:
+        return 0
+    return len(response.content)
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token, start = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.finish(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        token, start = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.finish(request, response, start)
+        return response
+
+    def start(self, request):
+        timer = request.query_timer = QueryTimer(settings.SLOW_REQUEST_LOGGED_QUERIES)
+        return current_timer.set(timer), time.perf_counter()
+
+    def finish(self, request, response, start):
+        end = time.perf_counter()
+        timer = request.query_timer
+
+        # Measured from the view onwards, so that middleware (sessions, auth)
+        # does not count as serialization.
+        view_start, sql_before_view = getattr(request, "view_started", (start, 0.0))
+        serialization = (end - view_start) - (timer.time - sql_before_view)
+
+        view = view_name(request)
+        record(
+            view,
+            request.method,
+            response.status_code,
+            end - start,
+            timer.time,
+            max(serialization, 0.0),
+            timer.count,
+            response_size(response),
+        )
+
+        threshold = settings.SLOW_REQUEST_SECONDS
+        if threshold is not None and end - start >= threshold:
+            log_slow_request(request, view, end - start, timer)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.view_started = (time.perf_counter(), request.query_timer.time)
+
+
+def log_slow_request(request, view, duration, timer):
+    queries = "\n".join(
+        f"  {elapsed * 1000:.1f} ms  {sql}"
+        for elapsed, _, sql in sorted(timer.slowest, reverse=True)
+    )
+    slow_logger.warning(
+        "Slow request %s %s (%s): %.3f s, %d queries in %.3f s; slowest:\n%s",
+        request.method,
+        request.get_full_path(),
+        view,
+        duration,
+        timer.count,
+        timer.time,
+        queries,
+    )
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        expected = f"Bearer {token}"
+        if not constant_time_compare(
+            request.META.get("HTTP_AUTHORIZATION", ""), expected
+        ):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        # without a token the endpoint is only open in development
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type="text/plain; version=0.0.4")
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('instaky', '0002_auto_20201025_2109'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['-posted_at', '-id'], name='card_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', '-posted_at', '-id'], name='card_user_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_timelines(apps, schema_editor):
+    Card = apps.get_model("instaky", "Card")
+    TimelineEntry = apps.get_model("instaky", "TimelineEntry")
+    User = apps.get_model("users", "User")
+
+    for user in User.objects.iterator():
+        cards = Card.objects.filter(user__followers=user).order_by("-posted_at")
+        TimelineEntry.objects.bulk_create(
+            TimelineEntry(
+                owner_id=user.id,
+                card_id=card.id,
+                author_id=card.user_id,
+                posted_at=card.posted_at,
+            )
+            for card in cards[: settings.TIMELINE_REBUILD_SIZE]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instaky", "0003_card_feed_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TimelineEntry",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("posted_at", models.DateTimeField()),
+                (
+                    "author",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "card",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timeline_entries",
+                        to="instaky.card",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="timeline_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["owner", "-posted_at", "-id"],
+                        name="timeline_owner_feed_idx",
+                    ),
+                    models.Index(
+                        fields=["owner", "author"], name="timeline_owner_author_idx"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("owner", "card"), name="unique_timeline_entry"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_timelines, migrations.RunPython.noop),
+    ]
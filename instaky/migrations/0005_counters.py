@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_rows(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Card = apps.get_model("instaky", "Card")
+    Comment = apps.get_model("instaky", "Comment")
+
+    Card.objects.update(
+        like_count=count_rows(Card.liked_by.through, "card"),
+        comment_count=count_rows(Comment, "card"),
+    )
+    Comment.objects.update(
+        like_count=count_rows(Comment.liked_by.through, "comment"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instaky", "0004_timelineentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="card",
+            name="comment_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="card",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="comment",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instaky", "0005_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="card",
+            name="image_height",
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="card",
+            name="image_variants",
+            field=models.JSONField(default=list, editable=False),
+        ),
+        migrations.AddField(
+            model_name="card",
+            name="image_width",
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instaky", "0008_storedimage"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["user", "-posted_at", "-id"], name="comment_user_feed_idx"
+            ),
+        ),
+    ]
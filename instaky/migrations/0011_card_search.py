@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:37
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# PostgreSQL only: SQLite gets an FTS5 index from instaky.search.install().
+CREATE_TRIGGERS = """
+CREATE FUNCTION instaky_card_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', NEW.outer_text), 'A')
+        || setweight(to_tsvector('english', NEW.inner_text), 'B')
+        || setweight(to_tsvector('english', coalesce(
+            (SELECT string_agg(body, ' ') FROM instaky_comment
+             WHERE card_id = NEW.id),
+            ''
+        )), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER instaky_card_search_vector
+BEFORE INSERT OR UPDATE OF outer_text, inner_text ON instaky_card
+FOR EACH ROW EXECUTE PROCEDURE instaky_card_search_vector();
+
+CREATE FUNCTION instaky_comment_search_vector() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE instaky_card
+        SET search_vector =
+            search_vector || setweight(to_tsvector('english', NEW.body), 'C')
+        WHERE id = NEW.card_id;
+        RETURN NULL;
+    END IF;
+    -- Touching outer_text fires the card trigger, which re-reads the comments.
+    UPDATE instaky_card SET outer_text = outer_text WHERE id = OLD.card_id;
+    IF TG_OP = 'UPDATE' AND NEW.card_id <> OLD.card_id THEN
+        UPDATE instaky_card SET outer_text = outer_text WHERE id = NEW.card_id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER instaky_comment_search_vector
+AFTER INSERT OR UPDATE OF body, card_id OR DELETE ON instaky_comment
+FOR EACH ROW EXECUTE PROCEDURE instaky_comment_search_vector();
+
+UPDATE instaky_card SET outer_text = outer_text;
+
+CREATE INDEX card_search_idx ON instaky_card USING gin (search_vector);
+"""
+
+DROP_TRIGGERS = """
+DROP INDEX IF EXISTS card_search_idx;
+DROP TRIGGER IF EXISTS instaky_comment_search_vector ON instaky_comment;
+DROP FUNCTION IF EXISTS instaky_comment_search_vector();
+DROP TRIGGER IF EXISTS instaky_card_search_vector ON instaky_card;
+DROP FUNCTION IF EXISTS instaky_card_search_vector();
+"""
+
+
+def run_on_postgresql(sql):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(sql, params=None)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instaky", "0010_suggestion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="card",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(
+            run_on_postgresql(CREATE_TRIGGERS), run_on_postgresql(DROP_TRIGGERS)
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instaky", "0011_card_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TrendingScore",
+            fields=[
+                (
+                    "card",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="trending",
+                        serialize=False,
+                        to="instaky.card",
+                    ),
+                ),
+                ("score", models.FloatField()),
+            ],
+            options={
+                "indexes": [models.Index(fields=["-score", "-card"], name="trending_score_idx")],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("instaky", "0012_trendingscore"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["card", "-posted_at", "-id"], name="comment_card_feed_idx"
+            ),
+        ),
+    ]
@@ -1,7 +1,26 @@
+import uuid
+
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from users.models import User
 
 
+def save_without_derived_fields(instance, kwargs):
+    """
+    Derived fields (counters, image metadata) are only ever written with
+    queryset UPDATEs from signals.py and images.py, so a plain save() of an
+    existing row must leave them alone or it would write back whatever stale
+    value was loaded with the instance.
+    """
+    if instance._state.adding or kwargs.get("update_fields") is not None:
+        return
+    kwargs["update_fields"] = [
+        field.name
+        for field in instance._meta.concrete_fields
+        if not field.primary_key and field.name not in instance.derived_fields
+    ]
+
+
 class Card(models.Model):
     outer_text = models.CharField(max_length=255, null=False, blank=False)
 
@@ -102,12 +121,47 @@ class Card(models.Model):
 
     image = models.ImageField(upload_to="post_images/", null=True, blank=True)
 
+    image_width = models.PositiveIntegerField(null=True, editable=False)
+
+    image_height = models.PositiveIntegerField(null=True, editable=False)
+
+    image_variants = models.JSONField(default=list, editable=False)
+
     liked_by = models.ManyToManyField(to=User, related_name="liked_cards", blank=True)
 
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Maintained by database triggers on PostgreSQL (see search.py), unused
+    # elsewhere.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    derived_fields = (
+        "like_count",
+        "comment_count",
+        "image_width",
+        "image_height",
+        "image_variants",
+        "search_vector",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-posted_at", "-id"], name="card_feed_idx"),
+            models.Index(
+                fields=["user", "-posted_at", "-id"], name="card_user_feed_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.id}"
         # this needs to change, maybe? idk how we should specify which card to link comments to
 
+    def save(self, *args, **kwargs):
+        save_without_derived_fields(self, kwargs)
+        super().save(*args, **kwargs)
+
 
 class Comment(models.Model):
     body = models.CharField(max_length=255, blank=False, null=False)
@@ -122,5 +176,172 @@ class Comment(models.Model):
         to=User, related_name="liked_comments", blank=True
     )
 
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+
+    derived_fields = ("like_count",)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "-posted_at", "-id"], name="comment_user_feed_idx"
+            ),
+            models.Index(
+                fields=["card", "-posted_at", "-id"], name="comment_card_feed_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"{self.body}"
+
+    def save(self, *args, **kwargs):
+        save_without_derived_fields(self, kwargs)
+        super().save(*args, **kwargs)
+
+
+class TimelineEntry(models.Model):
+    """
+    One card in one user's materialized following feed. Rows are written when
+    a card is posted (fan-out on write) and when a follow is added, so reading
+    the feed is a range scan over (owner, posted_at) instead of a join through
+    the follower table.
+    """
+
+    owner = models.ForeignKey(
+        to=User, on_delete=models.CASCADE, related_name="timeline_entries"
+    )
+
+    card = models.ForeignKey(
+        to=Card, on_delete=models.CASCADE, related_name="timeline_entries"
+    )
+
+    author = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="+")
+
+    posted_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "card"], name="unique_timeline_entry"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["owner", "-posted_at", "-id"], name="timeline_owner_feed_idx"
+            ),
+            models.Index(fields=["owner", "author"], name="timeline_owner_author_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.owner_id}: {self.card_id}"
+
+
+class Suggestion(models.Model):
+    """
+    One "who to follow" candidate for ``owner``. ``mutual_count`` is how many
+    accounts the owner follows that follow the candidate; ``popularity`` is a
+    bonus for being among the most-followed accounts. Written by
+    suggestions.py in batch and adjusted when follows change.
+    """
+
+    owner = models.ForeignKey(
+        to=User, on_delete=models.CASCADE, related_name="suggestions"
+    )
+
+    candidate = models.ForeignKey(to=User, on_delete=models.CASCADE, related_name="+")
+
+    mutual_count = models.IntegerField(default=0)
+
+    popularity = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "candidate"], name="unique_suggestion"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.owner_id}: {self.candidate_id}"
+
+
+class TrendingScore(models.Model):
+    """
+    A card's trending score, as log2 of its weighted likes and comments
+    counted from a fixed epoch (see trending.py). Only cards with recent
+    activity have a row.
+    """
+
+    card = models.OneToOneField(
+        to=Card, on_delete=models.CASCADE, primary_key=True, related_name="trending"
+    )
+
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [models.Index(fields=["-score", "-card"], name="trending_score_idx")]
+
+    def __str__(self):
+        return f"{self.card_id}: {self.score}"
+
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable upload in progress. The bytes received so far are spooled to
+    a temporary file (see chunked.py); ``offset`` is how many of them there
+    are. ``target``/``target_pk``/``field`` say which image field the finished
+    file is attached to.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+
+    user = models.ForeignKey(
+        to=User, on_delete=models.CASCADE, related_name="chunked_uploads"
+    )
+
+    target = models.CharField(max_length=100)
+
+    target_pk = models.PositiveIntegerField()
+
+    field = models.CharField(max_length=100)
+
+    filename = models.CharField(max_length=255)
+
+    content_type = models.CharField(max_length=100)
+
+    size = models.PositiveBigIntegerField()
+
+    offset = models.PositiveBigIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+class StoredImage(models.Model):
+    """
+    One object in the content-addressed image store (see content.py), shared
+    by every card image and profile picture with the same bytes. ``refcount``
+    is how many of those fields point at it; the object and its variants are
+    deleted when it drops to zero. ``digest`` is empty for direct uploads that
+    have not been hashed yet (dedupe_images takes care of those).
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+
+    digest = models.CharField(max_length=64, blank=True, db_index=True)
+
+    size = models.PositiveBigIntegerField()
+
+    refcount = models.PositiveIntegerField(default=0)
+
+    width = models.PositiveIntegerField(null=True)
+
+    height = models.PositiveIntegerField(null=True)
+
+    variants = models.JSONField(default=list)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+
+from rest_framework.pagination import (
+    BasePagination,
+    CursorPagination,
+    _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CardCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the card feeds. The cursor encodes the last
+    posted_at seen, so each page is an index range scan on (posted_at, id)
+    no matter how deep the client has scrolled. id breaks ties between cards
+    posted in the same instant, which keeps "load more" stable while new
+    cards are being posted at the top of the feed.
+    """
+
+    ordering = ("-posted_at", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class CommentCursorPagination(CardCursorPagination):
+    """The same keyset pagination for per-card and per-user comment lists."""
+
+
+class FollowCursorPagination(CursorPagination):
+    """Follower and following lists, newest follow first."""
+
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class SearchPagination(BasePagination):
+    """
+    Numbered pages of search results, ordered by relevance. Every page ranks
+    the whole match set again, so a keyset cursor would save nothing; the
+    page is fetched with one extra row to tell whether there is a next one
+    instead of counting all the matches.
+    """
+
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    page_query_param = "page"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page = self.get_number(self.page_query_param, default=1)
+        size = min(
+            self.get_number(self.page_size_query_param, default=self.page_size),
+            self.max_page_size,
+        )
+        offset = (self.page - 1) * size
+        rows = list(queryset[offset : offset + size + 1])
+        self.has_next = len(rows) > size
+        return rows[:size]
+
+    def get_number(self, name, default):
+        try:
+            return _positive_int(self.request.query_params[name], strict=True)
+        except (KeyError, ValueError):
+            return default
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page + 1)
+
+    def get_previous_link(self):
+        if self.page == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page - 1)
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+
+class TrendingPagination(CursorPagination):
+    """
+    Keyset pagination for trending cards, on the (score, card) index. The
+    cursor encodes the last score seen, so a deep page costs no more than the
+    first, and a card does not show up twice while likes move the others
+    between pages.
+    """
+
+    ordering = ("-score", "-card")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
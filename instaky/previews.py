@@ -0,0 +1,210 @@
+"""
+Server-rendered card previews, for Open Graph tags and emails.
+
+    GET /cards/:id/preview/   redirects to a PNG of the card's front
+                              (?format=webp or Accept: image/webp for WebP)
+
+A preview is drawn (drawing.py) from the fields that show on the front of a
+card, and is stored under a hash of them,
+
+    previews/sha256/<first two hex digits>/<hash>.<png|webp>
+
+so cards that look the same share one file, no look is ever drawn twice, and
+a file's bytes never change under its URL. Editing a card changes the hash,
+so its next preview request draws the new look; the old file is deleted
+unless another card still looks that way. The redirect itself is cached for
+PREVIEW_REDIRECT_MAX_AGE seconds.
+
+Drawing takes a CPU for tens of milliseconds, so it runs in a pool of
+PREVIEW_RENDER_PROCESSES processes (0 draws in the requesting thread) and
+concurrent requests for the same preview wait for the same drawing.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as RenderTimeout
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Q
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import BaseRenderer
+
+from . import drawing
+from .content import ADDRESS_DIRECTORY
+from .models import Card
+
+# What shows on the front of a card, and so what a preview depends on.
+STYLE_FIELDS = [
+    "outer_text",
+    "card_color",
+    "border_style",
+    "font_family",
+    "font_style",
+    "text_align",
+    "font_size",
+    "image",
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+_rendering = {}
+_rendering_lock = threading.Lock()
+
+
+class PreviewUnavailable(APIException):
+    status_code = 503
+    default_detail = "The preview is taking too long to draw; try again shortly."
+    default_code = "preview_unavailable"
+
+
+class PNGRenderer(BaseRenderer):
+    """Content negotiation for previews; only errors are rendered here."""
+
+    media_type = "image/png"
+    format = "png"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data).encode()
+
+
+class WebPRenderer(PNGRenderer):
+    media_type = "image/webp"
+    format = "webp"
+
+
+def executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned rather than forked from a process full of threads and
+            # open connections; drawing.py needs no Django to run.
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.PREVIEW_RENDER_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def style(card):
+    """The values of STYLE_FIELDS for a Card or a dict of them."""
+    if isinstance(card, dict):
+        values = card
+    else:
+        values = {name: getattr(card, name) for name in STYLE_FIELDS}
+    return {**values, "image": str(values["image"] or "")}
+
+
+def key(values, fmt):
+    payload = [drawing.VERSION, list(settings.PREVIEW_SIZE), fmt]
+    payload += [values[name] for name in STYLE_FIELDS]
+    return hashlib.sha256(json.dumps(payload).encode()).hexdigest()
+
+
+def preview_name(digest, fmt):
+    return posixpath.join("previews", ADDRESS_DIRECTORY, digest[:2], f"{digest}.{fmt}")
+
+
+def memo_key(name):
+    return f"preview:{name}"
+
+
+def picture(card):
+    """The bytes of the smallest version of the card's image that will do."""
+    if not card.image:
+        return None
+    wide_enough = [
+        variant
+        for variant in card.image_variants
+        if variant["format"] == "jpeg"
+        and variant["width"] >= settings.PREVIEW_SIZE[0] // 2
+    ]
+    name = card.image.name
+    if wide_enough:
+        name = min(wide_enough, key=lambda variant: variant["width"])["name"]
+    with card.image.storage.open(name, "rb") as f:
+        return f.read()
+
+
+def arguments(card, fmt):
+    fonts = settings.PREVIEW_FONTS.get(card.font_family, {})
+    return dict(
+        text=card.outer_text,
+        color=card.card_color,
+        border=card.border_style,
+        font_name=fonts.get(card.font_style, fonts.get("N", "DejaVuSans.ttf")),
+        underline=card.font_style == Card.FontStyleChoices.UNDERLINE,
+        align=card.text_align,
+        font_size=card.font_size,
+        picture=picture(card),
+        size=tuple(settings.PREVIEW_SIZE),
+        fmt=fmt,
+        quality=settings.IMAGE_VARIANT_QUALITY,
+    )
+
+
+def render(card, fmt, name):
+    """Draw and store a preview, unless it is already being drawn."""
+    with _rendering_lock:
+        drawn = _rendering.get(name)
+        owner = drawn is None
+        if owner:
+            drawn = _rendering[name] = threading.Event()
+    if not owner:
+        drawn.wait(settings.PREVIEW_RENDER_TIMEOUT)
+        if not default_storage.exists(name):
+            raise PreviewUnavailable()
+        return
+
+    try:
+        if not default_storage.exists(name):
+            kwargs = arguments(card, fmt)
+            if settings.PREVIEW_RENDER_PROCESSES:
+                future = executor().submit(drawing.draw, **kwargs)
+                try:
+                    data = future.result(settings.PREVIEW_RENDER_TIMEOUT)
+                except RenderTimeout:
+                    raise PreviewUnavailable()
+            else:
+                data = drawing.draw(**kwargs)
+            saved = default_storage.save(name, ContentFile(data))
+            if saved != name:
+                # drawn by another worker first; keep theirs
+                default_storage.delete(saved)
+        cache.set(memo_key(name), True, settings.PREVIEW_CACHE_SECONDS)
+    finally:
+        with _rendering_lock:
+            del _rendering[name]
+        drawn.set()
+
+
+def url(card, fmt):
+    """The storage URL of the card's preview, drawing it if need be."""
+    name = preview_name(key(style(card), fmt), fmt)
+    if not cache.get(memo_key(name)):
+        render(card, fmt, name)
+    return default_storage.url(name)
+
+
+def discard(values):
+    """
+    Delete the previews of a look (the STYLE_FIELDS values of a card before an
+    edit or deletion) unless a card still looks that way.
+    """
+    lookup = {name: values[name] for name in STYLE_FIELDS if name != "image"}
+    image = Q(image=values["image"])
+    if not values["image"]:
+        image = Q(image="") | Q(image__isnull=True)
+    if Card.objects.filter(image, **lookup).exists():
+        return
+    for fmt in drawing.PILLOW_FORMATS:
+        name = preview_name(key(style(values), fmt), fmt)
+        cache.delete(memo_key(name))
+        default_storage.delete(name)
@@ -0,0 +1,97 @@
+"""
+Read replicas.
+
+DATABASE_REPLICA_URLS adds the databases "replica1", "replica2", ... that
+DATABASE_REPLICAS lists. ReplicaRouter sends a read to a replica only while
+the request being handled has picked one: ReplicaReadsMixin does so for the
+GETs of the viewsets it is mixed into, and the async views for theirs.
+Everything else, writes included, stays on the primary.
+
+Replicas lag behind the primary, so someone who has just liked, followed or
+posted something could be shown a page without it. Every successful write
+request through those viewsets therefore pins its user to the primary for
+REPLICA_LAG_SECONDS, which should exceed the replicas' lag. Pins live in the
+cache named by REPLICA_CACHE_ALIAS, so they hold across workers when the
+cache is shared. Code that writes during a GET and then reads back what it
+wrote (fan-out on read, suggestion refreshes) calls stick_to_primary().
+"""
+
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+# The database reads go to for the rest of the request; None for the primary.
+reads = ContextVar("instaky_read_database", default=None)
+
+
+def backend():
+    return caches[settings.REPLICA_CACHE_ALIAS]
+
+
+def pin_key(user_id):
+    return f"replica-pin:{user_id}"
+
+
+def pin(user):
+    """Keep ``user``'s reads on the primary until the replicas catch up."""
+    if settings.DATABASE_REPLICAS and settings.REPLICA_LAG_SECONDS:
+        backend().set(pin_key(user.id), True, settings.REPLICA_LAG_SECONDS)
+
+
+def read_database(user):
+    """The database to serve ``user``'s reads from, None for the primary."""
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas:
+        return None
+    if user.is_authenticated and backend().get(pin_key(user.id)):
+        return None
+    return random.choice(replicas)
+
+
+def stick_to_primary():
+    """Read from the primary for the rest of the current request."""
+    reads.set(None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return reads.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        same_data = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in same_data and obj2._state.db in same_data:
+            return True
+        return None
+
+
+class ReplicaReadsMixin:
+    """Serve a viewset's GETs from a replica and pin users who write."""
+
+    def dispatch(self, request, *args, **kwargs):
+        token = reads.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            reads.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS:
+            reads.set(read_database(request.user))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and request.user.is_authenticated
+        ):
+            pin(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,215 @@
+"""
+Full-text search over cards and their comments.
+
+Each card is indexed as one document: outer_text (weight A), inner_text (B)
+and the bodies of all its comments (C), so a card is found by what its
+comments say too and ranks higher when the match is in its own text.
+
+On PostgreSQL the document is the Card.search_vector tsvector column with a
+GIN index, both kept current by triggers installed in migration 0011: a card
+recomputes its vector when its text changes, a new comment appends its body,
+and editing or deleting a comment makes the card recompute. Matches are
+ranked with ts_rank. The triggers use the "english" configuration, which
+SEARCH_CONFIG has to match.
+
+SQLite has no tsvector; development databases get an FTS5 table,
+instaky_card_fts, whose rowid is the card id, ranked with bm25. SQLite
+rebuilds a table on most schema changes and drops its triggers with it, so
+rather than living in a migration the FTS5 table and triggers are (re)created
+by install() after every migrate, and the index is rebuilt whenever they were
+missing.
+
+Either way Matches returns card ids, best match first; other databases
+fall back to an unranked icontains scan. Ranking is the expensive part of a
+query for a common word, which can match a large share of all cards, so only
+the SEARCH_RANK_WINDOW newest matches are ranked and results come from those.
+"""
+
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import F, Q
+
+from .models import Card
+
+FTS_TABLE = "instaky_card_fts"
+
+# bm25 weights of the outer_text, inner_text and comments columns
+FTS_WEIGHTS = (4.0, 2.0, 1.0)
+
+FTS_SCHEMA = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE}
+    USING fts5(outer_text, inner_text, comments, tokenize = 'porter unicode61')
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_card_insert
+    AFTER INSERT ON instaky_card BEGIN
+        INSERT OR REPLACE INTO {FTS_TABLE} (rowid, outer_text, inner_text, comments)
+        VALUES (new.id, new.outer_text, new.inner_text, '');
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_card_update
+    AFTER UPDATE OF outer_text, inner_text ON instaky_card BEGIN
+        UPDATE {FTS_TABLE}
+        SET outer_text = new.outer_text, inner_text = new.inner_text
+        WHERE rowid = new.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_card_delete
+    AFTER DELETE ON instaky_card BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_comment_insert
+    AFTER INSERT ON instaky_comment BEGIN
+        UPDATE {FTS_TABLE} SET comments = comments || ' ' || new.body
+        WHERE rowid = new.card_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_comment_update
+    AFTER UPDATE OF body, card_id ON instaky_comment BEGIN
+        UPDATE {FTS_TABLE}
+        SET comments = coalesce(
+            (SELECT group_concat(body, ' ') FROM instaky_comment
+             WHERE card_id = {FTS_TABLE}.rowid),
+            ''
+        )
+        WHERE rowid IN (old.card_id, new.card_id);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_comment_delete
+    AFTER DELETE ON instaky_comment BEGIN
+        UPDATE {FTS_TABLE}
+        SET comments = coalesce(
+            (SELECT group_concat(body, ' ') FROM instaky_comment
+             WHERE card_id = old.card_id),
+            ''
+        )
+        WHERE rowid = old.card_id;
+    END
+    """,
+]
+
+FTS_TRIGGERS = [
+    f"{FTS_TABLE}_{name}"
+    for name in (
+        "card_insert",
+        "card_update",
+        "card_delete",
+        "comment_insert",
+        "comment_update",
+        "comment_delete",
+    )
+]
+
+FTS_REBUILD = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"""
+    INSERT INTO {FTS_TABLE} (rowid, outer_text, inner_text, comments)
+    SELECT card.id, card.outer_text, card.inner_text, coalesce(
+        (SELECT group_concat(body, ' ') FROM instaky_comment
+         WHERE card_id = card.id),
+        ''
+    )
+    FROM instaky_card AS card
+    """,
+]
+
+
+def install(using=DEFAULT_DB_ALIAS, rebuild=False, **kwargs):
+    """
+    Create the SQLite FTS5 index if it or any of its triggers is missing.
+    Connected to post_migrate; a no-op on other databases.
+    """
+    db = connections[using]
+    if db.vendor != "sqlite":
+        return
+    with db.cursor() as cursor:
+        tables = db.introspection.table_names(cursor)
+        if "instaky_card" not in tables or "instaky_comment" not in tables:
+            return
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+            [f"{FTS_TABLE}%"],
+        )
+        present = {name for (name,) in cursor.fetchall()}
+        missing = FTS_TABLE not in tables or not present.issuperset(FTS_TRIGGERS)
+        for statement in FTS_SCHEMA:
+            cursor.execute(statement)
+        if rebuild or missing:
+            for statement in FTS_REBUILD:
+                cursor.execute(statement)
+
+
+def fts_query(text):
+    """
+    Turn free text into an FTS5 query that matches cards containing every
+    word, quoting each one so that user input cannot inject query syntax.
+    """
+    return " ".join(f'"{word}"' for word in re.findall(r"\w+", text))
+
+
+class Matches:
+    """
+    Ids of the cards matching ``text``, best first. Sliced by the paginator,
+    so only one page of ids is fetched per request.
+    """
+
+    def __init__(self, text):
+        self.text = text
+
+    def __getitem__(self, window):
+        if connection.vendor == "postgresql":
+            return list(self.postgresql()[window])
+        if connection.vendor == "sqlite":
+            return self.sqlite(window.start or 0, window.stop - (window.start or 0))
+        return list(self.fallback()[window])
+
+    def postgresql(self):
+        query = SearchQuery(self.text, config=settings.SEARCH_CONFIG)
+        newest = Card.objects.filter(search_vector=query).order_by("-id")
+        return (
+            Card.objects.filter(id__in=newest[: settings.SEARCH_RANK_WINDOW])
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "-id")
+            .values_list("id", flat=True)
+        )
+
+    def sqlite(self, offset, limit):
+        query = fts_query(self.text)
+        if not query:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT id FROM (
+                    SELECT rowid AS id, bm25({FTS_TABLE}, %s, %s, %s) AS score
+                    FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s
+                    ORDER BY rowid DESC LIMIT %s
+                )
+                ORDER BY score, id DESC LIMIT %s OFFSET %s
+                """,
+                [*FTS_WEIGHTS, query, settings.SEARCH_RANK_WINDOW, limit, offset],
+            )
+            return [card_id for (card_id,) in cursor.fetchall()]
+
+    def fallback(self):
+        words = re.findall(r"\w+", self.text)
+        cards = Card.objects.all()
+        for word in words:
+            cards = cards.filter(
+                Q(outer_text__icontains=word)
+                | Q(inner_text__icontains=word)
+                | Q(comments__body__icontains=word)
+            )
+        if not words:
+            cards = cards.none()
+        return cards.distinct().order_by("-id").values_list("id", flat=True)
@@ -1,18 +1,66 @@
+from collections import defaultdict
+
 from rest_framework import serializers
-from users.models import User
-from .models import Card, Comment
+from users.models import Follow, User
+from . import images
+from .comments import preview_size, recent_comments
+from .models import Card, Comment, Suggestion
+from .sparse import SparseFieldsMixin
 
 
-class CommentSerializer(serializers.HyperlinkedModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     liked_by = serializers.StringRelatedField(many=True, read_only=True)
 
+    expandable = {
+        "user": lambda: UserDisplaySerializer(read_only=True),
+        "card": lambda: CardDisplaySerializer(read_only=True),
+    }
+
     class Meta:
         model = Comment
-        fields = ["user", "id", "url", "body", "posted_at", "card", "liked_by"]
+        fields = [
+            "user",
+            "id",
+            "url",
+            "body",
+            "posted_at",
+            "card",
+            "liked_by",
+            "like_count",
+        ]
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class CommentSummarySerializer(serializers.HyperlinkedModelSerializer):
+    user = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = Comment
+        fields = ["user", "id", "url", "body", "posted_at", "card", "like_count"]
+
+
+class SrcsetField(serializers.Field):
+    """Read-only ``{format: srcset}`` map for an image field's variants."""
+
+    def __init__(self, image_field, **kwargs):
+        self.image_field = image_field
+        # columns read, for sparse.narrow()
+        self.model_fields = [f"{image_field}_variants"]
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        request = self.context.get("request")
+        build_absolute_uri = request.build_absolute_uri if request else str
+        return images.srcset(
+            instance._meta.get_field(self.image_field).storage,
+            getattr(instance, f"{self.image_field}_variants"),
+            build_absolute_uri,
+        )
+
+
+class UserSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     cards = serializers.HyperlinkedRelatedField(
         many=True, view_name="card-detail", read_only=True
     )
@@ -20,6 +68,7 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         many=True, view_name="comment-detail", read_only=True
     )
     followers = serializers.StringRelatedField(many=True, read_only=True)
+    profile_picture_srcset = SrcsetField("profile_picture")
 
     class Meta:
         model = User
@@ -28,23 +77,95 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
             "id",
             "url",
             "profile_picture",
+            "profile_picture_width",
+            "profile_picture_height",
+            "profile_picture_srcset",
             "cards",
             "comments",
             "followers",
         ]
 
 
+class UserSummarySerializer(UserSerializer):
+    """
+    UserSerializer with counts in place of the full card, comment and follower
+    lists, so that a user costs the same to render however active they are.
+    The cards and comments themselves are paginated under ``cards_url`` and
+    ``comments_url``.
+    """
+
+    card_count = serializers.IntegerField(read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    follower_count = serializers.IntegerField(read_only=True)
+    following_count = serializers.IntegerField(read_only=True)
+    cards_url = serializers.HyperlinkedIdentityField(view_name="user-cards")
+    comments_url = serializers.HyperlinkedIdentityField(view_name="user-comments")
+
+    class Meta(UserSerializer.Meta):
+        fields = [
+            field
+            for field in UserSerializer.Meta.fields
+            if field not in ("cards", "comments", "followers")
+        ] + [
+            "card_count",
+            "comment_count",
+            "follower_count",
+            "following_count",
+            "cards_url",
+            "comments_url",
+        ]
+
+
 class UserDisplaySerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = ["username", "id", "url"]
 
 
-class CardSerializer(serializers.HyperlinkedModelSerializer):
+class CardDisplaySerializer(serializers.HyperlinkedModelSerializer):
+    class Meta:
+        model = Card
+        fields = ["id", "url", "outer_text"]
+
+
+class FollowSerializer(serializers.ModelSerializer):
+    followed_at = serializers.DateTimeField(source="created_at", read_only=True)
+
+    class Meta:
+        model = Follow
+        fields = ["user", "followed_at"]
+
+
+class FollowerSerializer(FollowSerializer):
+    user = UserDisplaySerializer(source="follower", read_only=True)
+
+
+class FollowingSerializer(FollowSerializer):
+    user = UserDisplaySerializer(source="followed", read_only=True)
+
+
+class SuggestionSerializer(serializers.ModelSerializer):
+    user = UserDisplaySerializer(source="candidate", read_only=True)
+    reason = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Suggestion
+        fields = ["user", "mutual_count", "reason"]
+
+    def get_reason(self, suggestion):
+        return "mutual" if suggestion.mutual_count > 0 else "popular"
+
+
+class CardSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     comments = CommentSerializer(many=True, read_only=True)
     liked_by = serializers.StringRelatedField(many=True, read_only=True)
     user_id = serializers.IntegerField(read_only=True)
+    image_srcset = SrcsetField("image")
+
+    expandable = {
+        "user": lambda: UserDisplaySerializer(read_only=True),
+    }
 
     class Meta:
         model = Card
@@ -55,6 +176,9 @@ class CardSerializer(serializers.HyperlinkedModelSerializer):
             "outer_text",
             "inner_text",
             "image",
+            "image_width",
+            "image_height",
+            "image_srcset",
             "posted_at",
             "id",
             "url",
@@ -66,4 +190,54 @@ class CardSerializer(serializers.HyperlinkedModelSerializer):
             "font_size",
             "liked_by",
             "comments",
+            "like_count",
+            "comment_count",
         ]
+
+
+class CardSummaryListSerializer(serializers.ListSerializer):
+    """
+    Looks up the extra per-card data a summary needs for a whole page of cards
+    at once: whether the requesting user liked each card, and each card's most
+    recent comments.
+    """
+
+    def to_representation(self, data):
+        cards = list(data)
+        ids = [card.id for card in cards]
+        user = self.context["request"].user
+
+        liked = set(
+            Card.liked_by.through.objects.filter(
+                card_id__in=ids, user_id=user.id
+            ).values_list("card_id", flat=True)
+        )
+        recent = defaultdict(list)
+        limit = preview_size(self.context["request"])
+        for comment in recent_comments(ids, limit).select_related("user"):
+            recent[comment.card_id].append(comment)
+
+        for card in cards:
+            card.liked = card.id in liked
+            card.recent_comments = recent[card.id]
+        return super().to_representation(cards)
+
+
+class CardSummarySerializer(CardSerializer):
+    """
+    Compact card for the list endpoints: like and comment counts plus the few
+    newest comments, instead of every liker and every comment. The rest of
+    the comments are paginated under ``comments_url``.
+    """
+
+    liked = serializers.BooleanField(read_only=True)
+    recent_comments = CommentSummarySerializer(many=True, read_only=True)
+    comments_url = serializers.HyperlinkedIdentityField(view_name="card-comments")
+
+    class Meta(CardSerializer.Meta):
+        fields = [
+            field
+            for field in CardSerializer.Meta.fields
+            if field not in ("liked_by", "comments")
+        ] + ["liked", "recent_comments", "comments_url"]
+        list_serializer_class = CardSummaryListSerializer
@@ -0,0 +1,139 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from users.models import User
+
+from . import cache, content, previews
+from .models import Card, Comment
+
+
+def related_count(model, field):
+    """Subquery counting the rows of ``model`` whose ``field`` is the outer row."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def refresh_like_counts(model, pks):
+    """
+    Recount likes from the through table rather than applying a +1/-1. Two
+    concurrent likes by the same user both report the same pk, so a delta
+    would double count; a recount always converges on the real number.
+    """
+    likes = related_count(model.liked_by.through, model._meta.model_name)
+    model.objects.filter(pk__in=pks).update(like_count=likes)
+
+
+def liked_cards(model, pks):
+    cards = Card.objects.filter(pk__in=pks)
+    if model is Comment:
+        cards = Card.objects.filter(comments__pk__in=pks).distinct()
+    return cards.values_list("id", "user_id")
+
+
+def add_like(instance, user):
+    """
+    Record ``user``'s like of ``instance`` (a card or comment) and return
+    whether it is new. The insert decides, so of two concurrent first likes
+    only one is new; a check before add() would let both think they were.
+    """
+    model = type(instance)
+    _, created = model.liked_by.through.objects.get_or_create(
+        **{model._meta.model_name: instance, "user": user}
+    )
+    if created:
+        # what track_likes() does for add(), which this bypasses
+        refresh_like_counts(model, [instance.pk])
+        cache.bump_cards(liked_cards(model, [instance.pk]))
+    return created
+
+
+def track_likes(model):
+    def changed(sender, instance, action, reverse, pk_set, **kwargs):
+        if action == "pre_clear" and reverse:
+            liked = getattr(instance, f"liked_{model._meta.model_name}s")
+            instance._cleared_like_pks = list(liked.values_list("pk", flat=True))
+        if action not in ("post_add", "post_remove", "post_clear"):
+            return
+
+        if not reverse:
+            pks = [instance.pk]
+        elif action == "post_clear":
+            pks = getattr(instance, "_cleared_like_pks", [])
+        else:
+            pks = pk_set
+        refresh_like_counts(model, pks)
+        cache.bump_cards(liked_cards(model, pks))
+
+    m2m_changed.connect(
+        changed,
+        sender=model.liked_by.through,
+        weak=False,
+        dispatch_uid=f"{model._meta.label}.like_count",
+    )
+
+
+track_likes(Card)
+track_likes(Comment)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        Card.objects.filter(pk=instance.card_id).update(
+            comment_count=F("comment_count") + 1
+        )
+    cache.bump_cards(
+        Card.objects.filter(pk=instance.card_id).values_list("id", "user_id")
+    )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Card.objects.filter(pk=instance.card_id, comment_count__gt=0).update(
+        comment_count=F("comment_count") - 1
+    )
+    cache.bump_cards(
+        Card.objects.filter(pk=instance.card_id).values_list("id", "user_id")
+    )
+
+
+@receiver(post_save, sender=Card)
+@receiver(post_delete, sender=Card)
+def card_changed(sender, instance, **kwargs):
+    cache.bump_cards([(instance.id, instance.user_id)])
+
+
+@receiver(post_delete, sender=Card)
+def card_deleted(sender, instance, **kwargs):
+    content.release(instance, "image")
+    previews.discard(previews.style(instance))
+
+
+@receiver(pre_save, sender=Card)
+def card_saving(sender, instance, **kwargs):
+    if instance.pk is not None:
+        instance._previous_look = (
+            Card.objects.filter(pk=instance.pk).values(*previews.STYLE_FIELDS).first()
+        )
+
+
+@receiver(post_save, sender=Card)
+def card_restyled(sender, instance, **kwargs):
+    previous = getattr(instance, "_previous_look", None)
+    if previous is not None and previews.style(previous) != previews.style(instance):
+        # If the edit rolls back, the old look is simply drawn again.
+        previews.discard(previews.style(previous))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    content.release(instance, "profile_picture")
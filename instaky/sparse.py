@@ -0,0 +1,140 @@
+"""
+Sparse fieldsets and opt-in expansion.
+
+On reads, ``?fields=id,outer_text,card_color`` trims a response down to the
+named fields, and ``?expand=user`` swaps a relation's compact form (a
+username, a hyperlink) for a nested object. Serializers opt in with
+SparseFieldsMixin and list what can be expanded in ``expandable``; writes
+always see every field so that validation is unaffected.
+
+A trimmed serializer also needs less from the database. narrow() reads the
+fields that are left and loads just those: .only() the columns behind them,
+select_related() for the single relations that are rendered and
+prefetch_related() for the many-valued ones, recursing into nested
+serializers. Viewsets apply it when a request asks for specific fields.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+
+def requested(request, param):
+    """The comma-separated names in ``?param=``, or None if it is absent."""
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    return [name for name in (part.strip() for part in value.split(",")) if name]
+
+
+def is_sparse(request):
+    return requested(request, "fields") is not None or bool(
+        requested(request, "expand")
+    )
+
+
+def selection(request, available, expandable):
+    """
+    Validate ``?fields=`` and ``?expand=`` against the field names a
+    serializer has and the ones it can expand. Returns the fields to keep
+    (None for all of them) and the fields to expand.
+    """
+    fields = requested(request, "fields")
+    expand = requested(request, "expand") or []
+    if fields is not None:
+        unknown = set(fields) - set(available)
+        if unknown:
+            raise ValidationError(
+                {"fields": f"Unknown fields: {', '.join(sorted(unknown))}"}
+            )
+    unknown = set(expand) - set(expandable)
+    if unknown:
+        raise ValidationError(
+            {"expand": f"Cannot expand: {', '.join(sorted(unknown))}"}
+        )
+    return fields, expand
+
+
+class SparseFieldsMixin:
+    """
+    Apply ``?fields=`` and ``?expand=`` to a top-level serializer. Nested
+    serializers are built without a request and keep their fields.
+    """
+
+    # {field name: callable returning the expanded field}
+    expandable = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields, expand = selection(
+            self.context.get("request"), self.fields, self.expandable
+        )
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in expand:
+            if name in self.fields:
+                self.fields[name] = self.expandable[name]()
+
+
+def narrow(queryset, serializer, required=()):
+    """
+    Restrict ``queryset`` to what ``serializer``'s fields will read, plus the
+    ``required`` columns.
+    """
+    model = queryset.model
+    columns = {model._meta.pk.name, *required}
+    related, prefetched = [], []
+    for field in serializer.fields.values():
+        if field.write_only or isinstance(field, serializers.HyperlinkedIdentityField):
+            continue
+        if field.source == "*":
+            sources = getattr(field, "model_fields", None)
+            if sources is None:
+                # reads the whole instance
+                return queryset
+            columns.update(sources)
+            continue
+
+        try:
+            model_field = model._meta.get_field(field.source.split(".")[0])
+        except FieldDoesNotExist:
+            # annotations, properties and the like
+            continue
+
+        if not model_field.is_relation or field.source == getattr(
+            model_field, "attname", None
+        ):
+            columns.add(model_field.name)
+        elif model_field.many_to_one or model_field.one_to_one:
+            columns.add(model_field.name)
+            # a hyperlink or pk only needs the foreign key itself
+            if isinstance(field, serializers.StringRelatedField) or not isinstance(
+                field, serializers.RelatedField
+            ):
+                related.append(model_field.name)
+        else:
+            prefetched.append(prefetch(model_field, field))
+
+    queryset = queryset.only(*columns)
+    if related:
+        queryset = queryset.select_related(*related)
+    if prefetched:
+        queryset = queryset.prefetch_related(*prefetched)
+    return queryset
+
+
+def prefetch(model_field, field):
+    target = model_field.related_model.objects.all()
+    child = getattr(field, "child", None) or getattr(field, "child_relation", None)
+    if isinstance(child, serializers.Serializer):
+        # a reverse foreign key is joined on the column pointing back
+        back = [model_field.field.name] if model_field.one_to_many else []
+        target = narrow(target, child, required=back)
+    elif not isinstance(child, serializers.StringRelatedField):
+        target = target.only(model_field.related_model._meta.pk.name)
+    return Prefetch(field.source, queryset=target)
@@ -0,0 +1,17 @@
+from django.conf import settings
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from .content import is_addressed
+
+
+class ContentAddressedS3Storage(S3Boto3Storage):
+    """
+    S3 storage that lets browsers and CDNs cache content-addressed objects
+    (see content.py) forever; their bytes can never change under a URL.
+    """
+
+    def get_object_parameters(self, name):
+        parameters = super().get_object_parameters(name)
+        if is_addressed(name):
+            parameters["CacheControl"] = settings.CONTENT_ADDRESSED_CACHE_CONTROL
+        return parameters
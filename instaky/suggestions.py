@@ -0,0 +1,205 @@
+"""
+Precomputed "who to follow" suggestions.
+
+A user's candidates are the accounts followed by the accounts they follow
+(friends of friends), ranked by how many of those mutual follows there are,
+plus the most-followed accounts on the site with a popularity bonus of up to
+SUGGESTIONS_POPULAR_WEIGHT. The two-hop join behind that is too slow to run
+per request, so refresh() stores the top SUGGESTIONS_SIZE candidates as
+Suggestion rows and the endpoint only reads them.
+
+The refresh_suggestions command recomputes every user in chunks of
+SUGGESTIONS_BATCH_SIZE, each chunk in its own transaction, so its memory use
+does not grow with the size of the graph. A user without any rows is
+computed on their first request; if there is nothing to suggest, that is
+remembered in the cache for SUGGESTIONS_CACHE_SECONDS rather than computed
+again on every request. Between runs, follow and unfollow
+keep the stored rows current: the user who (un)followed is recomputed, and
+the mutual count of the followed account is adjusted for that user's own
+followers. As with timeline fan-out, the second step is skipped for accounts
+with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers and left to the next
+batch run.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField
+from users.models import Follow, User
+
+from . import replicas, timeline
+from .models import Suggestion
+
+POPULAR_CACHE_KEY = "suggestions:popular-authors"
+
+
+def empty_key(user_id):
+    return f"suggestions:empty:{user_id}"
+
+
+def remember_empty(rows_by_user):
+    """Mark the users ``rows_by_user`` has no rows for as having none."""
+    cache.set_many(
+        {
+            empty_key(user_id): True
+            for user_id, rows in rows_by_user.items()
+            if not rows
+        },
+        settings.SUGGESTIONS_CACHE_SECONDS,
+    )
+    cache.delete_many(
+        [empty_key(user_id) for user_id, rows in rows_by_user.items() if rows]
+    )
+
+
+def popular_authors():
+    """{author id: popularity bonus} for the most-followed accounts."""
+    bonuses = cache.get(POPULAR_CACHE_KEY)
+    if bonuses is None:
+        top = list(
+            Follow.objects.values("followed")
+            .annotate(total=Count("follower"))
+            .order_by("-total", "followed")
+            .values_list("followed", "total")[: settings.SUGGESTIONS_POPULAR_POOL]
+        )
+        most = top[0][1] if top else 1
+        weight = settings.SUGGESTIONS_POPULAR_WEIGHT
+        bonuses = {author: weight * total / most for author, total in top}
+        cache.set(POPULAR_CACHE_KEY, bonuses, settings.SUGGESTIONS_CACHE_SECONDS)
+    return bonuses
+
+
+def compute(user):
+    """Return the user's top Suggestion rows (unsaved)."""
+    following = Follow.objects.filter(follower=user).values("followed")
+    mutual = dict(
+        Follow.objects.filter(follower__in=following)
+        .exclude(followed__in=following)
+        .exclude(followed=user)
+        .values("followed")
+        .annotate(mutual=Count("follower"))
+        .order_by("-mutual", "followed")
+        .values_list("followed", "mutual")[: settings.SUGGESTIONS_SIZE]
+    )
+
+    popular = popular_authors()
+    followed_popular = set(
+        Follow.objects.filter(follower=user, followed__in=list(popular)).values_list(
+            "followed", flat=True
+        )
+    )
+    candidates = set(mutual) | (set(popular) - followed_popular - {user.id})
+
+    ranked = sorted(
+        candidates,
+        key=lambda candidate: (
+            -(mutual.get(candidate, 0) + popular.get(candidate, 0)),
+            candidate,
+        ),
+    )
+    return [
+        Suggestion(
+            owner_id=user.id,
+            candidate_id=candidate,
+            mutual_count=mutual.get(candidate, 0),
+            popularity=popular.get(candidate, 0),
+        )
+        for candidate in ranked[: settings.SUGGESTIONS_SIZE]
+    ]
+
+
+def refresh(user):
+    """Recompute and store one user's suggestions."""
+    rows = compute(user)
+    with transaction.atomic():
+        Suggestion.objects.filter(owner=user).delete()
+        Suggestion.objects.bulk_create(rows)
+    remember_empty({user.id: rows})
+
+
+def refresh_all(batch_size=None):
+    """Recompute every user's suggestions, one chunk of users at a time."""
+    batch_size = batch_size or settings.SUGGESTIONS_BATCH_SIZE
+    cache.delete(POPULAR_CACHE_KEY)
+    refreshed, last_id = 0, 0
+    while True:
+        users = list(User.objects.filter(id__gt=last_id).order_by("id")[:batch_size])
+        if not users:
+            return refreshed
+        rows_by_user = {user.id: compute(user) for user in users}
+        rows = [row for user_rows in rows_by_user.values() for row in user_rows]
+        with transaction.atomic():
+            Suggestion.objects.filter(owner__in=users).delete()
+            Suggestion.objects.bulk_create(rows, batch_size=batch_size)
+        remember_empty(rows_by_user)
+        refreshed += len(users)
+        last_id = users[-1].id
+
+
+def _followers_of(user):
+    return Follow.objects.filter(followed=user).values("follower")
+
+
+def followed(follower, author):
+    """``follower`` just followed ``author``."""
+    refresh(follower)
+    if timeline.is_high_fanout(follower):
+        return
+
+    # author is now a friend of a friend for everyone who follows follower
+    owners = _followers_of(follower)
+    Suggestion.objects.filter(owner__in=owners, candidate=author).update(
+        mutual_count=F("mutual_count") + 1
+    )
+    new_owners = (
+        Follow.objects.filter(followed=follower)
+        .exclude(follower=author)
+        .exclude(follower__in=_followers_of(author))
+        .exclude(
+            follower__in=Suggestion.objects.filter(candidate=author).values("owner")
+        )
+        .values_list("follower", flat=True)
+    )
+    bonus = popular_authors().get(author.id, 0)
+    Suggestion.objects.bulk_create(
+        (
+            Suggestion(
+                owner_id=owner, candidate=author, mutual_count=1, popularity=bonus
+            )
+            for owner in new_owners.iterator()
+        ),
+        batch_size=settings.SUGGESTIONS_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def unfollowed(follower, author):
+    """``follower`` just stopped following ``author``."""
+    refresh(follower)
+    if timeline.is_high_fanout(follower):
+        return
+
+    suggestions = Suggestion.objects.filter(
+        owner__in=_followers_of(follower), candidate=author
+    )
+    suggestions.update(mutual_count=F("mutual_count") - 1)
+    suggestions.filter(mutual_count__lte=0, popularity=0).delete()
+
+
+def suggestions_for(user):
+    if (
+        not Suggestion.objects.filter(owner=user).exists()
+        and cache.get(empty_key(user.id)) is None
+    ):
+        refresh(user)
+        replicas.stick_to_primary()
+    return (
+        Suggestion.objects.filter(owner=user)
+        .select_related("candidate")
+        .annotate(
+            score=ExpressionWrapper(
+                F("mutual_count") + F("popularity"), output_field=FloatField()
+            )
+        )
+        .order_by("-score", "candidate_id")[: settings.SUGGESTIONS_SIZE]
+    )
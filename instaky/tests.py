@@ -1,3 +1,2099 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from PIL import Image, ImageFont
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import (
+    APIRequestFactory,
+    APITestCase,
+    APITransactionTestCase,
+)
+from users.models import Follow, User
+
+from . import cache as response_cache
+from . import (
+    bulk,
+    chunked,
+    compression,
+    drawing,
+    events,
+    export,
+    metrics,
+    previews,
+    renderers,
+    replicas,
+    search,
+    suggestions,
+    timeline,
+    trending,
+)
+from .feed import CardFeedSerializer, card_rows
+from .management.commands import bench_endpoints
+from .models import (
+    Card,
+    ChunkedUpload,
+    Comment,
+    StoredImage,
+    Suggestion,
+    TimelineEntry,
+    TrendingScore,
+)
+from .serializers import CardSummarySerializer
+
+
+class CardFeedPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.client.force_authenticate(self.user)
+        for n in range(7):
+            Card.objects.create(user=self.user, outer_text=f"out {n}", inner_text="in")
+
+    def test_feed_pages_follow_next_cursor(self):
+        response = self.client.get("/cards/all/", {"page_size": 3})
+        self.assertEqual(response.status_code, 200)
+        seen = [card["id"] for card in response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            seen += [card["id"] for card in response.data["results"]]
+
+        expected = list(
+            Card.objects.order_by("-posted_at", "-id").values_list("id", flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+    def test_cursor_is_stable_when_new_cards_are_posted(self):
+        first = self.client.get("/cards/mine/", {"page_size": 3})
+        Card.objects.create(user=self.user, outer_text="new", inner_text="in")
+        second = self.client.get(first.data["next"])
+
+        first_ids = [card["id"] for card in first.data["results"]]
+        second_ids = [card["id"] for card in second.data["results"]]
+        self.assertFalse(set(first_ids) & set(second_ids))
+        self.assertEqual(len(second_ids), 3)
+
+
+class UserDirectoryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.heavy = User.objects.create_user(username="heavy", password="pass")
+        self.heavy.followers.add(self.user)
+        self.client.force_authenticate(self.user)
+        for n in range(5):
+            card = Card.objects.create(
+                user=self.heavy, outer_text=f"{n}", inner_text="i"
+            )
+            Comment.objects.create(card=card, user=self.heavy, body=f"comment {n}")
+
+    def test_users_carry_counts_instead_of_relations(self):
+        response = self.client.get(f"/users/{self.heavy.id}/")
+        self.assertNotIn("cards", response.data)
+        self.assertEqual(
+            [
+                response.data[key]
+                for key in (
+                    "card_count",
+                    "comment_count",
+                    "follower_count",
+                    "following_count",
+                )
+            ],
+            [5, 5, 1, 0],
+        )
+        listed = self.client.get("/users/").data["results"]
+        self.assertEqual([user["following_count"] for user in listed], [1, 0])
+
+    def test_profile_cost_does_not_grow_with_activity(self):
+        url = f"/users/{self.heavy.id}/"
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        for n in range(20):
+            card = Card.objects.create(
+                user=self.heavy, outer_text=f"{n}", inner_text="i"
+            )
+            Comment.objects.create(card=card, user=self.heavy, body="more")
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(url)
+        self.assertEqual(len(after), len(before))
+
+    def test_cards_and_comments_are_paginated(self):
+        profile = self.client.get(f"/users/{self.heavy.id}/").data
+        page = self.client.get(profile["cards_url"], {"page_size": 3}).data
+        self.assertEqual(len(page["results"]), 3)
+        rest = self.client.get(page["next"]).data
+        self.assertEqual(
+            [card["id"] for card in page["results"] + rest["results"]],
+            list(
+                Card.objects.filter(user=self.heavy)
+                .order_by("-posted_at", "-id")
+                .values_list("id", flat=True)
+            ),
+        )
+
+        comments = self.client.get(profile["comments_url"], {"page_size": 2}).data
+        self.assertEqual(comments["results"][0]["body"], "comment 4")
+        self.assertIsNotNone(comments["next"])
+
+
+class CardCommentTests(APITestCase):
+    def setUp(self):
+        # feed responses are cached and the cache outlives each test
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.client.force_authenticate(self.user)
+        self.cards = [
+            Card.objects.create(user=self.user, outer_text=f"{n}", inner_text="i")
+            for n in range(3)
+        ]
+        for card in self.cards:
+            for n in range(4):
+                Comment.objects.create(card=card, user=self.other, body=f"c{n}")
+
+    def test_card_comments_are_paginated(self):
+        card = self.client.get("/cards/all/").data["results"][0]
+        page = self.client.get(card["comments_url"], {"page_size": 3}).data
+        rest = self.client.get(page["next"]).data
+        self.assertEqual(
+            [comment["body"] for comment in page["results"] + rest["results"]],
+            ["c3", "c2", "c1", "c0"],
+        )
+        self.assertEqual(self.client.get("/cards/0/comments/").status_code, 404)
+
+    def test_preview_size_is_configurable(self):
+        def previews(**params):
+            cards = self.client.get("/cards/all/", params).data["results"]
+            return [
+                [comment["body"] for comment in card["recent_comments"]]
+                for card in cards
+            ]
+
+        self.assertEqual(previews(), [["c3", "c2", "c1"]] * 3)
+        self.assertEqual(previews(comments=1), [["c3"]] * 3)
+        self.assertEqual(previews(comments=0), [[]] * 3)
+        self.assertEqual(previews(comments=100), [["c3", "c2", "c1", "c0"]] * 3)
+
+    def test_preview_reads_only_the_previewed_comments(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/cards/all/", {"comments": 1})
+        (preview,) = [
+            query["sql"]
+            for query in queries.captured_queries
+            if "ROW_NUMBER" in query["sql"]
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(preview)
+            self.assertEqual(len(cursor.fetchall()), 3)
+
+    def test_updating_a_card_does_not_query_per_comment(self):
+        card = self.cards[0]
+
+        def update():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(
+                    f"/cards/{card.id}/", {"inner_text": "edited"}, format="json"
+                )
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        before = update()
+        for n in range(5):
+            comment = Comment.objects.create(card=card, user=self.other, body="more")
+            comment.liked_by.add(self.user)
+        self.assertEqual(update(), before)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.client.force_authenticate(self.user)
+        self.card = Card.objects.create(
+            user=self.user, outer_text="out", inner_text="in", card_color="TE"
+        )
+        self.card.liked_by.add(self.other)
+        self.comment = Comment.objects.create(
+            card=self.card, user=self.other, body="hi"
+        )
+        self.addCleanup(cache.clear)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data, [query["sql"] for query in queries.captured_queries]
+
+    def test_feed_returns_only_requested_fields(self):
+        data, queries = self.get("/cards/all/", fields="id,outer_text,card_color")
+        self.assertEqual(
+            data["results"],
+            [{"outer_text": "out", "id": self.card.id, "card_color": "TE"}],
+        )
+        (cards,) = [sql for sql in queries if 'FROM "instaky_card"' in sql]
+        self.assertNotIn("inner_text", cards)
+        self.assertFalse([sql for sql in queries if "instaky_comment" in sql])
+
+    def test_feed_matches_serializer_with_fields_and_expand(self):
+        params = {"fields": "user,id,liked,recent_comments", "expand": "user"}
+        request = Request(APIRequestFactory().get("/cards/all/", params))
+        request.user = self.user
+        cards = Card.objects.order_by("-posted_at", "-id")
+        expected = CardSummarySerializer(
+            cards, many=True, context={"request": request}
+        ).data
+        serializer = CardFeedSerializer(request)
+        actual = serializer.serialize(serializer.rows(cards))
+
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+        self.assertEqual(actual[0]["user"]["username"], "kyle")
+
+    def test_detail_loads_only_what_it_renders(self):
+        url = f"/cards/{self.card.id}/"
+        full, full_queries = self.get(url)
+        data, queries = self.get(url, fields="id,outer_text", expand="user")
+        self.assertEqual(data, {"outer_text": "out", "id": self.card.id})
+        self.assertLess(len(queries), len(full_queries))
+        self.assertNotIn("inner_text", queries[-1])
+
+        data, _ = self.get(url, fields="user,liked_by", expand="user")
+        self.assertEqual(data["user"]["username"], "kyle")
+        self.assertEqual(data["liked_by"], ["other"])
+
+        data, queries = self.get(url, fields="id,comments")
+        self.assertEqual(data["comments"][0]["liked_by"], [])
+        self.assertLess(len(queries), len(full_queries))
+
+    def test_comments_expand_relations(self):
+        data, queries = self.get(
+            f"/comments/{self.comment.id}/", fields="body,user,card", expand="user,card"
+        )
+        self.assertEqual(data["user"]["username"], "other")
+        self.assertEqual(data["card"]["outer_text"], "out")
+
+    def test_users_skip_counts_they_do_not_show(self):
+        data, queries = self.get("/users/", fields="id,username,follower_count")
+        self.assertEqual(
+            data["results"][0],
+            {"username": "kyle", "id": self.user.id, "follower_count": 0},
+        )
+        self.assertFalse([sql for sql in queries if "instaky_card" in sql])
+
+        data, _ = self.get(f"/users/{self.user.id}/", fields="username")
+        self.assertEqual(data, {"username": "kyle"})
+
+    def test_invalid_names_are_rejected(self):
+        self.assertEqual(
+            self.client.get("/cards/all/", {"fields": "nope"}).status_code, 400
+        )
+        self.assertEqual(
+            self.client.get(
+                f"/cards/{self.card.id}/", {"expand": "liked_by"}
+            ).status_code,
+            400,
+        )
+
+    def test_writes_ignore_fields(self):
+        response = self.client.patch(
+            f"/cards/{self.card.id}/?fields=id", {"inner_text": "edited"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["inner_text"], "edited")
+
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.client.force_authenticate(self.user)
+        self.titled = Card.objects.create(
+            user=self.user, outer_text="Sunset over the harbor", inner_text="boats"
+        )
+        self.inside = Card.objects.create(
+            user=self.user, outer_text="Evening", inner_text="a harbor at dusk"
+        )
+        self.commented = Card.objects.create(
+            user=self.user, outer_text="Untitled", inner_text="nothing here"
+        )
+        self.comment = Comment.objects.create(
+            card=self.commented, user=self.user, body="looks like the harbor"
+        )
+
+    def search(self, q, **params):
+        response = self.client.get("/cards/search/", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [card["id"] for card in response.data["results"]]
+
+    def test_matches_card_text_and_comments_ranked(self):
+        self.assertEqual(
+            self.search("harbor"),
+            [self.titled.id, self.inside.id, self.commented.id],
+        )
+        self.assertEqual(self.search("Harbors, sunset"), [self.titled.id])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.comment.body = "nice colours"
+        self.comment.save()
+        self.assertEqual(self.search("colours"), [self.commented.id])
+        self.assertNotIn(self.commented.id, self.search("harbor"))
+
+        self.comment.delete()
+        self.assertEqual(self.search("colours"), [])
+
+        self.inside.outer_text = "Morning"
+        self.inside.save()
+        self.assertEqual(self.search("morning"), [self.inside.id])
+        self.inside.delete()
+        self.assertEqual(self.search("harbor"), [self.titled.id])
+
+    def test_results_are_paginated(self):
+        first = self.client.get("/cards/search/", {"q": "harbor", "page_size": 2})
+        self.assertEqual(len(first.data["results"]), 2)
+        self.assertIsNone(first.data["previous"])
+        second = self.client.get(first.data["next"])
+        self.assertEqual(
+            [card["id"] for card in second.data["results"]], [self.commented.id]
+        )
+        self.assertIsNone(second.data["next"])
+        self.assertIsNotNone(second.data["previous"])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('harbor" -boats*'), [self.titled.id])
+        self.assertEqual(self.search("***"), [])
+        self.assertEqual(self.client.get("/cards/search/").status_code, 400)
+
+    def test_install_restores_dropped_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TRIGGER {search.FTS_TABLE}_card_insert")
+        card = Card.objects.create(user=self.user, outer_text="lost", inner_text="i")
+        self.assertEqual(self.search("lost"), [])
+        search.install()
+        self.assertEqual(self.search("lost"), [card.id])
+
+
+class FollowListTests(APITestCase):
+    def setUp(self):
+        self.star = User.objects.create_user(username="star", password="pass")
+        self.client.force_authenticate(self.star)
+        self.fans = [
+            User.objects.create_user(username=f"fan{n}", password="pass")
+            for n in range(5)
+        ]
+        for fan in self.fans:
+            self.star.followers.add(fan)
+
+    def test_followers_are_paginated_newest_first(self):
+        response = self.client.get(
+            f"/users/{self.star.id}/followers/", {"page_size": 2}
+        )
+        usernames = [row["user"]["username"] for row in response.data["results"]]
+        while response.data["next"]:
+            response = self.client.get(response.data["next"])
+            usernames += [row["user"]["username"] for row in response.data["results"]]
+        self.assertEqual(usernames, [f"fan{n}" for n in reversed(range(5))])
+        self.assertIn("followed_at", response.data["results"][0])
+
+    def test_following_lists_followed_accounts(self):
+        response = self.client.get(f"/users/{self.fans[0].id}/following/")
+        self.assertEqual(
+            [row["user"]["id"] for row in response.data["results"]], [self.star.id]
+        )
+
+    def test_follow_rows_record_when_they_were_made(self):
+        follow = Follow.objects.get(followed=self.star, follower=self.fans[0])
+        self.assertIsNotNone(follow.created_at)
+        self.assertEqual(self.star.followers.count(), 5)
+        self.assertEqual(self.fans[0].following.get(), self.star)
+
+
+@override_settings(SUGGESTIONS_POPULAR_POOL=1)
+class SuggestionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.users = {
+            name: User.objects.create_user(username=name, password="pass")
+            for name in "abcdefx"
+        }
+        for follower, followed in ["ab", "bc", "bd", "ec", "xa"]:
+            self.users[followed].followers.add(self.users[follower])
+
+    def suggested(self, name):
+        self.client.force_authenticate(self.users[name])
+        response = self.client.get("/users/suggestions/")
+        return [
+            (row["user"]["username"], row["mutual_count"], row["reason"])
+            for row in response.data
+        ]
+
+    def test_friends_of_friends_and_popular_accounts(self):
+        self.assertEqual(self.suggested("a"), [("c", 1, "mutual"), ("d", 1, "mutual")])
+        self.assertEqual(self.suggested("f"), [("c", 0, "popular")])
+
+    @override_settings(SUGGESTIONS_POPULAR_POOL=1)
+    def test_users_with_nothing_to_suggest_are_computed_once(self):
+        with mock.patch.object(
+            suggestions, "compute", wraps=suggestions.compute
+        ) as compute:
+            self.assertEqual(self.suggested("b"), [])
+            self.assertEqual(self.suggested("b"), [])
+        compute.assert_called_once()
+
+        self.client.post(f"/users/{self.users['x'].id}/follow/")
+        self.assertEqual(self.suggested("b"), [("a", 1, "mutual")])
+
+    def test_follow_and_unfollow_update_stored_suggestions(self):
+        self.assertEqual(self.suggested("x"), [("c", 0, "popular"), ("b", 1, "mutual")])
+
+        self.client.force_authenticate(self.users["a"])
+        self.client.post(f"/users/{self.users['f'].id}/follow/")
+        self.assertIn(("f", 1, "mutual"), self.suggested("x"))
+        self.assertNotIn("f", [name for name, _, _ in self.suggested("a")])
+
+        self.client.force_authenticate(self.users["a"])
+        self.client.post(f"/users/{self.users['f'].id}/unfollow/")
+        self.assertNotIn("f", [name for name, _, _ in self.suggested("x")])
+
+    def test_repeated_follows_and_unfollows_count_once(self):
+        self.assertIn(("c", 0, "popular"), self.suggested("x"))
+
+        self.client.force_authenticate(self.users["a"])
+        for _ in range(2):
+            self.client.post(f"/users/{self.users['c'].id}/follow/")
+        self.assertIn(("c", 1, "mutual"), self.suggested("x"))
+
+        self.client.force_authenticate(self.users["a"])
+        for _ in range(2):
+            self.client.post(f"/users/{self.users['c'].id}/unfollow/")
+        self.assertIn(("c", 0, "popular"), self.suggested("x"))
+
+    def test_batch_refresh(self):
+        call_command("refresh_suggestions", batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            set(
+                Suggestion.objects.filter(owner=self.users["a"]).values_list(
+                    "candidate__username", flat=True
+                )
+            ),
+            {"c", "d"},
+        )
+        self.assertTrue(Suggestion.objects.filter(owner=self.users["f"]).exists())
+
+
+class FollowingTimelineTests(APITestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username="reader", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.client.force_authenticate(self.reader)
+
+    def feed_ids(self):
+        response = self.client.get("/cards/following/")
+        self.assertEqual(response.status_code, 200)
+        return [card["id"] for card in response.data["results"]]
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        old = Card.objects.create(user=self.author, outer_text="old", inner_text="in")
+        self.client.post(f"/users/{self.author.id}/follow/")
+        self.assertEqual(self.feed_ids(), [old.id])
+
+        self.client.post(f"/users/{self.author.id}/unfollow/")
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_following_twice_backfills_once(self):
+        Card.objects.create(user=self.author, outer_text="old", inner_text="in")
+        with mock.patch.object(timeline, "backfill") as backfill:
+            for _ in range(2):
+                response = self.client.post(f"/users/{self.author.id}/follow/")
+                self.assertEqual(response.status_code, 200)
+        backfill.assert_called_once()
+        with mock.patch.object(timeline, "prune") as prune:
+            for _ in range(2):
+                self.client.post(f"/users/{self.author.id}/unfollow/")
+        prune.assert_called_once()
+
+    def test_new_cards_fan_out_to_followers(self):
+        self.author.followers.add(self.reader)
+        self.client.force_authenticate(self.author)
+        response = self.client.post(
+            "/cards/", {"outer_text": "hi", "inner_text": "there"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.feed_ids(), [response.data["id"]])
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 1)
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_fanout_authors_are_pulled_on_read(self):
+        cache.clear()
+        self.author.followers.add(self.reader)
+        card = Card.objects.create(user=self.author, outer_text="hi", inner_text="in")
+        timeline.fan_out(card)
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        self.assertEqual(self.feed_ids(), [card.id])
+
+    def test_authors_crossing_the_fanout_limit_are_not_lost(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.author.followers.add(self.reader)
+        self.assertEqual(self.feed_ids(), [])
+
+        # the author is now over the limit, but the cached set says otherwise
+        with override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0):
+            card = Card.objects.create(
+                user=self.author, outer_text="hi", inner_text="in"
+            )
+            timeline.fan_out(card)
+            self.assertEqual(self.feed_ids(), [card.id])
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0, TIMELINE_BACKFILL_SIZE=2)
+    def test_high_fanout_pulls_do_not_skip_cards(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        other = User.objects.create_user(username="other", password="pass")
+        self.reader.following.add(self.author, other)
+
+        def post(user, ago):
+            card = Card.objects.create(user=user, outer_text="o", inner_text="i")
+            Card.objects.filter(pk=card.pk).update(
+                posted_at=timezone.now() - timedelta(seconds=ago)
+            )
+            return card.id
+
+        newest = post(self.author, 10)
+        self.assertEqual(self.feed_ids(), [newest])
+        # committed after the newer card was pulled
+        late = post(self.author, 20)
+        # older than the other author's newest pulled card
+        behind = post(other, 30)
+        self.assertEqual(self.feed_ids(), [newest, late, behind])
+
+        # more than TIMELINE_BACKFILL_SIZE since the last pull
+        run = [post(self.author, ago) for ago in range(9, 4, -1)]
+        for _ in range(3):
+            ids = self.feed_ids()
+        self.assertEqual(ids, run[::-1] + [newest, late, behind])
+
+    def test_rebuild_timelines_command(self):
+        self.author.followers.add(self.reader)
+        card = Card.objects.create(user=self.author, outer_text="hi", inner_text="in")
+        call_command("rebuild_timelines", stdout=StringIO())
+        self.assertEqual(self.feed_ids(), [card.id])
+
+
+class CounterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.card = Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+        self.client.force_authenticate(self.user)
+
+    def test_likes_are_counted_once(self):
+        self.client.post(f"/cards/{self.card.id}/like/")
+        self.client.post(f"/cards/{self.card.id}/like/")
+        self.other.liked_cards.add(self.card)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.like_count, 2)
+
+        self.card.liked_by.clear()
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.like_count, 0)
+
+    def test_a_like_that_loses_the_race_is_not_new(self):
+        likes = Card.liked_by.through
+        raced = []
+
+        def race(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            looked = likes._meta.db_table in sql and len(params or ()) >= 2
+            if sql.startswith("SELECT") and looked and not raced:
+                # another request likes the card right after this one looked
+                # for the user's like of it
+                raced.append(True)
+                likes.objects.create(card=self.card, user=self.user)
+            return result
+
+        with connection.execute_wrapper(race), mock.patch.object(
+            events, "card_liked"
+        ) as card_liked:
+            response = self.client.post(f"/cards/{self.card.id}/like/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(raced, [True])
+        card_liked.assert_not_called()
+        self.assertFalse(TrendingScore.objects.filter(card=self.card).exists())
+
+        with mock.patch.object(events, "card_liked") as card_liked:
+            self.client.force_authenticate(self.other)
+            self.client.post(f"/cards/{self.card.id}/like/")
+        card_liked.assert_called_once()
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.like_count, 2)
+
+    def test_comment_create_and_delete_update_card(self):
+        response = self.client.post(
+            "/comments/",
+            {"body": "nice", "card": f"http://testserver/cards/{self.card.id}/"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.comment_count, 1)
+
+        self.client.delete(f"/comments/{response.data['id']}/")
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.comment_count, 0)
+
+    def test_save_does_not_overwrite_counters(self):
+        stale = Card.objects.get(pk=self.card.pk)
+        self.card.liked_by.add(self.other)
+        stale.outer_text = "edited"
+        stale.save()
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.like_count, 1)
+        self.assertEqual(self.card.outer_text, "edited")
+
+    def test_reconcile_counters_repairs_drift(self):
+        self.card.liked_by.add(self.other)
+        Card.objects.update(like_count=7, comment_count=3)
+        out = StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.card.refresh_from_db()
+        self.assertEqual((self.card.like_count, self.card.comment_count), (1, 0))
+        self.assertIn("instaky.Card.like_count: repaired 1 rows", out.getvalue())
+
+    def test_feeds_return_summaries(self):
+        self.card.liked_by.add(self.user, self.other)
+        for n in range(5):
+            Comment.objects.create(card=self.card, user=self.other, body=f"c{n}")
+
+        response = self.client.get("/cards/all/")
+        card = response.data["results"][0]
+        self.assertNotIn("liked_by", card)
+        self.assertEqual(card["like_count"], 2)
+        self.assertEqual(card["comment_count"], 5)
+        self.assertTrue(card["liked"])
+        self.assertEqual(
+            [comment["body"] for comment in card["recent_comments"]],
+            ["c4", "c3", "c2"],
+        )
+
+
+class CardFeedSerializerTests(APITestCase):
+    def test_fast_path_matches_card_summary_serializer(self):
+        user = User.objects.create_user(username="kyle", password="pass")
+        other = User.objects.create_user(username="other", password="pass")
+        for n in range(4):
+            card = Card.objects.create(
+                user=user,
+                outer_text=f"out {n}",
+                inner_text="in",
+                card_color=Card.CardColorChoices.TEAL,
+                font_size=Card.FontSizeChoices.XLARGE,
+                is_public=n % 2 == 0,
+            )
+            card.liked_by.add(other)
+            for m in range(n):
+                Comment.objects.create(card=card, user=other, body=f"c{m}")
+
+        request = Request(APIRequestFactory().get("/cards/all/"))
+        request.user = other
+        cards = Card.objects.order_by("-posted_at", "-id")
+        expected = CardSummarySerializer(
+            cards, many=True, context={"request": request}
+        ).data
+        actual = CardFeedSerializer(request).serialize(card_rows(cards))
+
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(actual), renderer.render(expected))
+
+
+class ResponseCacheTests(APITransactionTestCase):
+    def setUp(self):
+        caches[settings.FEED_CACHE_ALIAS].clear()
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.card = Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+        self.client.force_authenticate(self.user)
+
+    def test_repeat_requests_are_served_from_cache(self):
+        url = f"/cards/{self.card.id}/"
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first["ETag"], second["ETag"])
+        self.assertEqual(response_cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get("/cards/all/")["ETag"]
+        response = self.client.get("/cards/all/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+    def test_writes_invalidate_dependent_responses(self):
+        detail = self.client.get(f"/cards/{self.card.id}/")["ETag"]
+        mine = self.client.get("/cards/mine/")["ETag"]
+
+        self.card.liked_by.add(self.other)
+        response = self.client.get(f"/cards/{self.card.id}/", HTTP_IF_NONE_MATCH=detail)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["liked_by"], ["other"])
+
+        Comment.objects.create(card=self.card, user=self.other, body="hi")
+        response = self.client.get("/cards/mine/", HTTP_IF_NONE_MATCH=mine)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0]["comment_count"], 1)
+
+    def test_evicted_versions_do_not_come_back(self):
+        url = f"/cards/{self.card.id}/"
+        store = caches[settings.FEED_CACHE_ALIAS]
+        store.clear()
+        etag = self.client.get(url)["ETag"]
+        self.card.liked_by.add(self.other)
+        # the store loses the versions, e.g. Redis restarts
+        store.clear()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_feeds_are_cached_per_user(self):
+        self.card.liked_by.add(self.user)
+        self.assertTrue(self.client.get("/cards/all/").data["results"][0]["liked"])
+
+        self.client.force_authenticate(self.other)
+        response = self.client.get("/cards/all/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertFalse(response.data["results"][0]["liked"])
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        caches[settings.METRICS_CACHE_ALIAS].clear()
+        metrics._histograms.clear()
+        metrics._requests.clear()
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+        self.client.force_authenticate(self.user)
+
+    def test_requests_are_recorded_per_view(self):
+        self.client.get("/cards/all/")
+        self.client.get("/cards/all/")
+        self.client.get("/users/")
+
+        with self.settings(DEBUG=True):
+            body = self.client.get("/metrics/").content.decode()
+        all_cards = '{view="card-all",method="GET"}'
+        self.assertIn(f"instaky_request_queries_count{all_cards} 2", body)
+        self.assertIn(f"instaky_request_sql_seconds_count{all_cards} 2", body)
+        self.assertIn('instaky_response_bytes_bucket{view="card-all"', body)
+        self.assertIn(
+            'instaky_requests_total{view="user-list",method="GET",status="200"} 1',
+            body,
+        )
+        self.assertIn(
+            'instaky_request_duration_seconds_bucket{view="card-all",method="GET",'
+            'le="+Inf"} 2',
+            body,
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_endpoint_requires_token_when_configured(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+        response = self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN="")
+    def test_endpoint_without_token_is_closed_outside_debug(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get("/metrics/").status_code, 200)
+
+    @override_settings(SLOW_REQUEST_SECONDS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs("instaky.slow_requests", "WARNING") as logs:
+            self.client.get("/cards/all/")
+        self.assertIn("(card-all)", logs.output[0])
+        self.assertIn('FROM "instaky_card"', logs.output[0])
+
+
+@override_settings(ASYNC_CONCURRENT_QUERIES=False)
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.reader = User.objects.create_user(username="reader", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        for n in range(3):
+            card = Card.objects.create(
+                user=self.author, outer_text=f"out {n}", inner_text="in"
+            )
+            card.liked_by.add(self.reader)
+            Comment.objects.create(card=card, user=self.reader, body=f"c{n}")
+        Card.objects.create(user=self.reader, outer_text="mine", inner_text="in")
+        self.client.force_authenticate(self.reader)
+        self.client.post(f"/users/{self.author.id}/follow/")
+        token = Token.objects.create(user=self.reader)
+        self.auth = {"AUTHORIZATION": f"Token {token.key}"}
+
+    def test_async_endpoints_return_what_the_sync_ones_do(self):
+        for path in [
+            "/cards/all/?page_size=2&comments=1",
+            "/cards/mine/",
+            "/cards/following/?fields=id,liked,recent_comments",
+            f"/users/{self.author.id}/",
+            f"/users/{self.author.id}/cards/?expand=user",
+        ]:
+            expected = self.client.get(path, HTTP_ACCEPT="application/json").json()
+            response = async_to_sync(self.async_client.get)(
+                f"/async{path}", **self.auth
+            )
+            self.assertEqual(response.status_code, 200, path)
+            actual = response.json()
+            if "next" in expected:
+                self.assertEqual(actual["results"], expected["results"], path)
+                self.assertEqual(bool(actual["next"]), bool(expected["next"]), path)
+            else:
+                self.assertEqual(actual, expected, path)
+
+        response = async_to_sync(self.async_client.get)(
+            "/async/cards/all/?page_size=2", **self.auth
+        )
+        self.assertTrue(response.json()["next"].startswith("http://testserver/async/"))
+
+    def test_errors_match_drf(self):
+        get = async_to_sync(self.async_client.get)
+        response = get("/async/cards/all/")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response["WWW-Authenticate"], "Token")
+
+        response = get("/async/users/999999/", **self.auth)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), self.client.get("/users/999999/").json())
+
+        response = get("/async/cards/all/?fields=nope", **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("fields", response.json())
+
+
+class AsyncConcurrentQueryTests(APITransactionTestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        metrics._histograms.clear()
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        card = Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+        card.liked_by.add(self.user)
+        Comment.objects.create(card=card, user=self.user, body="hi")
+        self.token = Token.objects.create(user=self.user)
+
+    def test_sub_queries_run_in_worker_threads_and_are_counted(self):
+        response = async_to_sync(self.async_client.get)(
+            "/async/cards/all/", AUTHORIZATION=f"Token {self.token.key}"
+        )
+        self.assertEqual(response.status_code, 200)
+        (entry,) = response.json()["results"]
+        self.assertTrue(entry["liked"])
+        self.assertEqual([c["body"] for c in entry["recent_comments"]], ["hi"])
+
+        # token lookup, page of cards, likes, comment previews
+        queries = metrics._histograms["instaky_request_queries"]
+        self.assertEqual(queries[("async-card-all", "GET")][-1], 4)
+
+
+@override_settings(EVENTS_KEEPALIVE_SECONDS=0.5)
+class EventStreamTests(APITransactionTestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.reader = User.objects.create_user(username="reader", password="pass")
+        self.stranger = User.objects.create_user(username="stranger", password="pass")
+        self.reader.following.add(self.author)
+        self.card = Card.objects.create(
+            user=self.author, outer_text="o", inner_text="i"
+        )
+
+    def events(self, user, action, query="token={key}"):
+        """The events ``user``'s stream receives while ``action`` runs."""
+        from project.asgi import application
+
+        key = Token.objects.get_or_create(user=user)[0].key
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/events/",
+            "query_string": query.format(key=key).encode(),
+            "headers": [],
+        }
+
+        async def run():
+            stream = ApplicationCommunicator(application, scope)
+            await stream.send_input({"type": "http.request", "body": b""})
+            start = await stream.receive_output(5)
+            if start["status"] != 200:
+                return start["status"], []
+            await stream.receive_output(5)
+            await sync_to_async(action)()
+            received = []
+            while True:
+                chunk = (await stream.receive_output(5))["body"].decode()
+                if chunk.startswith(": keepalive"):
+                    break
+                received.append(json.loads(chunk.split("data: ", 1)[1]))
+            await stream.send_input({"type": "http.disconnect"})
+            await stream.wait(5)
+            return 200, received
+
+        return async_to_sync(run)()
+
+    def as_user(self, user, method, path, body=None):
+        self.client.force_authenticate(user)
+        response = getattr(self.client, method)(path, body, format="json")
+        self.assertLess(response.status_code, 300)
+
+    def test_followers_hear_of_new_cards(self):
+        def post():
+            self.as_user(
+                self.author, "post", "/cards/", {"outer_text": "hi", "inner_text": "in"}
+            )
+
+        status, received = self.events(self.reader, post)
+        self.assertEqual(status, 200)
+        (event,) = received
+        self.assertEqual(event["type"], "card")
+        self.assertEqual(event["user"], "author")
+        self.assertEqual(self.events(self.stranger, post), (200, []))
+
+    def test_authors_hear_of_likes_and_comments(self):
+        def react():
+            self.as_user(self.reader, "post", f"/cards/{self.card.id}/like/")
+            self.as_user(self.reader, "post", f"/cards/{self.card.id}/like/")
+            self.as_user(
+                self.reader,
+                "post",
+                "/comments/",
+                {"card": f"http://testserver/cards/{self.card.id}/", "body": "nice"},
+            )
+            # acting on your own card is not news to you
+            self.as_user(self.author, "post", f"/cards/{self.card.id}/like/")
+
+        status, received = self.events(self.author, react)
+        self.assertEqual(
+            [(event["type"], event["card"], event["user"]) for event in received],
+            [("like", self.card.id, "reader"), ("comment", self.card.id, "reader")],
+        )
+
+    def response_start(self, query, origin):
+        from project.asgi import application
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/events/",
+            "query_string": query.encode(),
+            "headers": [(b"origin", origin.encode())],
+        }
+
+        async def run():
+            stream = ApplicationCommunicator(application, scope)
+            await stream.send_input({"type": "http.request", "body": b""})
+            start = await stream.receive_output(5)
+            await stream.send_input({"type": "http.disconnect"})
+            await stream.wait(5)
+            return start
+
+        return async_to_sync(run)()
+
+    def test_stream_allows_cross_origin_clients(self):
+        query = f"token={Token.objects.create(user=self.reader).key}"
+        start = self.response_start(query, "https://app.example")
+        self.assertIn((b"access-control-allow-origin", b"*"), start["headers"])
+        start = self.response_start("", "https://app.example")
+        self.assertEqual(start["status"], 401)
+        self.assertIn((b"access-control-allow-origin", b"*"), start["headers"])
+
+        with override_settings(
+            CORS_ORIGIN_ALLOW_ALL=False,
+            CORS_ALLOWED_ORIGINS=["https://app.example"],
+            CORS_ALLOW_CREDENTIALS=True,
+        ):
+            start = self.response_start(query, "https://app.example")
+            self.assertIn(
+                (b"access-control-allow-origin", b"https://app.example"),
+                start["headers"],
+            )
+            self.assertIn(
+                (b"access-control-allow-credentials", b"true"), start["headers"]
+            )
+            start = self.response_start(query, "https://elsewhere.example")
+            self.assertNotIn(b"access-control-allow-origin", dict(start["headers"]))
+
+    def test_stream_requires_a_token(self):
+        self.assertEqual(self.events(self.reader, None, query="")[0], 401)
+        self.assertEqual(self.events(self.reader, None, query="token=nope")[0], 401)
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class ReplicaRoutingTests(APITestCase):
+    databases = {"default", "replica1"}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        for user in (self.user, self.other):
+            user.save(using="replica1")
+        # what the replica has not caught up with yet
+        self.fresh = Card.objects.create(user=self.other, outer_text="new")
+        self.stale = Card(user=self.other, outer_text="old")
+        self.stale.save(using="replica1")
+        self.client.force_authenticate(self.user)
+
+    def feed_ids(self):
+        response = self.client.get("/cards/all/")
+        self.assertEqual(response.status_code, 200)
+        return [card["id"] for card in response.data["results"]]
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.feed_ids(), [self.stale.id])
+        self.assertEqual(
+            self.client.get(f"/users/{self.other.id}/cards/").data["results"][0]["id"],
+            self.stale.id,
+        )
+
+        self.client.force_authenticate(self.other)
+        response = self.client.post(
+            "/cards/", {"outer_text": "o", "inner_text": "i"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Card.objects.filter(id=response.data["id"]).exists())
+        self.assertFalse(
+            Card.objects.using("replica1").filter(id=response.data["id"]).exists()
+        )
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        response = self.client.post(f"/cards/{self.fresh.id}/like/")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.feed_ids(), [self.fresh.id])
+
+        # other people still read from the replica
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.feed_ids(), [self.stale.id])
+
+        # and so does the writer once the replicas have caught up
+        cache.delete(replicas.pin_key(self.user.id))
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.feed_ids(), [self.stale.id])
+
+    def test_replica_reads_right_after_a_bump_are_cached_briefly(self):
+        token = replicas.reads.set("replica1")
+        self.addCleanup(replicas.reads.reset, token)
+        self.assertEqual(response_cache.timeout(["cards"]), settings.FEED_CACHE_TIMEOUT)
+        response_cache.backend().set(response_cache.bumped_key("cards"), True)
+        self.assertEqual(
+            response_cache.timeout(["cards"]), settings.REPLICA_LAG_SECONDS
+        )
+
+    @override_settings(REPLICA_LAG_SECONDS=0)
+    def test_pinning_can_be_turned_off(self):
+        self.client.post(f"/cards/{self.fresh.id}/like/")
+        self.assertEqual(self.feed_ids(), [self.stale.id])
+
+
+class BulkCardTests(APITestCase):
+    def setUp(self):
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.follower = User.objects.create_user(username="fan", password="pass")
+        self.user.followers.add(self.follower)
+        self.client.force_authenticate(self.user)
+
+    def test_ids_without_returning_bulk_inserts(self):
+        db = connections["default"]
+        Card.objects.create(user=self.follower, outer_text="before")
+        for vendor in ["sqlite", "other"]:
+            entries = [
+                (self.user, {"outer_text": f"{vendor} {n}", "inner_text": "i"})
+                for n in range(3)
+            ]
+            with mock.patch.object(
+                type(db.features), "can_return_rows_from_bulk_insert", False
+            ), mock.patch.object(db, "vendor", vendor):
+                results = bulk.create_cards(entries, publish=False)
+            self.assertEqual(
+                [Card.objects.get(pk=result["id"]).outer_text for result in results],
+                [f"{vendor} {n}" for n in range(3)],
+            )
+
+    def test_post_a_list_of_cards(self):
+        response = self.client.post(
+            "/cards/",
+            [
+                {"outer_text": "one", "inner_text": "1", "card_color": "RD"},
+                {"outer_text": "two", "inner_text": "2"},
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["created"], 2)
+        ids = [result["id"] for result in response.data["results"]]
+        cards = Card.objects.in_bulk(ids)
+        self.assertEqual([cards[pk].outer_text for pk in ids], ["one", "two"])
+        self.assertEqual(cards[ids[0]].card_color, "RD")
+        self.assertEqual(cards[ids[0]].user, self.user)
+        self.assertEqual(
+            set(
+                TimelineEntry.objects.filter(owner=self.follower).values_list(
+                    "card_id", flat=True
+                )
+            ),
+            set(ids),
+        )
+
+    def test_invalid_rows_are_reported_per_row(self):
+        response = self.client.post(
+            "/cards/",
+            [
+                {"outer_text": "ok", "inner_text": "fine"},
+                {"outer_text": "", "inner_text": "x"},
+                {"outer_text": "x", "inner_text": "x", "card_color": "??"},
+                "not a card",
+            ],
+            format="json",
+        )
+        self.assertEqual(response.status_code, 207)
+        results = response.data["results"]
+        self.assertEqual(response.data["created"], 1)
+        self.assertIn("id", results[0])
+        self.assertIn("outer_text", results[1]["errors"])
+        self.assertIn("card_color", results[2]["errors"])
+        self.assertIn("non_field_errors", results[3]["errors"])
+        self.assertEqual(Card.objects.count(), 1)
+
+        response = self.client.post("/cards/", [{"outer_text": ""}], format="json")
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(BULK_CREATE_MAX_CARDS=2)
+    def test_request_size_is_limited(self):
+        card = {"outer_text": "o", "inner_text": "i"}
+        response = self.client.post("/cards/", [card] * 3, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Card.objects.exists())
+
+    def test_import_command(self):
+        lines = [
+            json.dumps({"username": "kyle", "outer_text": "a", "inner_text": "b"}),
+            "",
+            "{not json",
+            json.dumps({"username": "nobody", "outer_text": "a", "inner_text": "b"}),
+            json.dumps({"username": "fan", "outer_text": "c", "inner_text": "d"}),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "cards.ndjson")
+            report = os.path.join(directory, "report.ndjson")
+            with open(source, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            out, err = StringIO(), StringIO()
+            call_command(
+                "import_cards",
+                source,
+                batch_size=2,
+                report=report,
+                stdout=out,
+                stderr=err,
+            )
+            with open(report) as f:
+                results = [json.loads(line) for line in f]
+
+        self.assertIn("Imported 2 cards, rejected 2 lines", out.getvalue())
+        self.assertIn("line 3:", err.getvalue())
+        self.assertEqual([result["line"] for result in results], [1, 3, 4, 5])
+        self.assertIn("username", results[2]["errors"])
+        self.assertEqual(
+            list(
+                Card.objects.order_by("id").values_list("user__username", "outer_text")
+            ),
+            [("kyle", "a"), ("fan", "c")],
+        )
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.card = Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+        other_card = Card.objects.create(user=self.other, outer_text="x")
+        other_card.liked_by.add(self.user)
+        self.comment = Comment.objects.create(
+            user=self.user, card=other_card, body="nice"
+        )
+        Comment.objects.create(user=self.other, card=self.card, body="thanks")
+        self.other_card = other_card
+        self.client.force_authenticate(self.user)
+
+    def records(self, response):
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content)
+        if response.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_ndjson_export_of_a_user(self):
+        response = self.client.get(f"/users/{self.user.id}/export/")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn('filename="kyle-export.ndjson"', response["Content-Disposition"])
+        records = self.records(response)
+        self.assertEqual(
+            [(record["type"], record.get("id")) for record in records],
+            [("cards", self.card.id), ("comments", self.comment.id), ("likes", None)],
+        )
+        self.assertEqual(records[0]["username"], "kyle")
+        self.assertEqual(
+            records[2],
+            {"type": "likes", "card": self.other_card.id, "username": "kyle"},
+        )
+
+    def test_csv_export_of_one_type(self):
+        response = self.client.get(
+            f"/users/{self.user.id}/export/", {"format": "csv", "type": "comments"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        body = b"".join(response.streaming_content).decode()
+        header, *rows = list(csv.reader(body.splitlines()))
+        self.assertEqual(header, export.columns("comments"))
+        self.assertEqual([row[0] for row in rows], [str(self.comment.id)])
+
+        response = self.client.get(f"/users/{self.user.id}/export/", {"format": "csv"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_gzip_when_accepted(self):
+        response = self.client.get(
+            f"/users/{self.user.id}/export/",
+            {"type": "cards"},
+            HTTP_ACCEPT_ENCODING="gzip, deflate",
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(
+            [record["id"] for record in self.records(response)], [self.card.id]
+        )
+
+        for refused in ["gzip;q=0, deflate", "*;q=0", "gzip; q=0.0, *"]:
+            response = self.client.get(
+                f"/users/{self.user.id}/export/", HTTP_ACCEPT_ENCODING=refused
+            )
+            self.assertFalse(response.has_header("Content-Encoding"), refused)
+
+    def test_only_the_user_or_staff_may_export(self):
+        self.assertEqual(
+            self.client.get(f"/users/{self.other.id}/export/").status_code, 403
+        )
+        self.assertEqual(self.client.get("/export/").status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(
+            len(self.records(self.client.get(f"/users/{self.other.id}/export/"))), 2
+        )
+        records = self.records(self.client.get("/export/", {"type": "cards,comments"}))
+        self.assertEqual(len(records), 4)
+
+        self.assertEqual(self.client.get("/export/", {"type": "nope"}).status_code, 400)
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command("export_data", user="other", types=["cards"], stdout=out)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record["id"] for record in records], [self.other_card.id])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "likes.csv.gz")
+            call_command(
+                "export_data",
+                fmt="csv",
+                types=["likes"],
+                output=path,
+                gzip=True,
+                stdout=StringIO(),
+            )
+            with gzip.open(path, "rt") as f:
+                self.assertEqual(
+                    list(csv.reader(f)),
+                    [["card", "username"], [str(self.other_card.id), "kyle"]],
+                )
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2, EXPORT_BUFFER_BYTES=64)
+class ExportASGITests(APITransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        for number in range(5):
+            Card.objects.create(user=self.user, outer_text=f"o{number}")
+        self.token = Token.objects.create(user=self.user)
+
+        # The export holds back its last rows until resume is set.
+        self.resume, self.finished = threading.Event(), threading.Event()
+        rows = export.rows
+
+        def held_rows(*args, **kwargs):
+            for number, row in enumerate(rows(*args, **kwargs)):
+                if number == 3:
+                    self.resume.wait(2)
+                yield row
+            self.finished.set()
+
+        patch = mock.patch.object(export, "rows", held_rows)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    async def request(self, path, query_string=b""):
+        from project.asgi import application
+
+        scope = {
+            "type": "http",
+            "http_version": "1.1",
+            "method": "GET",
+            "path": path,
+            "query_string": query_string,
+            "headers": [(b"authorization", f"Token {self.token.key}".encode())],
+        }
+        stream = ApplicationCommunicator(application, scope)
+        await stream.send_input({"type": "http.request", "body": b""})
+        return stream
+
+    async def body(self, stream):
+        chunks = []
+        while True:
+            message = await stream.receive_output(5)
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    def test_exports_stream_through_the_asgi_application(self):
+        async def run():
+            stream = await self.request(f"/users/{self.user.id}/export/", b"type=cards")
+            start = await stream.receive_output(5)
+            chunks = [(await stream.receive_output(5))["body"]]
+            streamed = not self.finished.is_set()
+            self.resume.set()
+            chunks.append(await self.body(stream))
+            return start, streamed, chunks
+
+        start, streamed, chunks = async_to_sync(run)()
+        self.assertEqual(start["status"], 200)
+        headers = {name.lower(): value for name, value in start["headers"]}
+        self.assertEqual(headers[b"content-type"], b"application/x-ndjson")
+        self.assertTrue(streamed)
+        records = [json.loads(line) for line in b"".join(chunks).splitlines()]
+        self.assertEqual(
+            [record["outer_text"] for record in records],
+            [f"o{number}" for number in range(5)],
+        )
+
+    def test_other_requests_run_while_an_export_streams(self):
+        self.client.force_authenticate(self.user)
+
+        async def run():
+            stream = await self.request(f"/users/{self.user.id}/export/", b"type=cards")
+            await stream.receive_output(5)
+            # on the thread Django 3.1's ASGI handler runs every sync view on
+            other = await sync_to_async(self.client.get, thread_sensitive=True)(
+                "/cards/all/"
+            )
+            during = not self.finished.is_set()
+            self.resume.set()
+            await self.body(stream)
+            return other, during
+
+        other, during = async_to_sync(run)()
+        self.assertEqual(other.status_code, 200)
+        self.assertTrue(during)
+
+
+class TrendingTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.old, self.new, self.hidden = [
+            Card.objects.create(user=self.author, outer_text=text, inner_text="i")
+            for text in ("old", "new", "hidden")
+        ]
+        self.client.force_authenticate(self.user)
+
+    def trending_ids(self):
+        response = self.client.get("/cards/trending/")
+        self.assertEqual(response.status_code, 200)
+        return [card["id"] for card in response.data["results"]]
+
+    def test_likes_and_comments_rank_cards(self):
+        self.client.post(f"/cards/{self.old.id}/like/")
+        self.client.post(f"/cards/{self.old.id}/like/")
+        response = self.client.post(
+            "/comments/",
+            {"body": "wow", "card": f"http://testserver/cards/{self.new.id}/"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        # a weighted like and a comment score 1 and 2, and liking twice counts once
+        score = TrendingScore.objects.get(card=self.new).score
+        self.assertAlmostEqual(trending.current(score), 2, places=3)
+        self.assertEqual(self.trending_ids(), [self.new.id, self.old.id])
+
+    def test_scores_decay(self):
+        two_days_ago = timezone.now() - timedelta(days=2)
+        for _ in range(10):
+            trending.record(self.old.id, 1, moment=two_days_ago)
+        trending.record(self.new.id, 1)
+        trending.record(self.hidden.id, 5)
+        Card.objects.filter(pk=self.hidden.pk).update(is_public=False)
+
+        self.assertAlmostEqual(
+            trending.current(TrendingScore.objects.get(card=self.old).score),
+            10 / 2**4,
+            places=3,
+        )
+        self.assertEqual(self.trending_ids(), [self.new.id, self.old.id])
+
+        with override_settings(TRENDING_MIN_SCORE=0.9):
+            self.assertEqual(self.trending_ids(), [self.new.id])
+            out = StringIO()
+            call_command("decay_trending", stdout=out)
+        self.assertIn("Pruned 1", out.getvalue())
+        self.assertFalse(TrendingScore.objects.filter(card=self.old).exists())
+
+    def test_pages_do_not_repeat_cards_as_scores_move(self):
+        extra = Card.objects.create(user=self.author, outer_text="o", inner_text="i")
+        Card.objects.filter(pk=self.hidden.pk).update(is_public=True)
+        cards = [self.old, self.new, self.hidden, extra]
+        for weight, card in enumerate(cards, start=1):
+            trending.record(card.id, weight)
+        first = self.client.get("/cards/trending/", {"page_size": 2}).data
+        self.assertEqual(
+            [card["id"] for card in first["results"]], [extra.id, self.hidden.id]
+        )
+
+        # a card from the next page jumps to the top while the reader pages on
+        trending.record(self.old.id, 10)
+        second = self.client.get(first["next"]).data
+        self.assertEqual([card["id"] for card in second["results"]], [self.new.id])
+        self.assertIsNone(second["next"])
+
+
+class RendererTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        for number in range(30):
+            card = Card.objects.create(
+                user=self.user,
+                outer_text=f"Grüße \u2028 {number}",
+                inner_text="i" * 100,
+            )
+            Comment.objects.create(user=self.user, card=card, body="nice")
+        self.client.force_authenticate(self.user)
+
+    def test_fast_json_matches_drf(self):
+        data = self.client.get("/cards/all/").data
+        for value in (data, {"big": 2**70, 1: None}, None):
+            self.assertEqual(
+                renderers.FastJSONRenderer().render(value),
+                JSONRenderer().render(value),
+            )
+        indented = "application/json; indent=2"
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(data, indented),
+            JSONRenderer().render(data, indented),
+        )
+
+    def test_large_responses_are_compressed(self):
+        plain = self.client.get("/cards/all/")
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", plain["Vary"])
+
+        response = self.client.get("/cards/all/", HTTP_ACCEPT_ENCODING="gzip, br;q=0")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response["ETag"], "W/" + plain["ETag"])
+        response = self.client.get(
+            "/cards/all/",
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+
+        with override_settings(COMPRESSION_MIN_BYTES=len(plain.content) + 1):
+            response = self.client.get("/cards/all/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli_is_preferred(self):
+        plain = self.client.get("/cards/all/")
+        response = self.client.get("/cards/all/", HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(response.content), plain.content)
+
+    def test_gzip_without_brotli(self):
+        with mock.patch.object(compression, "brotli", None):
+            response = self.client.get("/cards/all/", HTTP_ACCEPT_ENCODING="br, gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    @skipUnless(renderers.msgpack, "msgpack is not installed")
+    def test_messagepack_on_request(self):
+        plain = self.client.get("/cards/all/")
+        response = self.client.get("/cards/all/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(
+            renderers.msgpack.unpackb(response.content), json.loads(plain.content)
+        )
+
+    def test_messagepack_needs_msgpack(self):
+        with mock.patch.object(renderers.MessagePackRenderer, "available", False):
+            response = self.client.get("/cards/all/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, 406)
+
+
+class BenchmarkCommandTests(APITestCase):
+    def setUp(self):
+        call_command(
+            "generate_data", users=30, images=0, stdout=StringIO(), prefix="bench-"
+        )
+
+    def test_generated_graph_is_consistent(self):
+        users = User.objects.filter(username__startswith="bench-")
+        self.assertEqual(users.count(), 30)
+        self.assertTrue(Card.objects.exists())
+        card = Card.objects.order_by("-like_count").first()
+        self.assertEqual(card.like_count, card.liked_by.count())
+        follower = User.objects.filter(following__isnull=False).first()
+        self.assertEqual(
+            TimelineEntry.objects.filter(owner=follower).count(),
+            Card.objects.filter(user__followers=follower).count(),
+        )
+
+    def test_regressions_fail_the_run(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, "baseline.json")
+            options = {"requests": 1, "baseline": Path(baseline), "stdout": StringIO()}
+            call_command(
+                "bench_endpoints", routes=["card-all"], update_baseline=True, **options
+            )
+            with open(baseline) as f:
+                recorded = json.load(f)
+            self.assertIn("p99_ms", recorded["routes"]["card-all"])
+
+            recorded["routes"]["card-all"]["queries"] = 0
+            with open(baseline, "w") as f:
+                json.dump(recorded, f)
+            with self.assertRaisesMessage(CommandError, "card-all"):
+                call_command("bench_endpoints", routes=["card-all"], **options)
+
+    def test_every_route_is_measured(self):
+        def names(resolver):
+            for pattern in resolver.url_patterns:
+                if isinstance(pattern, URLResolver):
+                    yield from names(pattern)
+                elif pattern.name:
+                    yield pattern.name
+
+        measured = {name for name, _, _, _ in bench_endpoints.ROUTES}
+        self.assertEqual(
+            set(names(get_resolver("instaky.urls")))
+            - measured
+            - bench_endpoints.UNMEASURED,
+            set(),
+        )
+
+    @override_settings(ASYNC_CONCURRENT_QUERIES=False, PREVIEW_RENDER_PROCESSES=0)
+    def test_all_routes_run(self):
+        self.addCleanup(cache.clear)
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            MEDIA_ROOT=directory
+        ):
+            baseline = Path(directory) / "baseline.json"
+            call_command(
+                "bench_endpoints",
+                requests=1,
+                baseline=baseline,
+                update_baseline=True,
+                stdout=StringIO(),
+            )
+            routes = json.loads(baseline.read_text())["routes"]
+        self.assertIn("card-create-many", routes)
+        self.assertIn("async-user-cards", routes)
+        self.assertIn("export", routes)
+        self.assertIn("card-preview", routes)
+        self.assertFalse(Token.objects.exists())
+
+    def test_a_missing_baseline_fails(self):
+        with self.assertRaisesMessage(CommandError, "No baseline"):
+            call_command(
+                "bench_endpoints",
+                routes=["card-all"],
+                requests=1,
+                baseline=Path(tempfile.gettempdir()) / "no-such-baseline.json",
+                stdout=StringIO(),
+            )
+
+    def test_renderer_benchmark(self):
+        out = StringIO()
+        call_command("bench_renderers", iterations=1, stdout=out, stderr=out)
+        self.assertIn("json (DRF)", out.getvalue())
+        self.assertNotIn("differs", out.getvalue())
+
+
+@override_settings(
+    IMAGE_PIPELINE_ASYNC=False,
+    IMAGE_VARIANT_WIDTHS=[40, 80],
+    IMAGE_VARIANT_FORMATS=["jpeg", "webp"],
+)
+class LocalMediaTestCase(APITestCase):
+    """Stores uploads in a throwaway local MEDIA_ROOT."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(
+            MEDIA_ROOT=media.name,
+            CHUNKED_UPLOAD_DIR=os.path.join(media.name, "chunks"),
+        )
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+        self.user = User.objects.create_user(username="kyle", password="pass")
+        self.card = Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+        self.client.force_authenticate(self.user)
+
+    def jpeg(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Camera Maker"
+        buffer = BytesIO()
+        Image.new("RGB", (120, 60), "red").save(buffer, "JPEG", exif=exif)
+        return buffer.getvalue()
+
+    def upload(self, url, body=None):
+        return self.client.post(
+            url,
+            body or self.jpeg(),
+            content_type="image/jpeg",
+            HTTP_CONTENT_DISPOSITION="attachment; filename=upload.jpg",
+        )
+
+
+class ImagePipelineTests(LocalMediaTestCase):
+    def test_card_image_variants(self):
+        response = self.upload(f"/cards/{self.card.id}/image/")
+        self.assertEqual(response.status_code, 201)
+
+        self.card.refresh_from_db()
+        self.assertEqual((self.card.image_width, self.card.image_height), (120, 60))
+        self.assertEqual(
+            sorted((v["format"], v["width"]) for v in self.card.image_variants),
+            [("jpeg", 40), ("jpeg", 80), ("webp", 40), ("webp", 80)],
+        )
+        storage = self.card.image.storage
+        for variant in self.card.image_variants:
+            with storage.open(variant["name"]) as stored:
+                self.assertEqual(len(Image.open(stored).getexif()), 0)
+
+        srcset = self.client.get(f"/cards/{self.card.id}/").data["image_srcset"]
+        self.assertEqual(set(srcset), {"jpeg", "webp"})
+        self.assertTrue(srcset["webp"].endswith("80w"))
+
+    def test_delete_image_removes_variants(self):
+        self.upload(f"/cards/{self.card.id}/image/")
+        self.card.refresh_from_db()
+        names = [variant["name"] for variant in self.card.image_variants]
+
+        self.client.post(f"/cards/{self.card.id}/delete_image/")
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.image_variants, [])
+        self.assertFalse(any(self.card.image.storage.exists(name) for name in names))
+
+    def test_profile_picture_variants(self):
+        response = self.client.post(
+            f"/users/{self.user.id}/image/",
+            {"file": SimpleUploadedFile("me.jpg", self.jpeg(), "image/jpeg")},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_picture_width, 120)
+        self.assertEqual(len(self.user.profile_picture_variants), 4)
+
+
+class ContentAddressedStorageTests(LocalMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+
+    def test_same_bytes_are_stored_once(self):
+        self.upload(f"/cards/{self.card.id}/image/")
+        self.upload(f"/cards/{self.other.id}/image/")
+        self.card.refresh_from_db()
+        self.other.refresh_from_db()
+
+        name = self.card.image.name
+        digest = hashlib.sha256(self.jpeg()).hexdigest()
+        self.assertEqual(name, f"post_images/sha256/{digest[:2]}/{digest}.jpg")
+        self.assertEqual(self.other.image.name, name)
+        self.assertEqual(self.other.image_variants, self.card.image_variants)
+        stored = StoredImage.objects.get(name=name)
+        self.assertEqual((stored.refcount, stored.width), (2, 120))
+
+        storage = self.card.image.storage
+        variants = [variant["name"] for variant in stored.variants]
+        self.client.post(f"/cards/{self.card.id}/delete_image/")
+        self.assertTrue(storage.exists(name))
+        self.assertTrue(all(storage.exists(variant) for variant in variants))
+        self.assertEqual(StoredImage.objects.get(name=name).refcount, 1)
+
+        self.other.delete()
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(any(storage.exists(variant) for variant in variants))
+
+    def test_replacing_an_image_releases_the_old_one(self):
+        self.upload(f"/cards/{self.card.id}/image/")
+        self.card.refresh_from_db()
+        old = self.card.image.name
+
+        buffer = BytesIO()
+        Image.new("RGB", (50, 50), "blue").save(buffer, "JPEG")
+        self.upload(f"/cards/{self.card.id}/image/", buffer.getvalue())
+        self.card.refresh_from_db()
+        self.assertNotEqual(self.card.image.name, old)
+        self.assertFalse(self.card.image.storage.exists(old))
+        self.assertEqual(self.card.image_width, 50)
+
+    def test_dedupe_images_command(self):
+        storage = self.card.image.storage
+        for card in (self.card, self.other):
+            card.image.name = storage.save(
+                "post_images/legacy.jpg", SimpleUploadedFile("a.jpg", self.jpeg())
+            )
+            card.save()
+        legacy = [self.card.image.name, self.other.image.name]
+
+        call_command("dedupe_images", stdout=StringIO())
+        self.card.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.card.image.name, self.other.image.name)
+        self.assertIn("/sha256/", self.card.image.name)
+        self.assertEqual(StoredImage.objects.get().refcount, 2)
+        self.assertEqual(self.other.image_width, 120)
+        self.assertFalse(any(storage.exists(name) for name in legacy))
+
+
+class DirectUploadTests(LocalMediaTestCase):
+    def intent(self, url, content_type="image/jpeg"):
+        return self.client.post(
+            url,
+            {"filename": "photo.jpg", "content_type": content_type},
+            format="json",
+        )
+
+    def test_upload_through_intent(self):
+        intent = self.intent(f"/cards/{self.card.id}/image_intent/")
+        self.assertEqual(intent.status_code, 201)
+        self.assertEqual(intent.data["method"], "PUT")
+
+        self.client.logout()
+        uploaded = self.client.put(
+            intent.data["url"], self.jpeg(), content_type="image/jpeg"
+        )
+        self.assertEqual(uploaded.status_code, 204)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            f"/cards/{self.card.id}/image_complete/",
+            {"token": intent.data["token"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.card.refresh_from_db()
+        self.assertTrue(self.card.image.name.endswith("photo.jpg"))
+        self.assertEqual(self.card.image_width, 120)
+
+    def test_rejects_unsupported_types_and_foreign_tokens(self):
+        response = self.intent(f"/cards/{self.card.id}/image_intent/", "text/html")
+        self.assertEqual(response.status_code, 400)
+
+        intent = self.intent(f"/users/{self.user.id}/image_intent/")
+        response = self.client.post(
+            f"/cards/{self.card.id}/image_complete/",
+            {"token": intent.data["token"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(UPLOAD_MAX_BYTES=10)
+    def test_rejects_oversized_uploads(self):
+        intent = self.intent(f"/users/{self.user.id}/image_intent/")
+        response = self.client.put(
+            intent.data["url"], self.jpeg(), content_type="image/jpeg"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_the_user_can_change_their_profile_picture(self):
+        other = User.objects.create_user(username="other", password="pass")
+        self.client.force_authenticate(other)
+        for action, body in [
+            (
+                "image",
+                {"file": SimpleUploadedFile("me.jpg", self.jpeg(), "image/jpeg")},
+            ),
+            ("image_intent", {"filename": "me.jpg", "content_type": "image/jpeg"}),
+            ("image_complete", {"token": "x"}),
+            ("image_resumable", {"content_type": "image/jpeg", "size": 10}),
+            ("delete_image", {}),
+        ]:
+            response = self.client.post(
+                f"/users/{self.user.id}/{action}/", body, format="multipart"
+            )
+            self.assertEqual(response.status_code, 403, action)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_complete_before_upload_fails(self):
+        intent = self.intent(f"/users/{self.user.id}/image_intent/")
+        response = self.client.post(
+            f"/users/{self.user.id}/image_complete/",
+            {"token": intent.data["token"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ChunkedUploadTests(LocalMediaTestCase):
+    def start(self, size, content_type="image/jpeg"):
+        return self.client.post(
+            f"/cards/{self.card.id}/image_resumable/",
+            {"filename": "big.jpg", "content_type": content_type, "size": size},
+            format="json",
+        )
+
+    def put(self, url, chunk, offset, checksum=None):
+        checksum = checksum or base64.b64encode(hashlib.sha256(chunk).digest())
+        return self.client.put(
+            url,
+            chunk,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+            HTTP_UPLOAD_CHECKSUM=f"sha256 {checksum.decode()}",
+        )
+
+    def test_resumable_upload(self):
+        data = self.jpeg()
+        upload = self.start(len(data))
+        self.assertEqual(upload.status_code, 201)
+        url = upload.data["url"]
+
+        half = len(data) // 2
+        self.assertEqual(self.put(url, data[:half], 0).data["offset"], half)
+
+        corrupted = self.put(url, data[half:], half, checksum=b"AAAA")
+        self.assertEqual(corrupted.status_code, 400)
+        self.assertEqual(self.client.get(url)["Upload-Offset"], str(half))
+
+        self.assertEqual(self.put(url, data[half:], 0).status_code, 409)
+        self.assertEqual(self.put(url, data[half:], half).data["offset"], len(data))
+
+        response = self.client.post(f"{url}complete/")
+        self.assertEqual(response.status_code, 201)
+        self.card.refresh_from_db()
+        with self.card.image.open("rb") as stored:
+            self.assertEqual(stored.read(), data)
+        self.assertEqual(self.card.image_width, 120)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_limits_are_enforced_before_assembly(self):
+        with override_settings(UPLOAD_MAX_BYTES=10):
+            self.assertEqual(self.start(11).status_code, 400)
+        self.assertEqual(self.start(10, "text/html").status_code, 400)
+
+        upload = self.start(4)
+        self.assertEqual(self.put(upload.data["url"], b"12345", 0).status_code, 400)
+        self.put(upload.data["url"], b"1234", 0)
+        response = self.client.post(f"{upload.data['url']}complete/")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_chunks_reaching_a_worker_without_the_spool_file(self):
+        data = self.jpeg()
+        url = self.start(len(data)).data["url"]
+        half = len(data) // 2
+        self.put(url, data[:half], 0)
+
+        # another worker, with its own CHUNKED_UPLOAD_DIR
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            CHUNKED_UPLOAD_DIR=directory
+        ):
+            response = self.put(url, data[half:], half)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.data["offset"], 0)
+            self.assertEqual(response["Upload-Offset"], "0")
+
+            self.assertEqual(self.put(url, data, 0).data["offset"], len(data))
+            response = self.client.post(f"{url}complete/")
+            self.assertEqual(response.status_code, 201)
+        self.card.refresh_from_db()
+        with self.card.image.open("rb") as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_chunks_reaching_a_worker_with_a_short_spool_file(self):
+        data = self.jpeg()
+        url = self.start(len(data)).data["url"]
+        half = len(data) // 2
+        self.put(url, data[:half], 0)
+        spool = chunked.spool_path(ChunkedUpload.objects.get())
+
+        for recover in [chunked.recover, lambda upload: upload]:
+            # an old copy, from before the last chunks went to another worker
+            with open(spool, "r+b") as copy:
+                copy.truncate(half // 2)
+            with mock.patch.object(chunked, "recover", recover):
+                response = self.put(url, data[half:], half)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.data["offset"], 0)
+            self.put(url, data[:half], 0)
+
+        self.put(url, data[half:], half)
+        self.assertEqual(self.client.post(f"{url}complete/").status_code, 201)
+        self.card.refresh_from_db()
+        with self.card.image.open("rb") as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_incomplete_upload_cannot_finish(self):
+        upload = self.start(100)
+        response = self.client.post(f"{upload.data['url']}complete/")
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PREVIEW_RENDER_PROCESSES=0)
+class CardPreviewTests(LocalMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(cache.clear)
+        patch = mock.patch.object(drawing, "draw", wraps=drawing.draw)
+        self.draw = patch.start()
+        self.addCleanup(patch.stop)
+
+    def preview(self, card, **params):
+        response = self.client.get(f"/cards/{card.id}/preview/", params)
+        self.assertEqual(response.status_code, 302)
+        name = response["Location"].split(settings.MEDIA_URL, 1)[1]
+        return name, Image.open(BytesIO(default_storage.open(name).read()))
+
+    def test_preview_is_drawn_once_per_look(self):
+        name, image = self.preview(self.card)
+        self.assertEqual(image.format, "PNG")
+        self.assertEqual(image.size, settings.PREVIEW_SIZE)
+
+        twin = Card.objects.create(user=self.user, outer_text="o", inner_text="other")
+        cache.clear()
+        self.assertEqual(self.preview(twin)[0], name)
+        self.assertEqual(self.draw.call_count, 1)
+
+        webp, image = self.preview(self.card, format="webp")
+        self.assertEqual(image.format, "WEBP")
+        response = self.client.get(
+            f"/cards/{self.card.id}/preview/", HTTP_ACCEPT="image/webp"
+        )
+        self.assertTrue(response["Location"].endswith(webp))
+
+    def test_styles_and_pictures_are_drawn(self):
+        self.upload(f"/cards/{self.card.id}/image/")
+        self.card.refresh_from_db()
+        for font_style, border_style, text_align in [
+            ("U", 1, "J"),
+            ("I", 2, "C"),
+            ("B", 3, "R"),
+        ]:
+            self.card.font_style = font_style
+            self.card.border_style = border_style
+            self.card.text_align = text_align
+            self.card.font_family = "SE"
+            self.card.outer_text = "Happy holidays to everyone " * 8
+            self.card.save()
+            self.preview(self.card)
+        self.assertEqual(self.draw.call_count, 3)
+        self.assertTrue(self.draw.call_args.kwargs["picture"])
+
+    def test_missing_fonts_fall_back_to_pillows_bitmap_font(self):
+        bitmap = ImageFont.load_default_imagefont()
+
+        def load_default(**kwargs):
+            # Pillow before 10.1 takes no size
+            if kwargs:
+                raise TypeError("load_default() got an unexpected keyword 'size'")
+            return bitmap
+
+        with mock.patch.object(
+            ImageFont, "truetype", side_effect=OSError
+        ), mock.patch.object(ImageFont, "load_default", load_default):
+            drawn = drawing.draw(
+                "Happy holidays " * 20, "BL", drawing.SOLID, "Nope.ttf", True, "J", 2
+            )
+        self.assertEqual(Image.open(BytesIO(drawn)).size, (1200, 630))
+
+    def test_edits_discard_previews_no_card_shares(self):
+        old, _ = self.preview(self.card)
+        response = self.client.patch(
+            f"/cards/{self.card.id}/", {"card_color": "RD"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(default_storage.exists(old))
+        self.assertNotEqual(self.preview(self.card)[0], old)
+
+        twin = Card.objects.create(user=self.user, outer_text="o", inner_text="i")
+        shared, _ = self.preview(twin)
+        self.card.card_color = "WH"
+        self.card.save()
+        self.assertTrue(default_storage.exists(shared))
+        twin.delete()
+        self.card.delete()
+        self.assertFalse(default_storage.exists(shared))
+
+    def test_private_cards_are_previewed_for_their_author_only(self):
+        self.client.force_authenticate(None)
+        self.preview(self.card)
+        self.card.is_public = False
+        self.card.save()
+        self.assertEqual(
+            self.client.get(f"/cards/{self.card.id}/preview/").status_code, 404
+        )
+        self.client.force_authenticate(self.user)
+        self.preview(self.card)
+
+    @override_settings(PREVIEW_RENDER_PROCESSES=1)
+    def test_previews_are_drawn_in_worker_processes(self):
+        self.addCleanup(setattr, previews, "_executor", None)
+        self.addCleanup(lambda: previews._executor.shutdown())
+        # the worker processes draw with the real function
+        mock.patch.stopall()
+        name, image = self.preview(self.card)
+        self.assertEqual(image.size, settings.PREVIEW_SIZE)
+        self.assertIsNotNone(previews._executor)
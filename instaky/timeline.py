@@ -0,0 +1,156 @@
+"""
+Materialized "following" feeds.
+
+Every user has a list of TimelineEntry rows, one per card from someone they
+follow. Cards are pushed to followers when they are posted (fan-out on write).
+Authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers are too
+expensive to push to, so their cards are pulled into a reader's timeline when
+the reader opens the feed (fan-out on read).
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from users.models import Follow
+
+from . import replicas
+from .models import Card, TimelineEntry
+
+HIGH_FANOUT_CACHE_KEY = "timeline:high-fanout-authors"
+
+
+def high_fanout_author_ids():
+    author_ids = cache.get(HIGH_FANOUT_CACHE_KEY)
+    if author_ids is None:
+        author_ids = set(
+            Follow.objects.values("followed")
+            .annotate(total=Count("follower"))
+            .filter(total__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS)
+            .values_list("followed", flat=True)
+        )
+        cache.set(
+            HIGH_FANOUT_CACHE_KEY,
+            author_ids,
+            settings.TIMELINE_HIGH_FANOUT_CACHE_SECONDS,
+        )
+    return author_ids
+
+
+def is_high_fanout(author):
+    # Same (cached) source as pull_high_fanout(), so that while an author
+    # crosses the threshold their cards are still either pushed or pulled.
+    return author.id in high_fanout_author_ids()
+
+
+def _entries(owner_ids, cards):
+    return [
+        TimelineEntry(
+            owner_id=owner_id,
+            card_id=card.id,
+            author_id=card.user_id,
+            posted_at=card.posted_at,
+        )
+        for owner_id in owner_ids
+        for card in cards
+    ]
+
+
+def _insert(entries):
+    TimelineEntry.objects.bulk_create(
+        entries, batch_size=settings.TIMELINE_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out(card):
+    """Push a newly posted card onto each of its author's followers' timelines."""
+    if is_high_fanout(card.user):
+        return
+
+    follower_ids = card.user.followers.values_list("id", flat=True)
+    _insert(_entries(follower_ids.iterator(), [card]))
+
+
+def fan_out_many(cards):
+    """fan_out() for many new cards, looking up all their authors' followers at once."""
+    by_author = {}
+    for card in cards:
+        by_author.setdefault(card.user_id, []).append(card)
+    high_fanout = high_fanout_author_ids()
+    follows = Follow.objects.filter(
+        followed__in=[author for author in by_author if author not in high_fanout]
+    ).values_list("followed", "follower")
+
+    entries = []
+    for author_id, follower_id in follows.iterator():
+        entries.extend(_entries([follower_id], by_author[author_id]))
+        if len(entries) >= settings.TIMELINE_BATCH_SIZE:
+            _insert(entries)
+            entries = []
+    _insert(entries)
+
+
+def backfill(follower, author):
+    """Copy an author's recent cards into a new follower's timeline."""
+    cards = Card.objects.filter(user=author).order_by("-posted_at", "-id")
+    _insert(_entries([follower.id], cards[: settings.TIMELINE_BACKFILL_SIZE]))
+
+
+def prune(follower, author):
+    """Drop an author's cards from a former follower's timeline."""
+    TimelineEntry.objects.filter(owner=follower, author=author).delete()
+
+
+def pull_high_fanout(user):
+    """
+    Fan-out on read: copy any cards the user's followed high-fanout authors
+    posted since the last pull into the user's timeline. Returns whether
+    there were any.
+
+    Each author is pulled from their own newest entry in the timeline, less
+    TIMELINE_PULL_OVERLAP_SECONDS for cards whose transaction committed after
+    a newer one was pulled, oldest first and at most TIMELINE_BACKFILL_SIZE
+    at a time, so that a longer run of cards is picked up over the next pulls
+    rather than skipped.
+    """
+    author_ids = list(
+        user.following.filter(id__in=high_fanout_author_ids()).values_list(
+            "id", flat=True
+        )
+    )
+    if not author_ids:
+        return False
+
+    newest = dict(
+        TimelineEntry.objects.filter(owner=user, author_id__in=author_ids)
+        .values("author")
+        .annotate(newest=Max("posted_at"))
+        .values_list("author", "newest")
+    )
+    pulled = TimelineEntry.objects.filter(owner=user).values("card")
+    overlap = timedelta(seconds=settings.TIMELINE_PULL_OVERLAP_SECONDS)
+    entries = []
+    for author_id in author_ids:
+        cards = Card.objects.filter(user_id=author_id)
+        if author_id in newest:
+            cards = cards.filter(posted_at__gte=newest[author_id] - overlap)
+            cards = cards.exclude(id__in=pulled).order_by("posted_at", "id")
+        else:
+            cards = cards.order_by("-posted_at", "-id")
+        entries += _entries([user.id], cards[: settings.TIMELINE_BACKFILL_SIZE])
+    _insert(entries)
+    return bool(entries)
+
+
+def rebuild(user):
+    """Throw away a user's timeline and recompute it from the follow graph."""
+    TimelineEntry.objects.filter(owner=user).delete()
+    cards = Card.objects.filter(user__followers=user).order_by("-posted_at", "-id")
+    _insert(_entries([user.id], cards[: settings.TIMELINE_REBUILD_SIZE]))
+
+
+def timeline_for(user):
+    if pull_high_fanout(user):
+        replicas.stick_to_primary()
+    return TimelineEntry.objects.filter(owner=user)
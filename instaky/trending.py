@@ -0,0 +1,88 @@
+"""
+Trending cards.
+
+A card's trending score is the sum of its likes and comments, weighted by
+TRENDING_LIKE_WEIGHT and TRENDING_COMMENT_WEIGHT and each halved every
+TRENDING_HALF_LIFE_HOURS since it happened. Counting a card's likes and
+comments per request would not scale, so scores are kept in the
+TrendingScore table, updated as cards are liked and commented on, and
+GET /cards/trending/ reads a page of public cards off its score index.
+
+Decaying the scores as time passes would mean rewriting every row, so a row
+holds its card's score as of a fixed EPOCH instead: an event adds
+``weight * 2 ** half_lives(event time)``. Every row gains the same factor
+over time, so ordering by the stored scores is ordering by the decayed ones,
+and the score now is the stored one times ``2 ** -half_lives(now)``. The
+stored scores grow without bound, so rows hold their log2.
+
+Rows whose decayed score has fallen below TRENDING_MIN_SCORE no longer rank;
+the decay_trending command, run periodically, deletes them so that the table
+only holds cards with recent activity.
+"""
+
+import datetime
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TrendingScore
+
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def half_lives(moment=None):
+    """Half-lives from EPOCH to ``moment`` (default: now)."""
+    hours = ((moment or timezone.now()) - EPOCH).total_seconds() / 3600
+    return hours / settings.TRENDING_HALF_LIFE_HOURS
+
+
+def log_add(a, b):
+    """log2(2 ** a + 2 ** b), without leaving log space."""
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def record(card_id, weight, moment=None):
+    """Add an event of ``weight`` to a card's score."""
+    value = math.log2(weight) + half_lives(moment)
+    with transaction.atomic():
+        row, created = TrendingScore.objects.select_for_update().get_or_create(
+            card_id=card_id, defaults={"score": value}
+        )
+        if not created:
+            TrendingScore.objects.filter(pk=card_id).update(
+                score=log_add(row.score, value)
+            )
+
+
+def liked(card):
+    record(card.id, settings.TRENDING_LIKE_WEIGHT)
+
+
+def commented(comment):
+    record(comment.card_id, settings.TRENDING_COMMENT_WEIGHT)
+
+
+def current(score, moment=None):
+    """The decayed score of a stored one."""
+    return 2 ** (score - half_lives(moment))
+
+
+def floor(moment=None):
+    """The stored score below which a card no longer ranks."""
+    return math.log2(settings.TRENDING_MIN_SCORE) + half_lives(moment)
+
+
+def ranked():
+    """Scores of public trending cards, highest first."""
+    return TrendingScore.objects.filter(
+        score__gte=floor(), card__is_public=True
+    ).order_by("-score", "-card")
+
+
+def prune(moment=None):
+    """Delete the scores that have decayed below TRENDING_MIN_SCORE."""
+    deleted, _ = TrendingScore.objects.filter(score__lt=floor(moment)).delete()
+    return deleted
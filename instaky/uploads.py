@@ -0,0 +1,159 @@
+"""
+Direct-to-storage uploads for card images and profile pictures.
+
+Instead of streaming the bytes through a gunicorn worker, the client asks for
+an upload intent, sends the file straight to storage with the credentials it
+gets back, and then reports completion:
+
+    POST /cards/:id/image_intent/    {"filename", "content_type"}
+        -> {"method", "url", "fields", "token"}
+    (client uploads the file to "url")
+    POST /cards/:id/image_complete/  {"token"}
+
+(and the same two actions on /users/:id/ for profile pictures).
+
+On S3 the intent is a presigned POST whose policy enforces the key, the
+content type and UPLOAD_MAX_BYTES, so the app server never sees the bytes.
+Any other storage (local development, tests) gets a signed PUT URL served by
+LocalUploadView, which stands in for the bucket.
+
+The token is a signed description of the pending upload. Completion checks
+that the object exists and is within the size and content-type limits before
+it is attached to the model and handed to the image pipeline. The object
+keeps its random key until dedupe_images moves it into the content-addressed
+store (see content.py).
+"""
+
+import posixpath
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.core import signing
+from django.core.files.base import ContentFile
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+
+from . import content
+
+SALT = "instaky.uploads"
+
+
+def is_s3(storage):
+    return hasattr(storage, "bucket_name")
+
+
+def check_content_type(content_type):
+    if content_type not in settings.UPLOAD_CONTENT_TYPES:
+        raise ValidationError({"content_type": f"Unsupported type {content_type!r}"})
+
+
+def new_key(field, filename):
+    filename = posixpath.basename(filename or "upload")
+    return posixpath.join(field.upload_to, "uploads", f"{uuid.uuid4().hex}-{filename}")
+
+
+def intent(request, instance, field_name, filename, content_type):
+    """Reserve a storage key for ``instance.<field_name>`` and sign an upload."""
+    check_content_type(content_type)
+    field = instance._meta.get_field(field_name)
+    key = new_key(field, filename)
+    token = signing.dumps(
+        {
+            "model": instance._meta.label,
+            "pk": instance.pk,
+            "field": field_name,
+            "key": key,
+            "content_type": content_type,
+        },
+        salt=SALT,
+    )
+
+    if is_s3(field.storage):
+        target = presigned_post(field.storage, key, content_type)
+    else:
+        target = {
+            "method": "PUT",
+            "url": request.build_absolute_uri(reverse("upload-target", args=[token])),
+            "fields": {},
+        }
+    return {**target, "token": token}
+
+
+def presigned_post(storage, key, content_type):
+    fields = {"Content-Type": content_type}
+    conditions = [
+        {"Content-Type": content_type},
+        ["content-length-range", 1, settings.UPLOAD_MAX_BYTES],
+    ]
+    if storage.default_acl:
+        fields["acl"] = storage.default_acl
+        conditions.append({"acl": storage.default_acl})
+
+    post = storage.bucket.meta.client.generate_presigned_post(
+        Bucket=storage.bucket_name,
+        Key=storage._normalize_name(key),
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=settings.UPLOAD_INTENT_MAX_AGE,
+    )
+    return {"method": "POST", "url": post["url"], "fields": post["fields"]}
+
+
+def unsign(token):
+    try:
+        return signing.loads(token, salt=SALT, max_age=settings.UPLOAD_INTENT_MAX_AGE)
+    except signing.BadSignature:
+        raise ValidationError({"token": "Invalid or expired upload token"})
+
+
+def stat(storage, key):
+    """Return (size, content type) of a stored object."""
+    if is_s3(storage):
+        stored = storage.bucket.Object(storage._normalize_name(key))
+        return stored.content_length, stored.content_type
+    # Local uploads had their type checked by receive().
+    return storage.size(key), None
+
+
+def complete(instance, field_name, token):
+    """Verify a finished upload and attach it to ``instance.<field_name>``."""
+    pending = unsign(token)
+    if (pending["model"], pending["pk"], pending["field"]) != (
+        instance._meta.label,
+        instance.pk,
+        field_name,
+    ):
+        raise ValidationError({"token": "Token is for a different upload"})
+
+    storage = instance._meta.get_field(field_name).storage
+    key = pending["key"]
+    if not storage.exists(key):
+        raise ValidationError({"token": "Nothing has been uploaded yet"})
+
+    size, content_type = stat(storage, key)
+    wrong_type = content_type not in (None, pending["content_type"])
+    if size > settings.UPLOAD_MAX_BYTES or wrong_type:
+        storage.delete(key)
+        raise ValidationError({"token": "Upload is too large or of the wrong type"})
+
+    content.attach_uploaded(instance, field_name, key)
+
+
+def receive(token, body, content_type):
+    """
+    Store a PUT body for a local-storage intent. Only used when the field's
+    storage is not S3; there the client uploads to the bucket directly.
+    """
+    pending = unsign(token)
+    if content_type != pending["content_type"]:
+        raise ValidationError({"content_type": "Does not match the upload intent"})
+    if len(body) > settings.UPLOAD_MAX_BYTES:
+        raise ValidationError({"file": "Upload is too large"})
+
+    model = apps.get_model(pending["model"])
+    storage = model._meta.get_field(pending["field"]).storage
+    if is_s3(storage):
+        raise ValidationError({"token": "Upload directly to storage"})
+    storage.delete(pending["key"])
+    storage.save(pending["key"], ContentFile(body))
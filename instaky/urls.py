@@ -1,6 +1,7 @@
 from django.urls import include, path
 from rest_framework import routers
 
+from . import async_views, metrics
 from . import views as instaky_views
 
 api_router = routers.DefaultRouter()
@@ -12,4 +13,34 @@ api_router.register("users", instaky_views.UserViewSet, basename="user")
 
 urlpatterns = [
     path("", include(api_router.urls)),
+    path(
+        "uploads/chunked/<uuid:pk>/",
+        instaky_views.ChunkedUploadView.as_view(),
+        name="chunked-upload",
+    ),
+    path(
+        "uploads/chunked/<uuid:pk>/complete/",
+        instaky_views.ChunkedUploadCompleteView.as_view(),
+        name="chunked-upload-complete",
+    ),
+    path(
+        "uploads/<str:token>/",
+        instaky_views.LocalUploadView.as_view(),
+        name="upload-target",
+    ),
+    path("export/", instaky_views.ExportView.as_view(), name="export"),
+    path("metrics/", metrics.metrics_view, name="metrics"),
+    path("async/cards/all/", async_views.cards_all, name="async-card-all"),
+    path("async/cards/mine/", async_views.cards_mine, name="async-card-mine"),
+    path(
+        "async/cards/following/",
+        async_views.cards_following,
+        name="async-card-following",
+    ),
+    path("async/users/<int:pk>/", async_views.user_detail, name="async-user-detail"),
+    path(
+        "async/users/<int:pk>/cards/",
+        async_views.user_cards,
+        name="async-user-cards",
+    ),
 ]
\ No newline at end of file
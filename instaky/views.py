@@ -1,39 +1,105 @@
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
+from django.db import router
+from django.http import HttpResponseRedirect
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from rest_framework.decorators import action
-from rest_framework.exceptions import ParseError
+from rest_framework.exceptions import NotFound, ParseError, ValidationError
 from rest_framework.parsers import FileUploadParser, JSONParser
-from rest_framework.permissions import SAFE_METHODS, BasePermission, IsAuthenticated
-from rest_framework.views import Response
+from rest_framework.permissions import (
+    SAFE_METHODS,
+    AllowAny,
+    BasePermission,
+    IsAdminUser,
+    IsAuthenticated,
+)
+from rest_framework.reverse import reverse
+from rest_framework.views import APIView, Response
 from rest_framework.viewsets import ModelViewSet
-from users.models import User
-
-from .models import Card, Comment
+from users.models import Follow, User
+
+from . import (
+    bulk,
+    chunked,
+    content,
+    events,
+    export,
+    feed,
+    previews,
+    replicas,
+    search,
+    sparse,
+    suggestions,
+    timeline,
+    trending,
+    uploads,
+)
+from .cache import cache_response
+from .models import Card, ChunkedUpload, Comment
+from .pagination import (
+    CardCursorPagination,
+    CommentCursorPagination,
+    FollowCursorPagination,
+    SearchPagination,
+    TrendingPagination,
+)
 from .serializers import (
     CardSerializer,
+    CardSummarySerializer,
     CommentSerializer,
-    UserDisplaySerializer,
+    CommentSummarySerializer,
+    FollowerSerializer,
+    FollowingSerializer,
+    SuggestionSerializer,
     UserSerializer,
+    UserSummarySerializer,
 )
-
+from .signals import add_like, related_count
 
 """
 GET	/cards/	-	    list of all cards
 GET	/cards/mine/	-	list of cards you have made	||| could use /cards/?list=mine or something like that
 GET	/cards/all/	-	list of cards for everyone  |||	could use /cards/?list=all
 GET /cards/following/ list of cards from people you follow
+    the three feeds above are cursor paginated: follow "next" (?cursor=...) to load more
+    feeds preview each card's newest comments; ?comments=N changes how many (0 for none)
+GET /cards/:id/comments/  that card's comments, newest first, cursor-paginated
+    any card, comment or user response takes ?fields=id,outer_text,... to return only
+    those fields; ?expand=user (cards, comments) and ?expand=card (comments) nest the
+    related object instead of a name or link
+GET /cards/search/?q=  cards whose text or comments match, best first, paginated (?page=)
+GET /cards/trending/  public cards with the most recent likes and comments, cursor-paginated
+GET /async/cards/{all,mine,following}/, /async/users/:id/, /async/users/:id/cards/
+    the same responses from async views that run their queries concurrently (ASGI only)
+GET /events/?token=  server-sent events: new cards from people you follow, likes and
+    comments on your cards (ASGI only, see events.py)
 
 POST /cards/	    card data	new card        |||  creates a card
+    or a list of cards to create them all at once: {"created": n, "results": [{"id": ...} or
+    {"errors": ...} per card]}, 201 if all were created, 207 if some, 400 if none
 GET	/cards/:id/	-	data for card with specified id	
 PATCH /cards/:id/	card data	updated card    ||| updates the card with specified id
 DELETE /cards/:id/	-	-	                    ||| deletes card with specified id
 POST /cards/:id/image/ add a picture
+POST /cards/:id/image_intent/ get credentials to upload a picture straight to storage (see uploads.py)
+POST /cards/:id/image_complete/ attach a picture uploaded that way
+POST /cards/:id/image_resumable/ start a resumable chunked upload (see chunked.py)
 POST /cards/:id/delete_image/ removes the picture
 POST /cards/:id/like/ likes the card
-
-GET	/users/	-	list of all people	
+GET /cards/:id/preview/ redirects to a PNG of the card's front for link previews and emails
+    (?format=webp for WebP); needs no login for public cards (see previews.py)
+
+GET	/users/	-	list of all people (with card/comment/follower counts)
+GET /users/:id/cards/     that user's cards, cursor-paginated
+GET /users/:id/comments/  that user's comments, cursor-paginated
+GET /users/suggestions/   accounts you might want to follow
+GET /users/:id/followers/ who follows that user, newest first, cursor-paginated
+GET /users/:id/following/ who that user follows, newest first, cursor-paginated
 POST /users/:id/	user by id	user info       ||| add user as a friend
 POST /users/:id/follow/     follows that user
+GET /users/:id/export/    that user's cards, comments and likes as NDJSON (?format=csv
+    for CSV); your own or, for staff, anyone's; GET /export/ for the whole site (staff)
 """
 
 
@@ -48,63 +114,90 @@ class CardMaker(BasePermission):
         return request.user == obj.user
 
 
-class CardViewSet(ModelViewSet):
+class ProfileOwner(BasePermission):
+    def has_permission(self, request, view):
+        return True
+
+    def has_object_permission(self, request, view, obj):
+        if request.method in SAFE_METHODS:
+            return True
+
+        return request.user == obj
+
+
+class CardViewSet(replicas.ReplicaReadsMixin, ModelViewSet):
     serializer_class = CardSerializer
     permission_classes = [
         IsAuthenticated,
         CardMaker,
     ]
     parser_classes = [JSONParser, FileUploadParser]
+    pagination_class = CardCursorPagination
+    summary_actions = ("list", "mine", "all", "following")
 
+    @cache_response(lambda request, pk: [f"card:{pk}"], personal=False)
     def retrieve(self, request, pk):
-        card = (
-            Card.objects.filter(pk=pk)
-            .select_related("user")
-            .prefetch_related(
+        serializer = self.get_serializer()
+        cards = Card.objects.filter(pk=pk)
+        if sparse.is_sparse(request):
+            cards = sparse.narrow(cards, serializer)
+        else:
+            cards = cards.select_related("user").prefetch_related(
                 "liked_by", "comments", "comments__user", "comments__liked_by"
             )
-        ).first()
-        serializer = CardSerializer(card, context={"request": request})
+        serializer.instance = cards.first()
         return Response(serializer.data)
 
     @action(detail=False)
+    @cache_response(lambda request: [f"user-cards:{request.user.id}"])
     def mine(self, request):
-        cards = (
-            Card.objects.filter(user=self.request.user)
-            .select_related("user")
-            .prefetch_related(
-                "liked_by", "comments", "comments__user", "comments__liked_by"
-            )
-            .order_by("-posted_at")
-        )
-        serializer = CardSerializer(cards, many=True, context={"request": request})
-        return Response(serializer.data)
+        return self.feed_response(Card.objects.filter(user=self.request.user))
 
     @action(detail=False)
+    @cache_response(lambda request: ["cards"])
     def all(self, request):
-        cards = (
-            Card.objects.all()
-            .select_related("user")
-            .prefetch_related(
-                "liked_by", "comments", "comments__user", "comments__liked_by"
-            )
-            .order_by("-posted_at")
-        )
-        serializer = CardSerializer(cards, many=True, context={"request": request})
-        return Response(serializer.data)
+        return self.feed_response(Card.objects.all())
 
     @action(detail=False)
     def following(self, request):
-        cards = (
-            Card.objects.filter(user__followers=self.request.user)
-            .select_related("user")
-            .prefetch_related(
-                "liked_by", "comments", "comments__user", "comments__liked_by"
-            )
-            .order_by("-posted_at")
+        entries = timeline.timeline_for(self.request.user).values(
+            "id", "posted_at", "card_id"
+        )
+        page = self.paginate_queryset(entries)
+        return self.get_paginated_response(
+            self.serialize_ids([entry["card_id"] for entry in page])
         )
-        serializer = CardSerializer(cards, many=True, context={"request": request})
-        return Response(serializer.data)
+
+    @action(detail=False)
+    def search(self, request):
+        text = request.query_params.get("q", "").strip()
+        if not text:
+            raise ValidationError({"q": "This query parameter is required."})
+        paginator = SearchPagination()
+        ids = paginator.paginate_queryset(search.Matches(text), request, view=self)
+        return paginator.get_paginated_response(self.serialize_ids(ids))
+
+    @action(detail=False)
+    def trending(self, request):
+        paginator = TrendingPagination()
+        scores = paginator.paginate_queryset(trending.ranked(), request, view=self)
+        ids = [score.card_id for score in scores]
+        return paginator.get_paginated_response(self.serialize_ids(ids))
+
+    @action(detail=True, methods=["GET"])
+    @cache_response(lambda request, pk: [f"card:{pk}"], personal=False)
+    def comments(self, request, pk):
+        card = get_object_or_404(Card.objects.all(), pk=pk)
+        paginator = CommentCursorPagination()
+        page = paginator.paginate_queryset(
+            Comment.objects.filter(card=card).select_related("user"),
+            request,
+            view=self,
+        )
+        serializer = CommentSummarySerializer(
+            page, many=True, context={"request": request}
+        )
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=["POST"])
     def image(self, request, pk, format=None):
@@ -114,120 +207,307 @@ class CardViewSet(ModelViewSet):
         file = request.data["file"]
         card = self.get_object()
 
-        card.image.save(file.name, file, save=True)
+        content.attach(card, "image", file)
+        return Response(status=201)
+
+    @action(detail=True, methods=["POST"])
+    def image_intent(self, request, pk):
+        card = self.get_object()
+        target = uploads.intent(
+            request,
+            card,
+            "image",
+            request.data.get("filename"),
+            request.data.get("content_type"),
+        )
+        return Response(target, status=201)
+
+    @action(detail=True, methods=["POST"])
+    def image_complete(self, request, pk):
+        card = self.get_object()
+        uploads.complete(card, "image", request.data.get("token", ""))
         return Response(status=201)
 
+    @action(detail=True, methods=["POST"])
+    def image_resumable(self, request, pk):
+        card = self.get_object()
+        upload = chunked.start(
+            request.user,
+            card,
+            "image",
+            request.data.get("filename"),
+            request.data.get("content_type"),
+            request.data.get("size"),
+        )
+        return chunked_upload_response(request, upload, status=201)
+
     @action(detail=True, methods=["POST"])
     def delete_image(self, request, pk, format=None):
         queryset = Card.objects.all()
         card = get_object_or_404(queryset, pk=pk)
-        card.image.delete(save=True)
+        content.detach(card, "image")
         return Response(status=204)
 
+    @action(
+        detail=True,
+        methods=["GET"],
+        permission_classes=[AllowAny],
+        renderer_classes=[previews.PNGRenderer, previews.WebPRenderer],
+    )
+    def preview(self, request, pk):
+        card = get_object_or_404(Card.objects.all(), pk=pk)
+        if not card.is_public and card.user != request.user:
+            raise NotFound()
+        url = previews.url(card, request.accepted_renderer.format)
+        response = HttpResponseRedirect(request.build_absolute_uri(url))
+        patch_cache_control(
+            response,
+            public=card.is_public,
+            private=not card.is_public,
+            max_age=settings.PREVIEW_REDIRECT_MAX_AGE,
+        )
+        patch_vary_headers(response, ["Accept"])
+        return response
+
     @action(detail=True, methods=["POST"], permission_classes=[IsAuthenticated])
     def like(self, request, pk):
         card = self.get_object()
-        card.liked_by.add(self.request.user)
-        card.save()
+        if add_like(card, self.request.user):
+            trending.liked(card)
+            events.card_liked(card, self.request.user)
         return Response(status=201)
 
     def get_parser_classes(self):
-        print(self.action)
         if self.action == "image":
             return [FileUploadParser]
 
         return [JSONParser]
 
+    def get_serializer_class(self):
+        if self.action in self.summary_actions:
+            return CardSummarySerializer
+        return CardSerializer
+
     def get_queryset(self):
-        return (
-            Card.objects.all()
-            .select_related("user")
-            .prefetch_related("liked_by", "comments", "comments__user")
-            .order_by("-posted_at")
+        cards = Card.objects.all().order_by("-posted_at")
+        if self.action in self.summary_actions:
+            return cards.select_related("user")
+        if sparse.is_sparse(self.request):
+            return sparse.narrow(cards, self.get_serializer())
+        return cards.select_related("user").prefetch_related(
+            "liked_by", "comments", "comments__user", "comments__liked_by"
+        )
+
+    def list(self, request):
+        return self.feed_response(self.filter_queryset(self.get_queryset()))
+
+    def feed_response(self, cards):
+        serializer = feed.CardFeedSerializer(self.request)
+        page = self.paginate_queryset(serializer.rows(cards))
+        return self.get_paginated_response(serializer.serialize(page))
+
+    def serialize_ids(self, ids):
+        """Feed entries for the cards ``ids``, in that order."""
+        serializer = feed.CardFeedSerializer(self.request)
+        cards = serializer.rows(Card.objects.filter(id__in=ids))
+        rows = {row["id"]: row for row in cards}
+        return serializer.serialize(rows[card_id] for card_id in ids if card_id in rows)
+
+    def perform_update(self, serializer):
+        card = serializer.save()
+        # UpdateModelMixin throws away the prefetched comments after saving,
+        # which would make the response query each comment's likes one by one.
+        serializer.instance = self.get_queryset().get(pk=card.pk)
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        if len(request.data) > settings.BULK_CREATE_MAX_CARDS:
+            raise ValidationError(
+                f"At most {settings.BULK_CREATE_MAX_CARDS} cards per request."
+            )
+        results = bulk.create_cards(
+            [(request.user, data) for data in request.data],
+            self.get_serializer_context(),
         )
+        created = sum("id" in result for result in results)
+        if created == len(results):
+            status = 201
+        elif created:
+            status = 207
+        else:
+            status = 400
+        return Response({"created": created, "results": results}, status=status)
 
     def perform_create(self, serializer):
         if self.request.user.is_authenticated:
-            return serializer.save(user=self.request.user)
+            card = serializer.save(user=self.request.user)
+            timeline.fan_out(card)
+            events.card_created(card)
+            return card
         raise PermissionDenied()
 
 
-class CommentViewSet(ModelViewSet):
+class CommentViewSet(replicas.ReplicaReadsMixin, ModelViewSet):
     serializer_class = CommentSerializer
     permission_classes = [
         IsAuthenticated,
     ]
 
     def get_queryset(self):
-        return (
-            Comment.objects.all()
-            .select_related("user", "card")
-            .prefetch_related("liked_by")
-        )
+        comments = Comment.objects.all()
+        if sparse.is_sparse(self.request):
+            return sparse.narrow(comments, self.get_serializer())
+        return comments.select_related("user", "card").prefetch_related("liked_by")
 
     def perform_create(self, serializer):
         if not self.request.user.is_authenticated:
             raise PermissionDenied()
-        serializer.save(user=self.request.user)
+        comment = serializer.save(user=self.request.user)
+        trending.commented(comment)
+        events.comment_created(comment)
 
     @action(detail=True, methods=["POST"], permission_classes=[IsAuthenticated])
     def like(self, request, pk):
         comment = self.get_object()
         comment.liked_by.add(self.request.user)
-        comment.save()
         return Response(status=201)
 
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(replicas.ReplicaReadsMixin, ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [
         IsAuthenticated,
+        ProfileOwner,
     ]
 
+    summary_actions = ("list", "retrieve", "follow")
+
+    def get_serializer_class(self):
+        if self.action in self.summary_actions:
+            return UserSummarySerializer
+        return UserSerializer
+
     def get_queryset(self):
-        return User.objects.all().prefetch_related("cards", "comments", "followers")
+        users = User.objects.all().order_by("id")
+        sparse_fields = sparse.is_sparse(self.request)
+        if self.action in self.summary_actions:
+            counts = {
+                "card_count": related_count(Card, "user"),
+                "comment_count": related_count(Comment, "user"),
+                "follower_count": related_count(Follow, "followed"),
+                "following_count": related_count(Follow, "follower"),
+            }
+            if sparse_fields:
+                # only the counts that will be shown
+                serializer = self.get_serializer()
+                counts = {
+                    name: count
+                    for name, count in counts.items()
+                    if name in serializer.fields
+                }
+                users = sparse.narrow(users, serializer)
+            return users.annotate(**counts)
+        if sparse_fields:
+            return sparse.narrow(users, self.get_serializer())
+        return users.prefetch_related("cards", "comments", "followers")
 
     @action(detail=True, methods=["GET"])
-    def followers(self, request, pk):
-        followers = (
-            User.objects.filter(pk=pk).prefetch_related("followers").first()
-        ).followers.all()
-        serializer = UserDisplaySerializer(
-            followers, many=True, context={"request": request}
+    @cache_response(lambda request, pk: [f"user-cards:{pk}"])
+    def cards(self, request, pk):
+        person = get_object_or_404(User.objects.all(), pk=pk)
+        serializer = feed.CardFeedSerializer(request)
+        paginator = CardCursorPagination()
+        page = paginator.paginate_queryset(
+            serializer.rows(Card.objects.filter(user=person)), request, view=self
+        )
+        return paginator.get_paginated_response(serializer.serialize(page))
+
+    @action(detail=True, methods=["GET"])
+    def comments(self, request, pk):
+        person = get_object_or_404(User.objects.all(), pk=pk)
+        paginator = CommentCursorPagination()
+        page = paginator.paginate_queryset(
+            Comment.objects.filter(user=person).select_related("user"),
+            request,
+            view=self,
+        )
+        serializer = CommentSummarySerializer(
+            page, many=True, context={"request": request}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=["GET"],
+        url_path="export",
+        url_name="export",
+        renderer_classes=[export.NDJSONRenderer, export.CSVRenderer],
+    )
+    def export_data(self, request, pk):
+        person = get_object_or_404(User.objects.all(), pk=pk)
+        if person != request.user and not request.user.is_staff:
+            raise PermissionDenied()
+        return export.response(
+            request,
+            using=router.db_for_read(Card),
+            user=person,
+            filename=f"{person.username}-export",
+        )
+
+    @action(detail=False, methods=["GET"])
+    def suggestions(self, request):
+        serializer = SuggestionSerializer(
+            suggestions.suggestions_for(request.user),
+            many=True,
+            context={"request": request},
         )
         return Response(serializer.data)
 
+    @action(detail=True, methods=["GET"])
+    def followers(self, request, pk):
+        follows = Follow.objects.filter(followed=pk).select_related("follower")
+        return self.follow_page(follows, FollowerSerializer)
+
     @action(detail=True, methods=["GET"])
     def following(self, request, pk):
-        queryset = User.objects.all()
-        person = get_object_or_404(queryset, pk=pk)
-        following = User.objects.filter(followers=person)
-        serializer = UserDisplaySerializer(
-            following, many=True, context={"request": request}
+        follows = Follow.objects.filter(follower=pk).select_related("followed")
+        return self.follow_page(follows, FollowingSerializer)
+
+    def follow_page(self, follows, serializer_class):
+        paginator = FollowCursorPagination()
+        page = paginator.paginate_queryset(follows, self.request, view=self)
+        serializer = serializer_class(
+            page, many=True, context={"request": self.request}
         )
-        return Response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=["POST"])
     def follow(self, request, pk):
         person = User.objects.filter(pk=pk).first()
-        person.followers.add(self.request.user)
-        serializer = UserSerializer(person, context={"request": request})
+        _, created = Follow.objects.get_or_create(
+            followed=person, follower=self.request.user
+        )
+        if created:
+            timeline.backfill(self.request.user, person)
+            suggestions.followed(self.request.user, person)
+        serializer = self.get_serializer(self.get_queryset().get(pk=person.pk))
         return Response(serializer.data)
 
     @action(detail=True, methods=["POST"])
     def unfollow(self, request, pk):
         person = User.objects.filter(pk=pk).first()
-        person.followers.remove(self.request.user)
-        person.save()
+        deleted, _ = Follow.objects.filter(
+            followed=person, follower=self.request.user
+        ).delete()
+        if deleted:
+            timeline.prune(self.request.user, person)
+            suggestions.unfollowed(self.request.user, person)
         return Response(status=204)
 
     def retrieve(self, request, pk):
-        user = (
-            User.objects.filter(pk=pk)
-            .prefetch_related("cards", "comments", "followers")
-            .first()
-        )
-        serializer = UserSerializer(user, context={"request": request})
+        user = get_object_or_404(self.get_queryset(), pk=pk)
+        serializer = self.get_serializer(user)
         return Response(serializer.data)
 
     @action(detail=True, methods=["POST", "PUT"])
@@ -238,12 +518,114 @@ class UserViewSet(ModelViewSet):
         file = request.data["file"]
         user = self.get_object()
 
-        user.profile_picture.save(file.name, file, save=True)
+        content.attach(user, "profile_picture", file)
         return Response(status=201)
 
+    @action(detail=True, methods=["POST"])
+    def image_intent(self, request, pk):
+        user = self.get_object()
+        target = uploads.intent(
+            request,
+            user,
+            "profile_picture",
+            request.data.get("filename"),
+            request.data.get("content_type"),
+        )
+        return Response(target, status=201)
+
+    @action(detail=True, methods=["POST"])
+    def image_complete(self, request, pk):
+        user = self.get_object()
+        uploads.complete(user, "profile_picture", request.data.get("token", ""))
+        return Response(status=201)
+
+    @action(detail=True, methods=["POST"])
+    def image_resumable(self, request, pk):
+        user = self.get_object()
+        upload = chunked.start(
+            request.user,
+            user,
+            "profile_picture",
+            request.data.get("filename"),
+            request.data.get("content_type"),
+            request.data.get("size"),
+        )
+        return chunked_upload_response(request, upload, status=201)
+
     @action(detail=True, methods=["POST"])
     def delete_image(self, request, pk, format=None):
-        queryset = User.objects.all()
-        user = get_object_or_404(queryset, pk=pk)
-        user.profile_picture.delete(save=True)
-        return Response(status=204)
\ No newline at end of file
+        user = self.get_object()
+        content.detach(user, "profile_picture")
+        return Response(status=204)
+
+
+class ExportView(replicas.ReplicaReadsMixin, APIView):
+    permission_classes = [IsAdminUser]
+    renderer_classes = [export.NDJSONRenderer, export.CSVRenderer]
+
+    def get(self, request):
+        return export.response(request, using=router.db_for_read(Card))
+
+
+def chunked_upload_response(request, upload, status=200):
+    url = reverse("chunked-upload", args=[upload.id], request=request)
+    response = Response(
+        {"id": upload.id, "url": url, "offset": upload.offset, "size": upload.size},
+        status=status,
+    )
+    response["Upload-Offset"] = upload.offset
+    return response
+
+
+class ChunkedUploadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, pk):
+        return get_object_or_404(ChunkedUpload, pk=pk, user=request.user)
+
+    def get(self, request, pk):
+        return chunked_upload_response(request, self.get_upload(request, pk))
+
+    def put(self, request, pk):
+        upload = self.get_upload(request, pk)
+        try:
+            length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            raise ParseError("Invalid Content-Length")
+        try:
+            upload = chunked.append(
+                upload,
+                request.META.get("HTTP_UPLOAD_OFFSET"),
+                request.META.get("HTTP_UPLOAD_CHECKSUM"),
+                request.stream,
+                length,
+            )
+        except chunked.OffsetConflict as conflict:
+            # tell the client where to resume from
+            return chunked_upload_response(request, conflict.upload, status=409)
+        return chunked_upload_response(request, upload)
+
+    def delete(self, request, pk):
+        chunked.discard(self.get_upload(request, pk))
+        return Response(status=204)
+
+
+class ChunkedUploadCompleteView(ChunkedUploadView):
+    def post(self, request, pk):
+        chunked.finish(self.get_upload(request, pk))
+        return Response(status=201)
+
+
+class LocalUploadView(APIView):
+    """
+    Stand-in for the S3 bucket when images are stored locally: accepts the
+    PUT that an upload intent points at. Authorised by the signed token in
+    the URL, like a presigned S3 request.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def put(self, request, token):
+        uploads.receive(token, request.body, request.content_type)
+        return Response(status=204)
@@ -9,8 +9,68 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
 from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.urls import Resolver404, resolve
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imports models, so only once the app registry is ready.
+from instaky import events  # noqa: E402
+
+# Exports stream rows from the ORM as the response is sent (see export.py).
+# Django's ASGI handler iterates a streaming response on the event loop, where
+# the ORM refuses to run, or, on newer Django, reads it all into memory first.
+# The WSGI handler streams it from a thread, as under gunicorn's sync workers.
+EXPORT_URL_NAMES = {"export", "user-export"}
+
+
+class ExportInstance(WsgiToAsgiInstance):
+    # Newer asgiref runs the WSGI app thread-sensitively, on the one thread
+    # every sync view of the worker shares, which a long export (or a slow
+    # client) would hold for as long as it streams. Give each its own.
+    run_wsgi_app = sync_to_async(
+        WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False
+    )
+
+
+class ExportWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ExportInstance(self.wsgi_application)(scope, receive, send)
+
+
+def closing(wsgi_application):
+    """Close responses once sent, as WSGI servers do and WsgiToAsgi does not."""
+
+    def wrapper(environ, start_response):
+        response = wsgi_application(environ, start_response)
+        try:
+            yield from response
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+
+    return wrapper
+
+
+export_application = ExportWsgiToAsgi(closing(get_wsgi_application()))
+
+
+def is_export(path):
+    try:
+        return resolve(path).url_name in EXPORT_URL_NAMES
+    except Resolver404:
+        return False
+
+
+async def application(scope, receive, send):
+    # Server-sent events stream outside Django's request cycle (see events.py).
+    if scope["type"] == "http" and scope["path"] == "/events/":
+        return await events.stream(scope, receive, send)
+    if scope["type"] == "http" and is_export(scope["path"]):
+        return await export_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 import environ
@@ -58,10 +59,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "instaky.metrics.MetricsMiddleware",
+    "instaky.compression.CompressionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.BrokenLinkEmailsMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -71,6 +73,14 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# The toolbar wraps every query; keep it out of production
+DEBUG_TOOLBAR = env.bool("DEBUG_TOOLBAR", default=DEBUG)
+if DEBUG_TOOLBAR:
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index("django.middleware.common.CommonMiddleware") + 1,
+        "debug_toolbar.middleware.DebugToolbarMiddleware",
+    )
+
 # CORS settings
 CORS_ORIGIN_ALLOW_ALL = True
 from corsheaders.defaults import default_headers
@@ -168,6 +178,21 @@ django_heroku.settings(locals())
 del DATABASES["default"]["OPTIONS"]["sslmode"]
 
 
+# Read replicas (see instaky/replicas.py): DATABASE_REPLICA_URLS is a
+# comma-separated list of database URLs, added as "replica1", "replica2", ...
+DATABASE_REPLICAS = []
+for number, url in enumerate(env.list("DATABASE_REPLICA_URLS", default=[]), 1):
+    DATABASES[f"replica{number}"] = {
+        **env.db_url_config(url),
+        "CONN_MAX_AGE": DATABASES["default"].get("CONN_MAX_AGE", 0),
+    }
+    DATABASE_REPLICAS.append(f"replica{number}")
+DATABASE_ROUTERS = ["instaky.replicas.ReplicaRouter"]
+REPLICA_LAG_SECONDS = env.float("REPLICA_LAG_SECONDS", default=5.0)
+REPLICA_CACHE_ALIAS = "default"
+# The test suite runs with project.test_settings, which adds a stand-in replica.
+
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.TokenAuthentication",
@@ -176,6 +201,12 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "instaky.renderers.FastJSONRenderer",
+        "instaky.renderers.MessagePackRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_CONTENT_NEGOTIATION_CLASS": "instaky.renderers.ContentNegotiation",
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 5,
 }
@@ -183,6 +214,7 @@ REST_FRAMEWORK = {
 
 MEDIA_URL = "/media/"
 MEDIA_DIR = BASE_DIR / "media"
+MEDIA_ROOT = MEDIA_DIR
 
 
 # AWS settings
@@ -195,4 +227,141 @@ AWS_S3_OBJECT_PARAMETERS = {
 }
 AWS_S3_FILE_OVERWRITE = False
 AWS_DEFAULT_ACL = "public-read"
-DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
+DEFAULT_FILE_STORAGE = env(
+    "FILE_STORAGE", default="instaky.storage.ContentAddressedS3Storage"
+)
+CONTENT_ADDRESSED_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+# Following-feed timelines
+TIMELINE_FANOUT_MAX_FOLLOWERS = 10000
+TIMELINE_HIGH_FANOUT_CACHE_SECONDS = 300
+TIMELINE_BACKFILL_SIZE = 200
+TIMELINE_PULL_OVERLAP_SECONDS = 60
+TIMELINE_REBUILD_SIZE = 1000
+TIMELINE_BATCH_SIZE = 1000
+
+
+# Comment previews in card feeds (see instaky/comments.py)
+FEED_COMMENT_PREVIEW = 3
+FEED_COMMENT_PREVIEW_MAX = 20
+
+
+# Follow suggestions
+SUGGESTIONS_SIZE = 50
+SUGGESTIONS_POPULAR_POOL = 200
+SUGGESTIONS_POPULAR_WEIGHT = 2.0
+SUGGESTIONS_CACHE_SECONDS = 60 * 60
+SUGGESTIONS_BATCH_SIZE = 500
+
+
+# Trending cards (see instaky/trending.py)
+TRENDING_HALF_LIFE_HOURS = 12
+TRENDING_LIKE_WEIGHT = 1.0
+TRENDING_COMMENT_WEIGHT = 2.0
+TRENDING_MIN_SCORE = 0.05
+
+
+# Full-text search; must match the configuration of the triggers installed
+# by instaky migration 0011.
+SEARCH_CONFIG = "english"
+SEARCH_RANK_WINDOW = 10000
+
+
+# Async feed endpoints (see instaky/async_views.py): run a request's
+# independent queries in worker threads of their own
+ASYNC_CONCURRENT_QUERIES = env.bool("ASYNC_CONCURRENT_QUERIES", default=True)
+
+
+# Server-sent events (see instaky/events.py)
+EVENTS_BROKER = env("EVENTS_BROKER", default="instaky.events.LocalBroker")
+EVENTS_CHANNEL = "instaky_events"
+EVENTS_QUEUE_SIZE = 100
+EVENTS_KEEPALIVE_SECONDS = 15
+EVENTS_RECONNECT_SECONDS = 5
+
+
+# Bulk card creation (see instaky/bulk.py): cards per POST /cards/ and rows
+# per INSERT
+BULK_CREATE_MAX_CARDS = 1000
+BULK_CREATE_BATCH_SIZE = 500
+
+
+# Bulk exports (see instaky/export.py)
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_BYTES = 64 * 1024
+
+
+# Caching
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+FEED_CACHE_ALIAS = "default"
+FEED_CACHE_TIMEOUT = 300
+
+
+# Response compression (see instaky/compression.py)
+COMPRESSION_MIN_BYTES = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+COMPRESSION_CONTENT_TYPES = [
+    "application/json",
+    "application/msgpack",
+    "text/html",
+    "text/plain",
+    "text/csv",
+]
+
+
+# Image derivatives
+IMAGE_PIPELINE_ASYNC = True
+IMAGE_PIPELINE_WORKERS = 2
+IMAGE_VARIANT_WIDTHS = [320, 640, 1080]
+IMAGE_VARIANT_FORMATS = ["jpeg", "webp", "avif"]
+IMAGE_VARIANT_QUALITY = 80
+
+
+# Card previews (see instaky/previews.py); PREVIEW_FONTS maps font_family and
+# font_style to font files, looked up in the system's font directories
+PREVIEW_SIZE = (1200, 630)
+PREVIEW_RENDER_PROCESSES = env.int("PREVIEW_RENDER_PROCESSES", default=2)
+PREVIEW_RENDER_TIMEOUT = 10
+PREVIEW_CACHE_SECONDS = 24 * 60 * 60
+PREVIEW_REDIRECT_MAX_AGE = 60
+PREVIEW_FONTS = {
+    "SS": {
+        "N": "DejaVuSans.ttf",
+        "I": "DejaVuSans-Oblique.ttf",
+        "B": "DejaVuSans-Bold.ttf",
+    },
+    "SE": {
+        "N": "DejaVuSerif.ttf",
+        "I": "DejaVuSerif-Italic.ttf",
+        "B": "DejaVuSerif-Bold.ttf",
+    },
+}
+
+
+# Direct uploads
+UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+UPLOAD_CONTENT_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+UPLOAD_INTENT_MAX_AGE = 60 * 60
+# Spool files of unfinished chunked uploads (see instaky/chunked.py). Must be
+# shared by every worker, e.g. a mounted volume: a chunk that reaches a worker
+# without the file restarts the upload from offset 0.
+CHUNKED_UPLOAD_DIR = env(
+    "CHUNKED_UPLOAD_DIR", default=os.path.join(tempfile.gettempdir(), "instaky-uploads")
+)
+CHUNKED_UPLOAD_MAX_AGE = 24 * 60 * 60
+
+
+# Request metrics
+METRICS_CACHE_ALIAS = "default"
+METRICS_FLUSH_SECONDS = 10
+METRICS_WORKER_TIMEOUT = 5 * 60
+# Bearer token /metrics/ requires. Unset, the endpoint refuses every request
+# unless DEBUG is on.
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+METRICS_QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200]
+METRICS_SIZE_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+SLOW_REQUEST_SECONDS = env.float("SLOW_REQUEST_SECONDS", default=1.0)
+SLOW_REQUEST_LOGGED_QUERIES = 10
@@ -0,0 +1,19 @@
+"""
+Settings for the test suite:
+
+    DJANGO_SETTINGS_MODULE=project.test_settings python manage.py test
+
+or ``python manage.py test --settings=project.test_settings``.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+# A second local database standing in for a replica. It is only read from
+# where a test lists it in DATABASE_REPLICAS.
+if "replica1" not in DATABASES:
+    DATABASES["replica1"] = dict(DATABASES["default"])
+    if DATABASES["replica1"]["ENGINE"] != "django.db.backends.sqlite3":
+        DATABASES["replica1"]["TEST"] = {
+            "NAME": f"test_{DATABASES['default']['NAME']}_replica"
+        }
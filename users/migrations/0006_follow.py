@@ -0,0 +1,88 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Turn the auto-created User.followers table into the explicit Follow model
+    in place: the model is declared over the existing table and columns, so
+    no rows are copied. Follows that predate created_at are stamped with the
+    time of the migration.
+    """
+
+    dependencies = [
+        ("users", "0005_image_variants"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="Follow",
+                    fields=[
+                        (
+                            "id",
+                            models.AutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "followed",
+                            models.ForeignKey(
+                                db_column="from_user_id",
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="+",
+                                to=settings.AUTH_USER_MODEL,
+                            ),
+                        ),
+                        (
+                            "follower",
+                            models.ForeignKey(
+                                db_column="to_user_id",
+                                on_delete=django.db.models.deletion.CASCADE,
+                                related_name="+",
+                                to=settings.AUTH_USER_MODEL,
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "users_user_followers",
+                        "unique_together": {("followed", "follower")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="user",
+                    name="followers",
+                    field=models.ManyToManyField(
+                        related_name="following",
+                        through="users.Follow",
+                        through_fields=("followed", "follower"),
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            database_operations=[],
+        ),
+        migrations.AddField(
+            model_name="follow",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(
+                fields=["followed", "-created_at", "-id"], name="follow_followers_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(
+                fields=["follower", "-created_at", "-id"], name="follow_following_idx"
+            ),
+        ),
+    ]
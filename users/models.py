@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 
 # Consider creating a custom user model from scratch as detailed at
 # https://docs.djangoproject.com/en/3.0/topics/auth/customizing/#specifying-a-custom-user-model
@@ -7,7 +8,47 @@ from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
     followers = models.ManyToManyField(
-        "self", related_name="following", symmetrical=False
+        "self",
+        related_name="following",
+        symmetrical=False,
+        through="Follow",
+        through_fields=("followed", "follower"),
     )
 
     profile_picture = models.ImageField(upload_to="post_images/", null=True, blank=True)
+
+    profile_picture_width = models.PositiveIntegerField(null=True, editable=False)
+
+    profile_picture_height = models.PositiveIntegerField(null=True, editable=False)
+
+    profile_picture_variants = models.JSONField(default=list, editable=False)
+
+
+class Follow(models.Model):
+    """
+    ``follower`` follows ``followed``. This is the through table of
+    User.followers; the columns keep the names of the table Django generated
+    for it before the model existed.
+    """
+
+    followed = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", db_column="from_user_id"
+    )
+
+    follower = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", db_column="to_user_id"
+    )
+
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "users_user_followers"
+        unique_together = [("followed", "follower")]
+        indexes = [
+            models.Index(
+                fields=["followed", "-created_at", "-id"], name="follow_followers_idx"
+            ),
+            models.Index(
+                fields=["follower", "-created_at", "-id"], name="follow_following_idx"
+            ),
+        ]